@@ -0,0 +1,143 @@
+"""Admisión de mensajes del bot antes de consultar OpenWeatherMap.
+
+- Límite por chat (token bucket): un chat que inunda al bot no gasta la cuota de
+  todos; el primer mensaje rechazado recibe un aviso y el resto se ignora.
+- Consultas de ciudad simultáneas limitadas para todo el bot.
+- La misma ciudad pedida por varios chats a la vez se consulta una sola vez: los
+  demás esperan el mismo resultado.
+- Lo consultado hace poco se recuerda unos segundos y se responde al instante.
+
+Todo vive en el event loop del bot, así que no hace falta ningún lock.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+from metricas import registro
+
+MENSAJES_MINUTO = float(os.getenv('BOT_MENSAJES_MINUTO', 12))  # por chat
+RAFAGA = float(os.getenv('BOT_RAFAGA_CHAT', 4))
+CONSULTAS_SIMULTANEAS = int(os.getenv('BOT_CONSULTAS_SIMULTANEAS', 16))
+MEMORIA = float(os.getenv('BOT_MEMORIA_RESPUESTAS', 60))  # segundos; 0 desactiva
+MAX_CHATS = 10000
+MAX_MEMORIA = 1000
+
+mensajes_limitados = registro.contador('bot_mensajes_limitados_total',
+                                       'Mensajes descartados por el límite por chat')
+consultas_evitadas = registro.contador(
+    'bot_consultas_evitadas_total', 'Consultas de ciudad resueltas sin volver a llamar a OpenWeatherMap',
+    ('motivo',))
+
+
+class Admision:
+    """Límite por chat, límite global de consultas, deduplicación y memoria corta."""
+
+    def __init__(self, por_minuto: float = MENSAJES_MINUTO, rafaga: float = RAFAGA,
+                 simultaneas: int = CONSULTAS_SIMULTANEAS, memoria: float = MEMORIA):
+        self.tasa = por_minuto / 60.0
+        self.capacidad = max(rafaga, 1.0)
+        self.memoria = memoria
+        self._cubos = OrderedDict()  # chat -> [tokens, último relleno, avisado]
+        self._semaforo = asyncio.Semaphore(simultaneas)
+        self._en_curso = {}  # clave -> Future con el resultado de la consulta
+        self._recientes = OrderedDict()  # clave -> (resultado, caduca)
+        self.en_espera = 0  # consultas esperando hueco del límite global
+
+    # --- límite por chat ---
+
+    def admitir(self, chat) -> float:
+        """0 si el mensaje de `chat` pasa; si no, segundos hasta que vuelva a haber hueco."""
+        if chat is None:
+            return 0.0
+        ahora = time.monotonic()
+        cubo = self._cubos.pop(chat, None) or [self.capacidad, ahora, False]
+        self._cubos[chat] = cubo  # al final: el menos reciente es el primero en salir
+        if len(self._cubos) > MAX_CHATS:
+            self._cubos.popitem(last=False)
+        cubo[0] = min(self.capacidad, cubo[0] + (ahora - cubo[1]) * self.tasa)
+        cubo[1] = ahora
+        if cubo[0] >= 1:
+            cubo[0] -= 1
+            cubo[2] = False
+            return 0.0
+        mensajes_limitados.inc()
+        return (1 - cubo[0]) / self.tasa
+
+    def avisar(self, chat) -> bool:
+        """True la primera vez que se limita a `chat` desde su último mensaje admitido."""
+        cubo = self._cubos.get(chat)
+        if cubo is None or cubo[2]:
+            return False
+        cubo[2] = True
+        return True
+
+    # --- consultas compartidas ---
+
+    def recordada(self, clave: str):
+        """Resultado consultado hace menos de `memoria` segundos, o None."""
+        entrada = self._recientes.get(clave)
+        if entrada is None:
+            return None
+        if time.monotonic() >= entrada[1]:
+            del self._recientes[clave]
+            return None
+        return entrada[0]
+
+    async def resolver(self, clave: str, consultar, recordar=lambda resultado: True):
+        """Resultado de `await consultar()` para `clave`, consultando una sola vez.
+
+        Devuelve `(resultado, origen)`: 'memoria' si se consultó hace poco, 'compartida'
+        si otra petición ya lo estaba consultando o 'consulta'. Sólo se recuerdan los
+        resultados para los que `recordar(resultado)` es cierto.
+        """
+        resultado = self.recordada(clave)
+        if resultado is not None:
+            consultas_evitadas.inc(motivo='memoria')
+            return resultado, 'memoria'
+        futuro = self._en_curso.get(clave)
+        if futuro is not None:
+            try:
+                resultado = await asyncio.shield(futuro)
+            except asyncio.CancelledError:
+                if not futuro.cancelled():
+                    raise  # la cancelada es esta petición
+                # Se canceló la que consultaba: lo intenta esta
+                return await self.resolver(clave, consultar, recordar)
+            consultas_evitadas.inc(motivo='compartida')
+            return resultado, 'compartida'
+
+        futuro = self._en_curso[clave] = asyncio.get_running_loop().create_future()
+        try:
+            self.en_espera += 1
+            try:
+                await self._semaforo.acquire()
+            finally:
+                self.en_espera -= 1
+            try:
+                resultado = await consultar()
+            finally:
+                self._semaforo.release()
+        except asyncio.CancelledError:
+            futuro.cancel()
+            raise
+        except Exception as error:
+            futuro.set_exception(error)
+            futuro.exception()  # que asyncio no avise si nadie más lo esperaba
+            raise
+        finally:
+            del self._en_curso[clave]
+        if self.memoria > 0 and recordar(resultado):
+            self._recientes.pop(clave, None)
+            self._recientes[clave] = (resultado, time.monotonic() + self.memoria)
+            if len(self._recientes) > MAX_MEMORIA:
+                self._recientes.popitem(last=False)
+        futuro.set_result(resultado)
+        return resultado, 'consulta'
+
+    @property
+    def en_curso(self) -> int:
+        return len(self._en_curso)
+
+    def __len__(self):
+        return len(self._recientes)
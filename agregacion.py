@@ -0,0 +1,574 @@
+"""Agregación vectorizada (NumPy) del forecast 3h en resúmenes diarios.
+
+Convierte los slots de `list` de una o muchas ciudades en arrays columnares en una
+sola pasada y calcula con operaciones de grupo lo que `resumen_diario` hace ítem a
+ítem: agrupación por día local, medias, mín/máx, pop máxima, precipitación,
+descripción representativa de mediodía y media circular del viento.
+
+La salida es idéntica (mismos valores y tipos) a la de la versión por bucles
+(`resumen_diario`), que se mantiene como referencia.
+
+Para peticiones sueltas y lotes que llegan ciudad a ciudad está `ResumenIncremental`:
+consume los slots de uno en uno (p.ej. los que va sacando `leer_forecast` del cuerpo
+de la respuesta) y sólo guarda acumuladores por día, sin listas intermedias.
+"""
+import json
+import math
+import re
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import numpy as np
+
+from metricas import latencia_agregacion, medido
+
+SEGUNDOS_DIA = 86400
+NAN = float('nan')
+
+
+def _fila(it):
+    """Slot -> tupla numérica; NaN marca lo que falta (sin 'main', sin 'wind', sin 'deg')."""
+    main = it.get('main')
+    wind = it.get('wind')
+    precip = 0.0
+    if 'rain' in it:
+        precip += it['rain'].get('3h', 0)
+    if 'snow' in it:
+        precip += it['snow'].get('3h', 0)
+    return (
+        it['dt'],
+        main['temp'] if main is not None else NAN,
+        main.get('temp_min') if main is not None else NAN,
+        main.get('temp_max') if main is not None else NAN,
+        it.get('pop', 0),
+        wind.get('speed', 0) if wind is not None else NAN,
+        wind.get('deg') if wind is not None else NAN,
+        precip,
+    )
+
+
+class _Columnas:
+    """Slots de todas las ciudades como arrays (uno por campo) + valores originales.
+
+    Es la única parte que recorre dicts: una comprensión para los campos numéricos
+    (con atajo para slots completos, los habituales de OWM) y otra para `weather`.
+    """
+
+    def __init__(self, forecasts):
+        self.tz = [fj.get('city', {}).get('timezone', 0) if fj else 0 for fj in forecasts]
+        listas = [(fj.get('list') if fj else None) or [] for fj in forecasts]
+        items = [it for lista in listas for it in lista]
+        n_por_ciudad = [len(lista) for lista in listas]
+        self.n = len(items)
+        self.ciudad = np.repeat(np.arange(len(listas), dtype=np.int64), n_por_ciudad)
+
+        try:
+            filas = [
+                (it['dt'], (m := it['main'])['temp'], m['temp_min'], m['temp_max'], it.get('pop', 0),
+                 (w := it['wind'])['speed'], w.get('deg'),
+                 (it['rain'].get('3h', 0) if 'rain' in it else 0.0)
+                 + (it['snow'].get('3h', 0) if 'snow' in it else 0.0))
+                for it in items
+            ]
+        except (KeyError, TypeError, AttributeError):
+            filas = [_fila(it) for it in items]
+        # Valores Python originales: min/max/pop se devuelven tal cual venían (int o float)
+        self.filas = filas
+        datos = np.array(filas, dtype=np.float64).reshape(self.n, 8)
+
+        self.dt = datos[:, 0].astype(np.int64)
+        self.local = self.dt + np.repeat(np.array(self.tz, dtype=np.int64), n_por_ciudad)
+        self.temp, self.tmin, self.tmax, self.pop = datos[:, 1], datos[:, 2], datos[:, 3], datos[:, 4]
+        self.tiene_main = ~np.isnan(self.temp)
+        self.speed, self.grados, self.precip = datos[:, 5], datos[:, 6], datos[:, 7]
+        self.tiene_viento = ~np.isnan(self.speed)
+        self.tiene_grados = ~np.isnan(self.grados)
+
+        w0s = [w[0] if (w := it.get('weather')) else None for it in items]
+        self.tiene_weather = np.array([w is not None for w in w0s], dtype=bool)
+        self.desc = [w.get('description', '') if w is not None else '' for w in w0s]
+        self.icono = [w.get('icon') if w is not None else None for w in w0s]
+        codigos = {}
+        self.desc_codigo = np.array([codigos.setdefault(d, len(codigos)) for d in self.desc], dtype=np.int64)
+
+
+def _matriz(valores, grupo, pos, forma, relleno):
+    """Coloca `valores` en una matriz (grupos x slots del día) rellenando huecos."""
+    m = np.full(forma, relleno, dtype=valores.dtype)
+    m[grupo, pos] = valores
+    return m
+
+
+def _suma_secuencial(m):
+    """Suma por filas en el mismo orden que `sum()` de Python (izquierda a derecha).
+
+    `np.sum` usa suma por pares y puede diferir en el último bit; al redondear a un
+    decimal eso cambiaría la salida respecto a la versión por bucles.
+    """
+    acc = m[:, 0].copy()
+    for j in range(1, m.shape[1]):
+        acc += m[:, j]
+    return acc
+
+
+def agregar(forecasts, max_days=5):
+    """Agrega muchas ciudades a la vez; devuelve dict de arrays por grupo (ciudad, día).
+
+    Útil para informes por lotes sin pasar por dicts; `resumen_diario_lote` lo
+    convierte al formato de la UI.
+    """
+    col = _Columnas(forecasts)
+    if col.n == 0:
+        return None
+
+    dia = col.local // SEGUNDOS_DIA
+    orden = np.lexsort((dia, col.ciudad))  # estable: respeta el orden original dentro del día
+    c_ord, d_ord = col.ciudad[orden], dia[orden]
+    nuevo = np.empty(col.n, dtype=bool)
+    nuevo[0] = True
+    nuevo[1:] = (c_ord[1:] != c_ord[:-1]) | (d_ord[1:] != d_ord[:-1])
+    inicios = np.flatnonzero(nuevo)
+    grupo = np.cumsum(nuevo) - 1
+    cuentas = np.diff(np.append(inicios, col.n))
+    pos = np.arange(col.n) - inicios[grupo]
+    forma = (len(inicios), int(cuentas.max()))
+
+    # Sólo los primeros `max_days` días de cada ciudad
+    ciudad_grupo = c_ord[inicios]
+    nueva_ciudad = np.empty(len(inicios), dtype=bool)
+    nueva_ciudad[0] = True
+    nueva_ciudad[1:] = ciudad_grupo[1:] != ciudad_grupo[:-1]
+    primer_grupo = np.flatnonzero(nueva_ciudad)
+    rango = np.arange(len(inicios)) - primer_grupo[np.cumsum(nueva_ciudad) - 1]
+    elegidos = rango < max_days
+
+    def mat(arr, relleno):
+        return _matriz(arr[orden], grupo, pos, forma, relleno)
+
+    con_main = mat(col.tiene_main, False)
+    n_main = con_main.sum(axis=1)
+    suma_temp = _suma_secuencial(mat(np.where(col.tiene_main, col.temp, 0.0), 0.0))
+    # argmin/argmax devuelven la primera aparición, igual que min()/max() de Python
+    pos_min = np.argmin(mat(np.where(col.tiene_main, col.tmin, np.inf), np.inf), axis=1)
+    pos_max = np.argmax(mat(np.where(col.tiene_main, col.tmax, -np.inf), -np.inf), axis=1)
+    pos_pop = np.argmax(mat(col.pop, -np.inf), axis=1)
+
+    con_viento = mat(col.tiene_viento, False)
+    n_viento = con_viento.sum(axis=1)
+    suma_speed = _suma_secuencial(mat(np.where(col.tiene_viento, col.speed, 0.0), 0.0))
+    con_grados = mat(col.tiene_grados, False)
+    rad = np.radians(np.where(col.tiene_grados, col.grados, 0.0))
+    suma_sin = _suma_secuencial(mat(np.where(col.tiene_grados, np.sin(rad), 0.0), 0.0))
+    suma_cos = _suma_secuencial(mat(np.where(col.tiene_grados, np.cos(rad), 0.0), 0.0))
+    precip = _suma_secuencial(mat(col.precip, 0.0))
+
+    # Descripción representativa: primer slot de 11-13 h con `weather`
+    hora = (col.local % SEGUNDOS_DIA) // 3600
+    mediodia = mat((hora >= 11) & (hora <= 13) & col.tiene_weather, False)
+    hay_mediodia = mediodia.any(axis=1)
+    pos_mediodia = np.argmax(mediodia, axis=1)
+    # ...y si no, la más frecuente (empates: la que aparece antes)
+    codigos = mat(col.desc_codigo, -1)
+    frecuencia = (codigos[:, :, None] == codigos[:, None, :]).sum(axis=2)
+    frecuencia[codigos < 0] = -1
+    pos_frecuente = np.argmax(frecuencia, axis=1)
+
+    return {
+        'ciudad': ciudad_grupo,
+        'elegidos': elegidos,
+        'orden': orden,
+        'inicios': inicios,
+        'cuentas': cuentas,
+        'dt': col.dt[orden][inicios],
+        'n_main': n_main,
+        'suma_temp': suma_temp,
+        'pos_min': pos_min,
+        'pos_max': pos_max,
+        'pos_pop': pos_pop,
+        'n_viento': n_viento,
+        'suma_speed': suma_speed,
+        'n_grados': con_grados.sum(axis=1),
+        'suma_sin': suma_sin,
+        'suma_cos': suma_cos,
+        'precip': precip,
+        'hay_mediodia': hay_mediodia,
+        'pos_mediodia': pos_mediodia,
+        'pos_frecuente': pos_frecuente,
+        'columnas': col,
+        'num_ciudades': len(col.tz),
+    }
+
+
+def _redondear(valores, decimales):
+    """`round()` de Python vectorizado: `np.rint` salvo en los casi-empates, que se
+    resuelven con `round()` para obtener exactamente el mismo float."""
+    escala = 10.0 ** decimales
+    y = valores * escala
+    resultado = (np.rint(y) / escala).tolist()
+    with np.errstate(invalid='ignore'):
+        dudosos = np.flatnonzero(np.abs(y - np.floor(y) - 0.5) < 1e-6)
+    for i in dudosos.tolist():
+        resultado[i] = round(float(valores[i]), decimales)
+    return resultado
+
+
+@medido(latencia_agregacion, paso='resumen_diario_lote')
+def resumen_diario_lote(forecasts, max_days=5):
+    """Resumen diario de muchas ciudades: una lista (formato UI) por forecast de entrada."""
+    forecasts = list(forecasts)
+    resultado = [[] for _ in forecasts]
+    g = agregar(forecasts, max_days=max_days)
+    if g is None:
+        return resultado
+
+    col = g['columnas']
+    filas, desc, icono = col.filas, col.desc, col.icono
+    elegidos = np.flatnonzero(g['elegidos'])
+    orden = g['orden']
+    inicios = g['inicios'][elegidos]
+
+    def slot(pos):
+        """Índice (en el orden original) del slot `pos` de cada día elegido."""
+        return orden[inicios + pos[elegidos]].tolist()
+
+    n_main = g['n_main'][elegidos]
+    n_viento = g['n_viento'][elegidos]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t_day = _redondear(g['suma_temp'][elegidos] / n_main, 1)
+        w_speed = _redondear(g['suma_speed'][elegidos] / n_viento, 1)
+    k_min, k_max, k_pop = slot(g['pos_min']), slot(g['pos_max']), slot(g['pos_pop'])
+    t_min = _redondear(col.tmin[k_min], 1)
+    t_max = _redondear(col.tmax[k_max], 1)
+    k_mediodia, k_frecuente = slot(g['pos_mediodia']), slot(g['pos_frecuente'])
+    k_centro = slot(g['cuentas'] // 2)
+    hay_mediodia = g['hay_mediodia'][elegidos].tolist()
+    n_grados = g['n_grados'][elegidos].tolist()
+    suma_sin, suma_cos = g['suma_sin'][elegidos].tolist(), g['suma_cos'][elegidos].tolist()
+    dts = g['dt'][elegidos].tolist()
+    ciudades = g['ciudad'][elegidos].tolist()
+    n_main, n_viento = n_main.tolist(), n_viento.tolist()
+
+    for i in range(len(dts)):
+        descr = icon = None
+        if hay_mediodia[i]:
+            k = k_mediodia[i]
+            descr, icon = desc[k], icono[k]
+        if not descr:
+            descr = desc[k_frecuente[i]]
+            icon = icono[k_centro[i]]
+
+        avg_wind_deg = '—'
+        if n_grados[i] and not (suma_sin[i] == 0 and suma_cos[i] == 0):
+            avg_wind_deg = round(math.degrees(math.atan2(suma_sin[i], suma_cos[i])) % 360, 0)
+
+        if n_main[i]:
+            # round(int, 1) devuelve int: se respeta el tipo original del payload
+            v_min, v_max = filas[k_min[i]][2], filas[k_max[i]][3]
+            temp = {
+                'day': t_day[i],
+                'min': v_min if type(v_min) is int else t_min[i],
+                'max': v_max if type(v_max) is int else t_max[i],
+            }
+        else:
+            temp = {'day': '—', 'min': '—', 'max': '—'}
+
+        resultado[ciudades[i]].append({
+            'dt': dts[i],
+            'temp': temp,
+            'pop': filas[k_pop[i]][4],
+            'wind': {
+                'speed': w_speed[i] if n_viento[i] else '—',
+                'deg': avg_wind_deg,
+            },
+            'weather': [{'description': (descr or '—'), 'icon': icon}],
+        })
+    return resultado
+
+
+@medido(latencia_agregacion, paso='resumen_diario')
+def resumen_diario(forecast_json, max_days=5):
+    """Agrupa forecast 3h de una ciudad en resumen diario compatible con la UI.
+
+    Versión ítem a ítem: para una sola ciudad (40 slots) es más rápida que montar
+    los arrays; para lotes usar `resumen_diario_lote`.
+    """
+    if not forecast_json or 'list' not in forecast_json:
+        return []
+
+    tz_offset = forecast_json.get('city', {}).get('timezone', 0)
+    dias = defaultdict(list)
+
+    for item in forecast_json['list']:
+        ts_local = item['dt'] + tz_offset
+        date_str = datetime.utcfromtimestamp(ts_local).date().isoformat()
+        dias[date_str].append(item)
+
+    resumen = []
+    for date_str, items in sorted(dias.items())[:max_days]:
+        temps = [it['main']['temp'] for it in items if 'main' in it]
+        mins = [it['main'].get('temp_min') for it in items if 'main' in it]
+        maxs = [it['main'].get('temp_max') for it in items if 'main' in it]
+        pops = [it.get('pop', 0) for it in items]
+
+        # Descripción representativa (mediodía si existe)
+        descr = None
+        icon = None
+        for it in items:
+            hour = datetime.utcfromtimestamp(it['dt'] + tz_offset).hour
+            if 11 <= hour <= 13 and it.get('weather'):
+                descr = it['weather'][0].get('description')
+                icon = it['weather'][0].get('icon')
+                break
+        if not descr:
+            descrs = [it.get('weather', [{}])[0].get('description', '') for it in items]
+            common = Counter(descrs).most_common(1)
+            descr = common[0][0] if common else '—'
+            icon = items[len(items)//2].get('weather', [{}])[0].get('icon') if items else None
+
+        total_precip = 0.0
+        winds = [it.get('wind', {}).get('speed', 0) for it in items if 'wind' in it]
+        wind_dirs = [it.get('wind', {}).get('deg') for it in items if 'wind' in it and it.get('wind', {}).get('deg') is not None]
+        for it in items:
+            if 'rain' in it:
+                total_precip += it['rain'].get('3h', 0)
+            if 'snow' in it:
+                total_precip += it['snow'].get('3h', 0)
+
+        dt_ts = items[0]['dt'] if items else 0
+        # calcular media circular de la dirección del viento si hay datos
+        avg_wind_deg = '—'
+        if wind_dirs:
+            sin_sum = sum(math.sin(math.radians(d)) for d in wind_dirs)
+            cos_sum = sum(math.cos(math.radians(d)) for d in wind_dirs)
+            if sin_sum == 0 and cos_sum == 0:
+                avg_wind_deg = '—'
+            else:
+                mean_rad = math.atan2(sin_sum, cos_sum)
+                deg = math.degrees(mean_rad) % 360
+                avg_wind_deg = round(deg, 0)
+
+        resumen.append({
+            'dt': dt_ts,
+            'temp': {
+                'day': round(sum(temps)/len(temps), 1) if temps else '—',
+                'min': round(min(mins), 1) if mins else '—',
+                'max': round(max(maxs), 1) if maxs else '—'
+            },
+            'pop': max(pops) if pops else 0,
+            'wind': {
+                'speed': round(sum(winds)/len(winds), 1) if winds else '—',
+                'deg': avg_wind_deg
+            },
+            'weather': [{'description': (descr or '—'), 'icon': icon}]
+        })
+
+    return resumen
+
+
+class _Dia:
+    """Acumuladores de un día local: lo que `resumen_diario` calcula sobre sus listas."""
+
+    __slots__ = ('dt', 'n', 'suma_temp', 'n_temp', 'minimo', 'maximo', 'pop', 'suma_speed', 'n_viento',
+                 'suma_sin', 'suma_cos', 'n_grados', 'precip', 'mediodia', 'descr', 'icon',
+                 'weathers')
+
+    def __init__(self, dt):
+        self.dt = dt
+        self.n = 0
+        # Sumas desde 0 (int) y en orden de llegada, como `sum()`: mismo float al redondear
+        self.suma_temp = self.n_temp = 0
+        self.minimo = self.maximo = self.pop = None
+        self.suma_speed = self.n_viento = 0
+        self.suma_sin = self.suma_cos = self.n_grados = 0
+        self.precip = 0.0
+        self.mediodia = False
+        self.descr = self.icon = None
+        # `weather` de cada slot, sólo mientras el mediodía no dé descripción (máx. 8 por día)
+        self.weathers = []
+
+
+class ResumenIncremental:
+    """Resumen diario de una ciudad alimentado slot a slot; misma salida que `resumen_diario`.
+
+    Sólo guarda los acumuladores de los `max_days` primeros días vistos, así que la
+    memoria no depende de cuántos slots traiga la previsión.
+    """
+
+    def __init__(self, tz_offset=0, max_days=5):
+        self.tz_offset = tz_offset
+        self.max_days = max_days
+        self._dias = {}  # día local (días desde epoch) -> _Dia
+
+    def añadir(self, item):
+        ts_local = item['dt'] + self.tz_offset
+        clave = ts_local // SEGUNDOS_DIA
+        dias = self._dias
+        dia = dias.get(clave)
+        if dia is None:
+            if len(dias) >= self.max_days:
+                ultimo = max(dias, default=None)
+                if ultimo is None or clave > ultimo:
+                    return  # fuera de los primeros `max_days` días
+                del dias[ultimo]
+            dia = dias[clave] = _Dia(item['dt'])
+        dia.n += 1
+
+        if 'main' in item:
+            main = item['main']
+            dia.suma_temp += main['temp']
+            dia.n_temp += 1
+            # Primera aparición del mínimo/máximo, como min()/max()
+            v = main.get('temp_min')
+            if dia.minimo is None or v < dia.minimo:
+                dia.minimo = v
+            v = main.get('temp_max')
+            if dia.maximo is None or v > dia.maximo:
+                dia.maximo = v
+        v = item.get('pop', 0)
+        if dia.pop is None or v > dia.pop:
+            dia.pop = v
+
+        if 'wind' in item:
+            wind = item['wind']
+            dia.suma_speed += wind.get('speed', 0)
+            dia.n_viento += 1
+            d = wind.get('deg')
+            if d is not None:
+                r = math.radians(d)
+                dia.suma_sin += math.sin(r)
+                dia.suma_cos += math.cos(r)
+                dia.n_grados += 1
+        if 'rain' in item:
+            dia.precip += item['rain'].get('3h', 0)
+        if 'snow' in item:
+            dia.precip += item['snow'].get('3h', 0)
+
+        # Descripción representativa: el primer slot de 11-13 h con `weather`...
+        if not dia.mediodia and 11 <= (ts_local % SEGUNDOS_DIA) // 3600 <= 13 and item.get('weather'):
+            dia.mediodia = True
+            dia.descr = item['weather'][0].get('description')
+            dia.icon = item['weather'][0].get('icon')
+        # ...y si no, la más frecuente del día con el icono del slot central
+        if not dia.descr:
+            dia.weathers.append(item.get('weather', [{}]))
+        elif dia.weathers:
+            dia.weathers = []
+
+    def dias(self):
+        """Una tupla por día con los campos de `modelos.ResumenDia` (None lo que falta)."""
+        for _, dia in sorted(self._dias.items()):
+            descr, icon = dia.descr, dia.icon
+            if not descr:
+                common = Counter(w[0].get('description', '') for w in dia.weathers).most_common(1)
+                descr = common[0][0] if common else '—'
+                icon = dia.weathers[dia.n // 2][0].get('icon')
+
+            avg_wind_deg = None
+            if dia.n_grados and not (dia.suma_sin == 0 and dia.suma_cos == 0):
+                avg_wind_deg = round(math.degrees(math.atan2(dia.suma_sin, dia.suma_cos)) % 360, 0)
+
+            yield (
+                dia.dt,
+                round(dia.suma_temp / dia.n_temp, 1) if dia.n_temp else None,
+                round(dia.minimo, 1) if dia.n_temp else None,
+                round(dia.maximo, 1) if dia.n_temp else None,
+                dia.pop,
+                round(dia.suma_speed / dia.n_viento, 1) if dia.n_viento else None,
+                avg_wind_deg,
+                descr or '—',
+                icon,
+            )
+
+    def resumen(self):
+        return [{
+            'dt': dt,
+            'temp': {'day': _o_raya(temp), 'min': _o_raya(minimo), 'max': _o_raya(maximo)},
+            'pop': pop,
+            'wind': {'speed': _o_raya(viento), 'deg': _o_raya(grados)},
+            'weather': [{'description': descr, 'icon': icon}],
+        } for dt, temp, minimo, maximo, pop, viento, grados, descr, icon in self.dias()]
+
+
+def _o_raya(valor):
+    return '—' if valor is None else valor
+
+
+@medido(latencia_agregacion, paso='resumen_incremental')
+def resumen_diario_incremental(slots, tz_offset=0, max_days=5):
+    """`resumen_diario` sobre un iterable de slots (lista, generador, `leer_forecast`)."""
+    acumulador = ResumenIncremental(tz_offset, max_days)
+    for item in slots:
+        acumulador.añadir(item)
+    return acumulador.resumen()
+
+
+@medido(latencia_agregacion, paso='resumen_incremental')
+def dias_incremental(slots, tz_offset=0, max_days=5):
+    """Como `resumen_diario_incremental`, pero una tupla por día (ver `ResumenIncremental.dias`)
+    en vez del dict de cada uno: es lo que `consultas` convierte en `modelos.ResumenDia`."""
+    acumulador = ResumenIncremental(tz_offset, max_days)
+    for item in slots:
+        acumulador.añadir(item)
+    return list(acumulador.dias())
+
+
+_decodificador = json.JSONDecoder()
+_blancos = re.compile(r'[ \t\n\r]*').match
+
+
+def _valor(texto, clave, desde_final=False):
+    """Posición del valor de la clave `clave` (con comillas), saltando apariciones que no
+    son clave (p.ej. una ciudad llamada así); None si no está."""
+    pos = texto.rfind(clave) if desde_final else texto.find(clave)
+    while pos >= 0:
+        antes = pos - 1
+        while antes >= 0 and texto[antes] in ' \t\n\r':
+            antes -= 1
+        i = _blancos(texto, pos + len(clave)).end()
+        if antes >= 0 and texto[antes] in '{,' and texto[i:i + 1] == ':':
+            return _blancos(texto, i + 1).end()
+        pos = texto.rfind(clave, 0, pos) if desde_final else texto.find(clave, pos + 1)
+    return None
+
+
+def _slots(texto, i):
+    escanear = _decodificador.scan_once  # sin la envoltura de `raw_decode`: un slot por llamada
+    blancos = ' \t\n\r'
+    if texto[i:i + 1] == ']':
+        return
+    while True:
+        try:
+            item, i = escanear(texto, i)
+        except StopIteration as e:
+            raise json.JSONDecodeError('Expecting value', texto, e.value) from None
+        yield item
+        if texto[i:i + 1] in blancos:
+            i = _blancos(texto, i).end()
+        c = texto[i:i + 1]
+        if c == ']':
+            return
+        if c != ',':
+            raise json.JSONDecodeError("Expecting ',' delimiter", texto, i)
+        i += 1
+        if texto[i:i + 1] in blancos:
+            i = _blancos(texto, i).end()
+
+
+def leer_forecast(cuerpo):
+    """Cuerpo de `/data/2.5/forecast` -> (`city`, iterador de slots de `list`).
+
+    Los slots se decodifican de uno en uno al iterar, así que nunca está en memoria el
+    árbol de dicts de la respuesta entera. `city` (con `timezone`) va detrás de `list`
+    en OWM y se lee antes, buscándolo desde el final. Si el cuerpo no tiene la forma
+    esperada se decodifica entero, con el mismo resultado.
+    """
+    texto = cuerpo.decode('utf-8') if isinstance(cuerpo, (bytes, bytearray)) else cuerpo
+    inicio = _valor(texto, '"list"')
+    pos_city = _valor(texto, '"city"', desde_final=True)
+    city = {}
+    if pos_city is not None:
+        city = _decodificador.raw_decode(texto, pos_city)[0]
+    if inicio is None or texto[inicio:inicio + 1] != '[' or not isinstance(city, dict):
+        forecast = json.loads(texto)
+        return forecast.get('city', {}), iter(forecast.get('list') or [])
+    return city, _slots(texto, _blancos(texto, inicio + 1).end())
@@ -1,219 +1,82 @@
+import functools
+import json
 import os
+import time
 from dotenv import load_dotenv
-import requests
 import streamlit as st
-from datetime import datetime
-import math
-from babel import Locale
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import consultas
+import geocodificacion
+import historico
+import iconos
+import lote
+import metricas
+import nomenclator
+import precalentado
+import transporte
+from cache_clima import cache as cache_clima
+from modelos import Observacion, Prevision, ResumenDia, o_raya, texto_viento
 
 load_dotenv()
 API_KEY = os.getenv("API_KEY")
+METRICAS_PUERTO = int(os.getenv('METRICAS_PUERTO_DASHBOARD', 9101))
+owm = consultas.ClienteOWM(API_KEY)
 
-_locale_es = Locale.parse('es')
+metricas.configurar('dashboard')
 
-def get_country_name(code: str) -> str:
-    if not code:
-        return '—'
-    try:
-        return _locale_es.territories.get(code.upper(), code)
-    except Exception:
-        return code
+# Nombres de territorio de Babel en español, precalculados: cargar la tabla de Babel
+# costaba ~25 ms en el primer render. Regenerar al actualizar Babel con
+#   python -c "import json; from babel import Locale; json.dump(dict(Locale.parse('es').territories), open('datos/paises_es.json', 'w'), ensure_ascii=False, indent=0, sort_keys=True)"
+RUTA_PAISES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'datos', 'paises_es.json')
 
 
-def deg_to_arrow(deg):
-    """Convierte grados en una flecha y una etiqueta de dirección (8 puntos).
-    Devuelve tupla (arrow, compass_label, deg) donde deg puede ser '—' si no disponible.
-    """
+@functools.cache
+def _paises_es() -> dict:
     try:
-        if deg is None:
-            return ('', '—', '—')
-        d = float(deg) % 360
-    except Exception:
-        return ('', '—', '—')
-
-    arrows = ['⬆️', '↗️', '➡️', '↘️', '⬇️', '↙️', '⬅️', '↖️']
-    labels = ['N', 'NE', 'E', 'SE', 'S', 'SO', 'O', 'NO']
-    idx = int(((d + 22.5) % 360) // 45)
-    return (arrows[idx], labels[idx], round(d, 0))
-
-def obtener_coordenadas(nombre):
-    url = f'http://api.openweathermap.org/geo/1.0/direct'
-    params = {
-        'q': nombre,
-        'limit': 1,
-        'appid': API_KEY
-    }
-    response = requests.get(url, params=params)
-    data = response.json()
+        with open(RUTA_PAISES, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        from babel import Locale
 
-    if not data:
-        raise ValueError("Ciudad no encontrada")
-    
-    else:
-        lat = data[0]['lat']
-        lon = data[0]['lon']
-        return lat, lon
+        return dict(Locale.parse('es').territories)
 
 
-def obtener_nombre_localizada(nombre, lang='es'):
-    """Devuelve el nombre localizado en `lang` si está disponible en la respuesta de geocoding."""
-    try:
-        url = 'http://api.openweathermap.org/geo/1.0/direct'
-        params = {'q': nombre, 'limit': 1, 'appid': API_KEY}
-        resp = requests.get(url, params=params, timeout=5)
-        resp.raise_for_status()
-        items = resp.json()
-        if not items:
-            return nombre
-        item = items[0]
-        local_names = item.get('local_names', {}) or {}
-        # intentar clave 'es' y fallback al nombre provisto por la API
-        return local_names.get(lang) or item.get('name') or nombre
-    except Exception:
-        return nombre
-
-def obtener_clima_hoy(lat:float, lon:float):
-    url = f'https://api.openweathermap.org/data/2.5/weather'
-    params = {
-        'lat': lat,
-        'lon': lon,
-        'appid': API_KEY,
-        'units': 'metric',
-        'lang': 'es'
-    }
-    response = requests.get(url, params=params, timeout=10)
-    if response.status_code == 200:    
-        return response.json()
-    else:
-        try:
-            error_message = response.json()
-        except ValueError:
-            error_message = {'mensaje':response.text}
-        return {'error': True, 'mensaje': error_message}
-
-
-def obtener_prevision_5dias(lat: float, lon: float):
-    """Devuelve previsión diaria usando /forecast (3h) del free plan."""
-    url = 'https://api.openweathermap.org/data/2.5/forecast'
-    params = {'lat': lat, 'lon': lon, 'appid': API_KEY, 'units': 'metric', 'lang': 'es'}
-    try:
-        resp = requests.get(url, params=params, timeout=10)
-        if resp.status_code != 200:
-            return {'error': True, 'mensaje': 'No se puede obtener previsión'}
-    except Exception as e:
-        return {'error': True, 'mensaje': str(e)}
-
-    try:
-        forecast3h = resp.json()
-        daily = _resumen_diario_desde_forecast3h(forecast3h, max_days=5)
-        return {
-            'daily': daily,
-            'timezone_offset': forecast3h.get('city', {}).get('timezone', 0)
-        }
-    except Exception as e:
-        return {'error': True, 'mensaje': str(e)}
-
-
-def _resumen_diario_desde_forecast3h(forecast_json, max_days=5):
-    """Agrupa forecast 3h en resumen diario compatible con la UI."""
-    from collections import defaultdict, Counter
-
-    if not forecast_json or 'list' not in forecast_json:
-        return []
-
-    tz_offset = forecast_json.get('city', {}).get('timezone', 0)
-    dias = defaultdict(list)
-
-    for item in forecast_json['list']:
-        ts_local = item['dt'] + tz_offset
-        date_str = datetime.utcfromtimestamp(ts_local).date().isoformat()
-        dias[date_str].append(item)
-
-    resumen = []
-    for date_str, items in sorted(dias.items())[:max_days]:
-        temps = [it['main']['temp'] for it in items if 'main' in it]
-        mins = [it['main'].get('temp_min') for it in items if 'main' in it]
-        maxs = [it['main'].get('temp_max') for it in items if 'main' in it]
-        pops = [it.get('pop', 0) for it in items]
-
-        # Descripción representativa (mediodía si existe)
-        descr = None
-        icon = None
-        for it in items:
-            hour = datetime.utcfromtimestamp(it['dt'] + tz_offset).hour
-            if 11 <= hour <= 13 and it.get('weather'):
-                descr = it['weather'][0].get('description')
-                icon = it['weather'][0].get('icon')
-                break
-        if not descr:
-            descrs = [it.get('weather', [{}])[0].get('description', '') for it in items]
-            common = Counter(descrs).most_common(1)
-            descr = common[0][0] if common else '—'
-            icon = items[len(items)//2].get('weather', [{}])[0].get('icon') if items else None
-
-        total_precip = 0.0
-        winds = [it.get('wind', {}).get('speed', 0) for it in items if 'wind' in it]
-        wind_dirs = [it.get('wind', {}).get('deg') for it in items if 'wind' in it and it.get('wind', {}).get('deg') is not None]
-        for it in items:
-            if 'rain' in it:
-                total_precip += it['rain'].get('3h', 0)
-            if 'snow' in it:
-                total_precip += it['snow'].get('3h', 0)
-
-        dt_ts = items[0]['dt'] if items else 0
-        # calcular media circular de la dirección del viento si hay datos
-        avg_wind_deg = '—'
-        if wind_dirs:
-            sin_sum = sum(math.sin(math.radians(d)) for d in wind_dirs)
-            cos_sum = sum(math.cos(math.radians(d)) for d in wind_dirs)
-            if sin_sum == 0 and cos_sum == 0:
-                avg_wind_deg = '—'
-            else:
-                mean_rad = math.atan2(sin_sum, cos_sum)
-                deg = math.degrees(mean_rad) % 360
-                avg_wind_deg = round(deg, 0)
-
-        resumen.append({
-            'dt': dt_ts,
-            'temp': {
-                'day': round(sum(temps)/len(temps), 1) if temps else '—',
-                'min': round(min(mins), 1) if mins else '—',
-                'max': round(max(maxs), 1) if maxs else '—'
-            },
-            'pop': max(pops) if pops else 0,
-            'wind': {
-                'speed': round(sum(winds)/len(winds), 1) if winds else '—',
-                'deg': avg_wind_deg
-            },
-            'weather': [{'description': (descr or '—'), 'icon': icon}]
-        })
-
-    return resumen
-
-
-def _format_basic(data):
-    """Return a small dict with the most useful fields for display."""
+def get_country_name(code: str) -> str:
+    if not code:
+        return '—'
     try:
-        return {
-            'ciudad': data.get('name'),
-            'temperatura_C': data['main']['temp'],
-            'temp_sentida_C': data['main']['feels_like'],
-            'descripcion': data['weather'][0]['description'],
-            'humedad_%': data['main']['humidity'],
-            'viento_m_s': data['wind']['speed']
-        }
+        return _paises_es().get(code.upper(), code)
     except Exception:
-        return {'error': 'Formato inesperado de respuesta'}
+        return code
 
 
 def main():
     st.set_page_config(page_title='Dashboard Clima', layout='wide')
     st.markdown("<h1 style='text-align:center; margin-bottom:0.25rem'>Dashboard Clima</h1>", unsafe_allow_html=True)
     st.markdown("<p style='text-align:center; color:gray'>Busca el clima por ciudad usando OpenWeatherMap</p>", unsafe_allow_html=True)
+    _servidor_metricas()
+
+    # Página oculta: ?metricas=1
+    if st.query_params.get('metricas'):
+        mostrar_metricas()
+        return
+
+    modo = st.radio('Modo', ['Una ciudad', 'Varias ciudades'], horizontal=True, label_visibility='collapsed')
+    if modo == 'Varias ciudades':
+        mostrar_lote()
+        return
 
     # Input + submit dentro de un formulario: Enter actúa como enviar
     with st.form(key='search_form'):
-        ciudad = st.text_input('Ciudad', value='Madrid', key='ciudad')
+        opciones = _opciones_ciudad()
+        if opciones:
+            # Sugerencias al escribir desde el nomenclátor local; se admite cualquier otro texto
+            ciudad = st.selectbox('Ciudad', opciones, index=_indice_defecto(opciones), key='ciudad',
+                                  accept_new_options=True, placeholder='Escribe una ciudad')
+        else:
+            ciudad = st.text_input('Ciudad', value='Madrid', key='ciudad')
         buscar = st.form_submit_button('Buscar')
 
     if buscar:
@@ -226,29 +89,87 @@ def main():
                 'weather': [{'description': 'cielo claro', 'icon': '01d'}],
                 'wind': {'speed': 3.4}
             }
-            mostrar_clima(ejemplo, ejemplo_mode=True)
+            mostrar_clima(Observacion.desde_owm(ejemplo), ejemplo_mode=True)
         else:
             try:
-                lat, lon = obtener_coordenadas(ciudad)
-                # obtener nombre localizado en español (si disponible)
-                ciudad_local = obtener_nombre_localizada(ciudad, lang='es')
-                clima = obtener_clima_hoy(lat, lon)
-                if isinstance(clima, dict) and clima.get('error'):
-                    st.error(f"Error: {clima.get('mensaje')}")
-                else:
-                    mostrar_clima(clima, ciudad_display=ciudad_local)
+                st.session_state['busqueda'] = buscar_ciudad(ciudad)
             except Exception as e:
+                st.session_state.pop('busqueda', None)
                 st.error(str(e))
 
+    # El resultado vive en la sesión: cualquier rerun (otro widget, etc.) repinta sin llamar a la API
+    busqueda = st.session_state.get('busqueda')
+    if busqueda:
+        mostrar_clima(busqueda['clima'], ciudad_display=busqueda['ciudad_local'], coords=busqueda['coords'],
+                      prevision=busqueda['prevision'])
+
     st.markdown('---')
 
-def mostrar_clima(data: dict, ejemplo_mode: bool = False, ciudad_display: str = None):
-    basic = _format_basic(data)
-    lat, lon = obtener_coordenadas(ciudad_display or basic.get('ciudad') or data.get('name'))
-    ciudad_nombre = ciudad_display or basic.get('ciudad') or data.get('name') or '—'
-    descripcion = basic.get('descripcion', '—')
+
+@st.cache_resource
+def _servidor_metricas():
+    # Un servidor /metrics por proceso de Streamlit (METRICAS_PUERTO_DASHBOARD=0 lo desactiva)
+    return metricas.iniciar_servidor(METRICAS_PUERTO)
+
+
+@st.cache_data
+def _opciones_ciudad():
+    return nomenclator.opciones(int(os.getenv('NOMENCLATOR_OPCIONES', 5000)))
+
+
+def _indice_defecto(opciones):
+    try:
+        return opciones.index('Madrid, ES')
+    except ValueError:
+        return 0
+
+
+@st.cache_resource
+def _executor():
+    # Compartido entre sesiones y reruns (el script se re-ejecuta, este recurso no)
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix='prevision')
+
+
+def buscar_ciudad(ciudad: str) -> dict:
+    """Una geocodificación y, en paralelo, clima actual y previsión.
+
+    La previsión se lanza en segundo plano y se devuelve como `Future`: la cabecera y
+    las métricas se pintan en cuanto llega el clima actual (un solo round trip) y sólo
+    el expander de previsión, al final de la página, espera a que termine. Si la API
+    falla sale `consultas.ErrorOWM`.
+    """
+    inicio = time.perf_counter()
+    resultado = 'error'
+    try:
+        ubicacion = owm.obtener_ubicacion(ciudad)
+        if ubicacion:
+            precalentado.registrar(ubicacion)
+            prevision = _executor().submit(owm.obtener_prevision_5dias, ubicacion.lat, ubicacion.lon)
+            clima = owm.obtener_clima_hoy(ubicacion.lat, ubicacion.lon)
+        resultado = 'ok' if ubicacion else 'no_encontrada'
+    finally:
+        metricas.latencia_peticion.observar(time.perf_counter() - inicio, tipo='busqueda', resultado=resultado)
+    if not ubicacion:
+        raise ValueError("Ciudad no encontrada")
+    return {
+        'ciudad': ciudad,
+        'ciudad_local': ubicacion.nombre_local or ciudad,
+        'coords': (ubicacion.lat, ubicacion.lon),
+        'clima': clima,
+        'prevision': prevision,
+    }
+
+
+def mostrar_clima(data: Observacion, ejemplo_mode: bool = False, ciudad_display: str = None, coords: tuple = None,
+                  prevision=None):
+    # Coordenadas ya resueltas por quien llama; si no, las que trae la respuesta de /weather
+    if coords is None:
+        coords = (data.lat, data.lon)
+    lat, lon = coords
+    ciudad_nombre = ciudad_display or data.nombre or '—'
+    descripcion = data.descripcion or '—'
     # Emoji selection inlined to keep helpers together and minimal edits
-    d = (descripcion or '').lower()
+    d = descripcion.lower()
     mapping = [
         ('clear', '☀️'),
         ('cloud', '☁️'),
@@ -269,29 +190,19 @@ def mostrar_clima(data: dict, ejemplo_mode: bool = False, ciudad_display: str =
     col1, col2 = st.columns([4,1])
     with col1:
         st.subheader(f" {emoji} Clima en {ciudad_nombre}")
-        st.write(f'Coordenadas: {lat:.4f}, {lon:.4f}')
+        if lat is not None and lon is not None:
+            st.write(f'Coordenadas: {lat:.4f}, {lon:.4f}')
         st.markdown(f"**{descripcion.capitalize()}** — actualizado: {datetime.utcnow().strftime('%Y-%m-%d %H:%M UTC')}")
     with col2:
-        icon_code = None
-        try:
-            icon_code = data['weather'][0].get('icon')
-        except Exception:
-            icon_code = None
-        if icon_code:
-            icon_url = f'http://openweathermap.org/img/wn/{icon_code}@2x.png'
-            st.image(icon_url, width=96)
+        if data.icono:
+            st.image(iconos.icono(data.icono), width=96)
 
     # Metrics row
-    t = basic.get('temperatura_C', '—')
-    feels = basic.get('temp_sentida_C', '—')
-    hum = basic.get('humedad_%', '—')
-    wind = basic.get('viento_m_s', '—')
-
-
     m1, m2, m3 = st.columns(3)
-    m1.metric(label='Temperatura (°C)', value=f"{t} °C", delta=f"Sensación térmica de {feels}°C", delta_color='off', delta_arrow='off')
-    m2.metric(label='Humedad (%)', value=f"{hum}")
-    m3.metric(label='Viento (m/s)', value=f"{wind}")
+    m1.metric(label='Temperatura (°C)', value=f"{o_raya(data.temp)} °C",
+              delta=f"Sensación térmica de {o_raya(data.sensacion)}°C", delta_color='off', delta_arrow='off')
+    m2.metric(label='Humedad (%)', value=f"{o_raya(data.humedad)}")
+    m3.metric(label='Viento (m/s)', value=f"{o_raya(data.viento)}")
 
     # Info completa en formato legible (3 columnas)
     with st.expander('ℹ️ Info completa'):
@@ -300,91 +211,232 @@ def mostrar_clima(data: dict, ejemplo_mode: bool = False, ciudad_display: str =
         # Columna 1: Datos del país
         with col1:
             st.subheader('🌍 País & Ubicación')
-            st.write(f"**Ciudad:** {data.get('name', '—')}")
-            country_code = data.get('sys', {}).get('country')
-            st.write(f"**País:** {get_country_name(country_code)}")
-            st.write(f"**Latitud:** {data.get('coord', {}).get('lat', '—')}°")
-            st.write(f"**Longitud:** {data.get('coord', {}).get('lon', '—')}°")
-            tz_offset = data.get('timezone', 0) / 3600  #Te devuelve en segundos
+            st.write(f"**Ciudad:** {o_raya(data.nombre)}")
+            st.write(f"**País:** {get_country_name(data.pais)}")
+            st.write(f"**Latitud:** {o_raya(data.lat)}°")
+            st.write(f"**Longitud:** {o_raya(data.lon)}°")
+            tz_offset = data.zona / 3600  #Te devuelve en segundos
             tz_sign = '+' if tz_offset >= 0 else ''
             st.write(f"**Zona horaria:** UTC {tz_sign}{tz_offset:.0f}h")
         
-        # Columna 2: Temperaturas y datos 'main'
+        # Columna 2: Temperaturas
         with col2:
             st.subheader('🌡️ Temperaturas')
-            main_data = data.get('main', {})
-            st.write(f"**Temperatura:** {main_data.get('temp', '—')}°C")
-            st.write(f"**Sensación térmica:** {main_data.get('feels_like', '—')}°C")
-            st.write(f"**Temp. mínima:** {main_data.get('temp_min', '—')}°C")
-            st.write(f"**Temp. máxima:** {main_data.get('temp_max', '—')}°C")
-            st.write(f"**Humedad:** {main_data.get('humidity', '—')}%")
-            st.write(f"**Presión:** {main_data.get('pressure', '—')} hPa")
+            st.write(f"**Temperatura:** {o_raya(data.temp)}°C")
+            st.write(f"**Sensación térmica:** {o_raya(data.sensacion)}°C")
+            st.write(f"**Temp. mínima:** {o_raya(data.temp_min)}°C")
+            st.write(f"**Temp. máxima:** {o_raya(data.temp_max)}°C")
+            st.write(f"**Humedad:** {o_raya(data.humedad)}%")
+            st.write(f"**Presión:** {o_raya(data.presion)} hPa")
         
         # Columna 3: Resto de datos
         with col3:
             st.subheader('📊 Otros datos')
-            st.write(f"**Visibilidad:** {data.get('visibility', '—')} m")
-            st.write(f"**Nubosidad:** {data.get('clouds', {}).get('all', '—')}%")
-            # Mostrar viento con flecha y etiqueta si hay dirección
-            wind_speed = data.get('wind', {}).get('speed', '—')
-            wind_deg = data.get('wind', {}).get('deg')
-            arrow, label, deg_val = deg_to_arrow(wind_deg)
-            if deg_val == '—':
-                st.write(f"**Viento:** {wind_speed} m/s")
-            else:
-                st.write(f"**Viento:** {wind_speed} m/s {arrow} {int(deg_val)}° ({label})")
-            if data.get('rain'):
-                st.write(f"**Lluvia (1h):** {data.get('rain', {}).get('1h', '—')} mm")
-            if data.get('snow'):
-                st.write(f"**Nieve (1h):** {data.get('snow', {}).get('1h', '—')} mm")
-            # Mostrar la descripción localizada (campo 'description') solicitada con 'lang=es'
-            desc_loc = data.get('weather', [{}])[0].get('description', '—')
-            st.write(f"**Descripción:** {desc_loc.capitalize()}")
+            st.write(f"**Visibilidad:** {o_raya(data.visibilidad)} m")
+            st.write(f"**Nubosidad:** {o_raya(data.nubes)}%")
+            # Viento con flecha y etiqueta si hay dirección
+            st.write(f"**Viento:** {texto_viento(data.viento, data.viento_deg)}")
+            if data.lluvia_1h is not None:
+                st.write(f"**Lluvia (1h):** {data.lluvia_1h} mm")
+            if data.nieve_1h is not None:
+                st.write(f"**Nieve (1h):** {data.nieve_1h} mm")
+            # La descripción localizada (se pide con 'lang=es')
+            st.write(f"**Descripción:** {descripcion.capitalize()}")
 
     # Previsión 7 días (extra)
     with st.expander('📅 Previsión 5 días'):
-        coord = data.get('coord') or {}
-        lat = coord.get('lat')
-        lon = coord.get('lon')
-        if not (lat and lon):
+        lat, lon = data.lat, data.lon
+        if prevision is None and not (lat and lon):
             st.info('No hay coordenadas disponibles para esta ciudad.')
         else:
-            prevision = obtener_prevision_5dias(lat, lon)
-            if isinstance(prevision, dict) and prevision.get('error'):
-                st.error(f"No se pudo obtener la previsión: {prevision.get('mensaje')}")
-            else:
-                daily = prevision.get('daily', [])[:7]
-                tz_offset = prevision.get('timezone_offset', 0)
-                if not daily:
+            try:
+                if prevision is None:
+                    prevision = owm.obtener_prevision_5dias(lat, lon)
+                elif isinstance(prevision, Future):
+                    # ya lanzada en paralelo por `buscar_ciudad`; normalmente ya ha terminado
+                    prevision = prevision.result()
+            except Exception as e:
+                st.error(f"No se pudo obtener la previsión: {e}")
+                prevision = None
+            if prevision is not None:
+                if prevision.recibido is None:  # sin marca no se distingue de otra previsión
+                    tarjetas = _tarjetas(prevision)
+                else:
+                    tarjetas = _tarjetas_prevision(lat, lon, prevision.recibido, prevision)
+                if not tarjetas:
                     st.info('No hay datos de previsión disponibles.')
                 else:
-                    cols = st.columns(len(daily))
-                    for i, day in enumerate(daily):
-                        with cols[i]:
-                            dt = datetime.utcfromtimestamp(day.get('dt', 0) + tz_offset)
-                            fecha = dt.strftime('%a %d %b')
-                            w = day.get('weather', [{}])[0]
-                            icon = w.get('icon')
-                            desc = w.get('description', '—').capitalize()
-                            temp = day.get('temp', {})
-                            t_day = temp.get('day', '—')
-                            t_min = temp.get('min', '—')
-                            t_max = temp.get('max', '—')
-                            pop = int(day.get('pop', 0) * 100)
-                            st.markdown(f"**{fecha}**")
-                            if icon:
-                                icon_url = f'http://openweathermap.org/img/wn/{icon}@2x.png'
-                                st.image(icon_url, width=72)
-                            st.write(f"{desc}")
-                            st.write(f"{t_day}°C (min {t_min} / max {t_max})")
-                            st.write(f"Prob. precipitación: {pop}%")
-                            wind_speed = day.get('wind', {}).get('speed', '—')
-                            wind_deg = day.get('wind', {}).get('deg')
-                            arrow, label, deg_val = deg_to_arrow(wind_deg)
-                            if deg_val == '—':
-                                st.write(f"Viento: {wind_speed} m/s")
-                            else:
-                                st.write(f"Viento: {wind_speed} m/s {arrow} {int(deg_val)}° ({label})")
+                    cols = st.columns(len(tarjetas))
+                    for col, tarjeta in zip(cols, tarjetas):
+                        with col:
+                            st.markdown(tarjeta['fecha'])
+                            if tarjeta['icono']:
+                                st.image(iconos.icono(tarjeta['icono']), width=72)
+                            st.write(tarjeta['descripcion'])
+                            st.write(tarjeta['temperaturas'])
+                            st.write(tarjeta['precipitacion'])
+                            st.write(tarjeta['viento'])
+
+    if not ejemplo_mode and None not in coords:
+        with st.expander('📈 Histórico'):
+            # El contenido de un expander se ejecuta aunque esté cerrado: sólo se lee el
+            # Parquet (y se carga pyarrow) cuando se pide
+            if st.toggle('Mostrar histórico', key='ver_historico'):
+                mostrar_historico(*coords)
+
+
+def _tarjeta_dia(dia: ResumenDia, tz_offset: int) -> dict:
+    """Textos de la tarjeta de un día de la previsión."""
+    fecha = datetime.utcfromtimestamp(dia.dt + tz_offset).strftime('%a %d %b')
+    return {
+        'fecha': f"**{fecha}**",
+        'icono': dia.icono,
+        'descripcion': (dia.descripcion or '—').capitalize(),
+        'temperaturas': f"{o_raya(dia.temp)}°C (min {o_raya(dia.temp_min)} / max {o_raya(dia.temp_max)})",
+        'precipitacion': f"Prob. precipitación: {int(dia.pop * 100)}%",
+        'viento': f"Viento: {texto_viento(dia.viento, dia.viento_deg)}",
+    }
+
+
+def _tarjetas(prevision: Prevision) -> list:
+    return [_tarjeta_dia(dia, prevision.zona) for dia in prevision.dias[:7]]
+
+
+@st.cache_data(max_entries=500, show_spinner=False)
+def _tarjetas_prevision(lat, lon, recibido, _prevision: Prevision) -> list:
+    """`_tarjetas` una vez por ciudad y previsión recibida (`recibido`): los reruns y
+    las demás sesiones que muestran la misma previsión no las rehacen."""
+    return _tarjetas(_prevision)
+
+
+# Rango -> (días, segundos por punto del gráfico)
+RANGOS_HISTORICO = {'24 horas': (1, 1800), '7 días': (7, 3 * 3600), '30 días': (30, 12 * 3600),
+                    '90 días': (90, 86400)}
+
+
+def mostrar_historico(lat: float, lon: float):
+    """Temperatura observada en el rango elegido, agregada en Arrow antes de llegar a pandas."""
+    rango = st.radio('Rango', list(RANGOS_HISTORICO), index=1, horizontal=True, key='rango_historico')
+    dias, segundos = RANGOS_HISTORICO[rango]
+    tabla = historico.consultar(lat, lon, datetime.now(timezone.utc) - timedelta(days=dias), columnas=['temp'])
+    if tabla.num_rows == 0:
+        st.info('Aún no hay observaciones guardadas de esta ciudad.')
+        return
+    serie = historico.reducir(tabla, segundos).to_pandas().set_index('ts')
+    serie = serie.rename(columns={'temp_mean': 'Media', 'temp_min': 'Mín.', 'temp_max': 'Máx.'})
+    st.line_chart(serie[['Mín.', 'Media', 'Máx.']], y_label='°C')
+    st.caption(f'{tabla.num_rows} observaciones guardadas en los últimos {rango}')
+
+
+def mostrar_metricas():
+    """Página oculta con las métricas del proceso (también en /metrics si hay puerto)."""
+    import pandas as pd
+
+    st.subheader('📈 Métricas')
+    if METRICAS_PUERTO:
+        st.caption(f'Formato Prometheus en http://127.0.0.1:{METRICAS_PUERTO}/metrics')
+    for nombre, (tipo, filas) in sorted(metricas.registro.instantanea().items()):
+        if not filas:
+            continue
+        st.markdown(f'**{nombre}**')
+        df = pd.DataFrame(filas)
+        if tipo == 'histogram' and not nombre.endswith('_bytes'):
+            for col in ('media', 'p50', 'p95', 'p99'):
+                df[col] = (df[col] * 1000).round(2)
+            df = df.rename(columns={c: f'{c} (ms)' for c in ('media', 'p50', 'p95', 'p99')})
+        st.dataframe(df, hide_index=True)
+    with st.expander('Transporte por endpoint'):
+        st.dataframe(pd.DataFrame(transporte.metricas.estadisticas()).T)
+    with st.expander('Cachés'):
+        st.json({'geocodificacion': geocodificacion.estadisticas(), 'clima': cache_clima.estadisticas()})
+    with st.expander('Texto Prometheus'):
+        st.code(metricas.registro.exportar_prometheus(), language='text')
+
+
+def _color_temperatura(t):
+    """Color RGBA para el mapa: azul (frío) -> rojo (calor)."""
+    if t is None:
+        return [128, 128, 128, 160]
+    x = min(max((t + 10) / 45, 0), 1)  # -10 °C .. 35 °C
+    return [int(255 * x), 80, int(255 * (1 - x)), 180]
+
+
+def mostrar_lote():
+    """Modo lote: muchas ciudades (o coordenadas) en una tabla ordenable y un mapa."""
+    import pandas as pd
+    import pydeck as pdk
+
+    with st.form(key='lote_form'):
+        texto = st.text_area('Ciudades o coordenadas (una por línea, p.ej. "Madrid,ES" o "40.41,-3.70")',
+                             value='Madrid\nBarcelona\nSevilla\nBilbao\nValencia', height=150)
+        archivo = st.file_uploader('...o un CSV con columna `ciudad` o columnas `lat`,`lon`', type=['csv', 'txt'])
+        con_prevision = st.checkbox('Incluir mín/máx y prob. de lluvia de hoy (previsión)', value=True)
+        consultar = st.form_submit_button('Consultar')
+
+    if consultar:
+        if not API_KEY:
+            st.error('No se encontró `API_KEY`. Coloca `API_KEY=tu_api_key` en un archivo `.env` en la raíz.')
+            return
+        contenido = archivo.getvalue().decode('utf-8-sig') if archivo is not None else texto
+        entradas = lote.parsear_entradas(contenido)
+        if not entradas:
+            st.info('No hay ciudades que consultar.')
+            return
+        with st.spinner(f'Consultando {len(entradas)} ubicaciones...'):
+            # Guardado en sesión: ordenar la tabla o mover el mapa no vuelve a llamar a la API
+            st.session_state['lote'] = lote.consultar_lote(entradas, API_KEY, con_prevision=con_prevision)
+
+    filas = st.session_state.get('lote')
+    if not filas:
+        return
+
+    ok = [f for f in filas if not f.get('error')]
+    errores = [f for f in filas if f.get('error')]
+    st.caption(f'{len(ok)} ubicaciones correctas, {len(errores)} con error')
+
+    if ok:
+        columnas = ['ciudad', 'pais', 'temp', 'sensacion', 'min_hoy', 'max_hoy', 'pop_hoy',
+                    'humedad', 'viento', 'descripcion', 'lat', 'lon']
+        df = pd.DataFrame([{c: f.get(c) for c in columnas} for f in ok])
+        df['pop_hoy'] = (pd.to_numeric(df['pop_hoy']) * 100).round()
+        df['descripcion'] = df['descripcion'].fillna('').str.capitalize()
+
+        tab_tabla, tab_mapa = st.tabs(['📋 Tabla', '🗺️ Mapa'])
+        with tab_tabla:
+            st.dataframe(
+                df, hide_index=True, width='stretch',
+                column_config={
+                    'ciudad': 'Ciudad', 'pais': 'País', 'descripcion': 'Descripción',
+                    'temp': st.column_config.NumberColumn('Temp. (°C)', format='%.1f'),
+                    'sensacion': st.column_config.NumberColumn('Sensación (°C)', format='%.1f'),
+                    'min_hoy': st.column_config.NumberColumn('Mín. hoy', format='%.1f'),
+                    'max_hoy': st.column_config.NumberColumn('Máx. hoy', format='%.1f'),
+                    'pop_hoy': st.column_config.NumberColumn('Prob. lluvia (%)', format='%d'),
+                    'humedad': st.column_config.NumberColumn('Humedad (%)', format='%d'),
+                    'viento': st.column_config.NumberColumn('Viento (m/s)', format='%.1f'),
+                    'lat': st.column_config.NumberColumn('Lat', format='%.4f'),
+                    'lon': st.column_config.NumberColumn('Lon', format='%.4f'),
+                },
+            )
+        with tab_mapa:
+            df_mapa = df.dropna(subset=['lat', 'lon']).copy()
+            df_mapa['color'] = [_color_temperatura(t) for t in df_mapa['temp']]
+            capa = pdk.Layer(
+                'ScatterplotLayer', data=df_mapa, get_position='[lon, lat]',
+                get_fill_color='color', get_radius=25000, radius_min_pixels=5, pickable=True,
+            )
+            vista = pdk.ViewState(latitude=float(df_mapa['lat'].mean()),
+                                  longitude=float(df_mapa['lon'].mean()), zoom=4)
+            st.pydeck_chart(pdk.Deck(
+                layers=[capa], initial_view_state=vista, map_style=None,
+                tooltip={'text': '{ciudad}: {temp} °C\n{descripcion}'},
+            ))
+
+    if errores:
+        with st.expander(f'⚠️ {len(errores)} ubicaciones con error'):
+            for f in errores:
+                st.write(f"**{f['entrada']}**: {f['error']}")
+
 
 if __name__ == '__main__':
     main()
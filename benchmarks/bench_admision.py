@@ -0,0 +1,115 @@
+"""Admisión del bot (`admision.py`) frente a llamar a OpenWeatherMap en cada mensaje.
+
+Dos escenarios contra el OWM falso, con las cachés vacías al empezar cada uno:
+
+- ráfaga: `--chats` chats preguntan a la vez por las mismas `--ciudades` ciudades, y al
+  terminar otra vez (la segunda ola ya está en caché o en la memoria de respuestas);
+- inundación: un solo chat manda `--mensajes` ciudades distintas seguidas.
+
+Cuenta las llamadas que llegan al OWM falso, los mensajes contestados y p50/p99.
+
+    python benchmarks/bench_admision.py --chats 200 --ciudades 5 --mensajes 100
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('GEO_CACHE_DB', os.path.join(tempfile.mkdtemp(), 'geo.sqlite'))
+os.environ.setdefault('PRECALENTADO_DB', os.path.join(tempfile.mkdtemp(), 'precalentado.sqlite'))
+os.environ.setdefault('HISTORICO', '0')
+os.environ.setdefault('OWM_LLAMADAS_MINUTO', '1000000')
+os.environ.setdefault('OWM_RAFAGA', '1000000')
+
+import admision  # noqa: E402
+import geocodificacion  # noqa: E402
+import telegram_bot  # noqa: E402
+from benchmarks.fake_owm import iniciar_servidor  # noqa: E402
+from cache_clima import cache as cache_clima  # noqa: E402
+from owm_async import ClienteOWMAsync  # noqa: E402
+
+
+class SinAdmision(admision.Admision):
+    """Lo de antes: cada mensaje consulta, sin límites ni resultados compartidos."""
+
+    def admitir(self, chat):
+        return 0.0
+
+    def recordada(self, clave):
+        return None
+
+    async def resolver(self, clave, consultar, recordar=None):
+        return await consultar(), 'consulta'
+
+
+def _update_falso(chat, texto, respuestas):
+    async def reply_text(texto_respuesta):
+        respuestas.append((chat, texto_respuesta))
+    return SimpleNamespace(message=SimpleNamespace(text=texto, reply_text=reply_text),
+                           effective_chat=SimpleNamespace(id=chat))
+
+
+async def _escenario(servidor, control, mensajes, pausa=None, olas=1):
+    """`mensajes` = [(chat, texto)], todos a la vez o separados `pausa` segundos, `olas` veces."""
+    geocodificacion._cache.limpiar()
+    geocodificacion._ids_owm.limpiar()
+    cache_clima.limpiar()
+    owm = ClienteOWMAsync('falsa', base_url=servidor.url)
+    contexto = SimpleNamespace(application=SimpleNamespace(bot_data={'owm': owm, 'admision': control}))
+    antes = sum(servidor.peticiones.values())
+    latencias, respuestas = [], []
+
+    async def uno(chat, texto):
+        inicio = time.perf_counter()
+        await telegram_bot.handle_message(_update_falso(chat, texto, respuestas), contexto)
+        latencias.append(time.perf_counter() - inicio)
+
+    for _ in range(olas):
+        tareas = []
+        for chat, texto in mensajes:
+            tareas.append(asyncio.create_task(uno(chat, texto)))
+            if pausa is not None:
+                await asyncio.sleep(pausa)
+        await asyncio.gather(*tareas)
+    await owm.cerrar()
+    climas = sum(1 for _, r in respuestas if r.startswith('Clima en'))
+    latencias.sort()
+    return {
+        'llamadas': sum(servidor.peticiones.values()) - antes,
+        'contestados': climas,
+        'p50_ms': statistics.median(latencias) * 1000,
+        'p99_ms': latencias[int(len(latencias) * 0.99) - 1] * 1000,
+    }
+
+
+async def main_async(args):
+    servidor = iniciar_servidor(latencia=args.latencia)
+    ciudades = [f'Admision {i}' for i in range(args.ciudades)]
+    rafaga = [(chat, f'clima {ciudades[chat % args.ciudades]}') for chat in range(args.chats)]
+    inundacion = [(1, f'clima Inundacion {i}') for i in range(args.mensajes)]
+    print(f'{"escenario":>11} {"modo":>12} {"llamadas OWM":>13} {"climas":>7} {"p50":>9} {"p99":>9}')
+    try:
+        for nombre, mensajes, pausa, olas in (('ráfaga', rafaga, None, 2), ('inundación', inundacion, 0.01, 1)):
+            for modo, control in (('sin admisión', SinAdmision()), ('admisión', admision.Admision())):
+                r = await _escenario(servidor, control, mensajes, pausa, olas)
+                print(f'{nombre:>11} {modo:>12} {r["llamadas"]:>13} {r["contestados"]:>7} '
+                      f'{r["p50_ms"]:>7.1f}ms {r["p99_ms"]:>7.1f}ms')
+    finally:
+        servidor.shutdown()
+    evitadas = {etiquetas['motivo']: v for _, etiquetas, v in admision.consultas_evitadas.muestras()}
+    limitados = sum(v for _, _, v in admision.mensajes_limitados.muestras())
+    print(f'Consultas evitadas: {evitadas}; mensajes limitados: {limitados}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latencia', type=float, default=0.05)
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--ciudades', type=int, default=5)
+    parser.add_argument('--mensajes', type=int, default=100, help='mensajes del chat que inunda')
+    asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,41 @@
+"""Compara `agregacion.resumen_diario` (bucles, ciudad a ciudad) con `resumen_diario_lote` (NumPy).
+
+    python benchmarks/bench_agregacion.py --ciudades 1 100 10000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import agregacion  # noqa: E402
+from benchmarks.fake_owm import payload_forecast  # noqa: E402
+
+
+def _medir(fn, repeticiones):
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = fn()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor, resultado
+
+
+def main(args):
+    print(f'{"ciudades":>9} {"bucles (ms)":>12} {"numpy (ms)":>11} {"speedup":>8}')
+    for n in args.ciudades:
+        forecasts = [payload_forecast((i * 0.731) % 180 - 90, (i * 1.37) % 360 - 180) for i in range(n)]
+        for i, fj in enumerate(forecasts):
+            fj['city']['timezone'] = (i % 27 - 12) * 3600
+        rep = max(1, min(50, 2000 // n))
+        t_bucles, ref = _medir(lambda: [agregacion.resumen_diario(f, 5) for f in forecasts], rep)
+        t_numpy, nuevo = _medir(lambda: agregacion.resumen_diario_lote(forecasts, 5), rep)
+        assert ref == nuevo, 'la salida vectorizada no coincide con la de referencia'
+        print(f'{n:>9} {t_bucles * 1000:>12.2f} {t_numpy * 1000:>11.2f} {t_bucles / t_numpy:>7.1f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ciudades', type=int, nargs='+', default=[1, 100, 10000])
+    main(parser.parse_args())
@@ -0,0 +1,108 @@
+"""Arranque en frío del dashboard y del bot: tiempo hasta estar listos y qué lo gasta.
+
+Cada medida es un proceso nuevo con `python -X importtime`:
+
+- dashboard: `import app` con Streamlit ya cargado (como en `streamlit run`, que
+  importa Streamlit antes de ejecutar el script);
+- bot: `import telegram_bot` + `crear_aplicacion()`, lo que hace `main()` antes de
+  empezar el polling.
+
+Da la mediana de `--repeticiones` procesos y los paquetes que más tiempo propio
+suman al importar. Con `--maximo-ms` sale con código 1 si alguno se pasa (para CI).
+
+    python benchmarks/bench_arranque.py
+    python benchmarks/bench_arranque.py --repeticiones 9 --maximo-ms 800
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from collections import Counter
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (código previo que no cuenta, código hasta estar listo)
+ENTRADAS = {
+    'dashboard': ('import streamlit', 'import app'),
+    'bot': ('', "import telegram_bot; telegram_bot.crear_aplicacion('123:falso')"),
+}
+
+_PLANTILLA = """
+import sys, time
+{previo}
+sys.stderr.write('INICIO\\n')
+inicio = time.perf_counter()
+{listo}
+print('LISTO', (time.perf_counter() - inicio) * 1000)
+"""
+
+
+def _entorno():
+    entorno = dict(os.environ)
+    entorno.update({
+        'API_KEY': 'falsa',
+        'PRECALENTADO': '0',
+        'METRICAS_PUERTO_DASHBOARD': '0',
+        'METRICAS_PUERTO_BOT': '0',
+        'PYTHONPATH': RAIZ,
+    })
+    return entorno
+
+
+def _paquetes(traza: str) -> Counter:
+    """Tiempo propio de importación (ms) por paquete de primer nivel."""
+    por_paquete = Counter()
+    for linea in traza.splitlines():
+        if not linea.startswith('import time:') or 'self [us]' in linea:
+            continue
+        propio, _, modulo = linea[len('import time:'):].split('|')
+        por_paquete[modulo.strip().split('.')[0]] += int(propio) / 1000
+    return por_paquete
+
+
+def medir_una(entrada: str):
+    """(ms hasta listo, ms de importación por paquete) en un proceso nuevo."""
+    previo, listo = ENTRADAS[entrada]
+    codigo = _PLANTILLA.format(previo=previo, listo=listo)
+    proceso = subprocess.run([sys.executable, '-X', 'importtime', '-c', codigo], cwd=RAIZ, env=_entorno(),
+                             capture_output=True, text=True, check=True)
+    # Lo que importa el código previo sale en la traza antes de la marca y no cuenta
+    return float(proceso.stdout.split('LISTO')[-1]), _paquetes(proceso.stderr.split('INICIO')[-1])
+
+
+def medir(entrada: str, repeticiones: int = 5) -> dict:
+    """Mediana de `repeticiones` arranques de `entrada` ('dashboard' o 'bot')."""
+    tiempos, paquetes = [], Counter()
+    for _ in range(repeticiones):
+        ms, por_paquete = medir_una(entrada)
+        tiempos.append(ms)
+        paquetes.update(por_paquete)
+    return {
+        'listo_ms': round(statistics.median(tiempos), 1),
+        'min_ms': round(min(tiempos), 1),
+        'paquetes': {p: round(ms / repeticiones, 1) for p, ms in paquetes.most_common(12)},
+    }
+
+
+def main(args):
+    excedidos = []
+    for entrada in args.entradas:
+        r = medir(entrada, args.repeticiones)
+        print(f'{entrada}: listo en {r["listo_ms"]:.1f} ms (mediana, mín. {r["min_ms"]:.1f} ms)')
+        for paquete, ms in r['paquetes'].items():
+            print(f'    {paquete:<24} {ms:>7.1f} ms')
+        if args.maximo_ms and r['listo_ms'] > args.maximo_ms:
+            excedidos.append(entrada)
+    if excedidos:
+        print(f'Por encima de {args.maximo_ms} ms: {", ".join(excedidos)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--entradas', nargs='+', choices=list(ENTRADAS), default=list(ENTRADAS))
+    parser.add_argument('--maximo-ms', type=float, help='presupuesto de arranque; sale con 1 si se supera')
+    sys.exit(main(parser.parse_args()))
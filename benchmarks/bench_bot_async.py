@@ -0,0 +1,88 @@
+"""Carga sobre `telegram_bot.handle_message` contra el OWM falso local.
+
+Mide mensajes/segundo a distintas concurrencias con el cliente asíncrono y, como
+referencia, con las llamadas bloqueantes a `requests` que usaba antes el bot.
+
+    python benchmarks/bench_bot_async.py --latencia 0.05 --mensajes 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('GEO_CACHE_DB', os.path.join(tempfile.mkdtemp(), 'geo.sqlite'))
+os.environ.setdefault('PRECALENTADO_DB', os.path.join(tempfile.mkdtemp(), 'precalentado.sqlite'))
+os.environ.setdefault('HISTORICO_DIR', os.path.join(tempfile.mkdtemp(), 'historico'))
+# El limitador del plan gratuito (60/min) falsearía la medida contra el servidor local
+os.environ.setdefault('OWM_LLAMADAS_MINUTO', '1000000')
+os.environ.setdefault('OWM_RAFAGA', '1000000')
+
+import requests  # noqa: E402
+
+import geocodificacion  # noqa: E402
+from cache_clima import cache as cache_clima  # noqa: E402
+from modelos import Observacion  # noqa: E402
+import telegram_bot  # noqa: E402
+from benchmarks.fake_owm import iniciar_servidor  # noqa: E402
+from owm_async import ClienteOWMAsync  # noqa: E402
+
+
+class ClienteBloqueante:
+    """Misma interfaz que `ClienteOWMAsync` pero con `requests` (bloquea el event loop)."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    async def obtener_ubicacion(self, nombre):
+        r = requests.get(f'{self.base_url}/geo/1.0/direct', params={'q': nombre, 'limit': 1}, timeout=10)
+        return geocodificacion.parsear_ubicacion(r.json())
+
+    async def obtener_clima_hoy(self, lat, lon):
+        r = requests.get(f'{self.base_url}/data/2.5/weather', params={'lat': lat, 'lon': lon}, timeout=10)
+        return Observacion.desde_owm(r.json())
+
+
+def _update_falso(texto):
+    async def reply_text(_texto):
+        return None
+    return SimpleNamespace(message=SimpleNamespace(text=texto, reply_text=reply_text))
+
+
+async def _ronda(cliente, mensajes: int, concurrencia: int, prefijo: str) -> float:
+    contexto = SimpleNamespace(application=SimpleNamespace(bot_data={'owm': cliente}))
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def uno(i):
+        async with semaforo:
+            await telegram_bot.handle_message(_update_falso(f'clima {prefijo}{i}'), contexto)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(uno(i) for i in range(mensajes)))
+    return mensajes / (time.perf_counter() - inicio)
+
+
+async def main_async(args):
+    servidor = iniciar_servidor(latencia=args.latencia)
+    print(f'OWM falso en {servidor.url}, latencia {args.latencia * 1000:.0f} ms')
+    print(f'{"concurrencia":>12} {"async msg/s":>12} {"bloqueante msg/s":>17}')
+    for n, c in enumerate(args.concurrencias):
+        geocodificacion._cache.limpiar()
+        cache_clima.limpiar()
+        cliente = ClienteOWMAsync('falsa', base_url=servidor.url, max_concurrencia=max(c, 1) * 2)
+        async_rate = await _ronda(cliente, args.mensajes, c, f'a{n}-')
+        await cliente.cerrar()
+        bloq_rate = await _ronda(ClienteBloqueante(servidor.url), min(args.mensajes, 50), c, f'b{n}-')
+        print(f'{c:>12} {async_rate:>12.1f} {bloq_rate:>17.1f}')
+    servidor.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latencia', type=float, default=0.05)
+    parser.add_argument('--mensajes', type=int, default=200)
+    parser.add_argument('--concurrencias', type=int, nargs='+', default=[1, 5, 20, 50, 100])
+    asyncio.run(main_async(parser.parse_args()))
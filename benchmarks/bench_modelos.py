@@ -0,0 +1,185 @@
+"""Memoria por petición con `modelos` frente a los dicts de OWM que circulaban antes.
+
+Con el clima y la previsión ya en caché (lo normal), una petición sólo formatea lo
+cacheado: el texto del bot, las tarjetas de la previsión del dashboard, la fila del
+modo lote. Antes se cacheaba la respuesta de OWM tal cual y cada interfaz la
+recorría con cadenas de `.get(...)` (que además crean un `{}` o `[{}]` por defecto
+en cada llamada); ahora se cachea el modelo leído una vez en `consultas`.
+
+Con `tracemalloc` mide la memoria que retiene cada entrada de caché y el pico de
+memoria asignada durante cada petición, más su tiempo, con las dos formas; y lo
+mismo al leer una previsión de OWM (`leer_prevision`, antes de cachearla).
+
+Lo que baja es la memoria retenida y la lectura de la previsión. El pico de
+formatear una petición ya cacheada apenas cambia: lo domina el texto que se devuelve,
+que es el mismo con dicts o con modelos.
+
+    python benchmarks/bench_modelos.py
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import agregacion  # noqa: E402
+import lote  # noqa: E402
+import modelos  # noqa: E402
+import telegram_bot  # noqa: E402
+from benchmarks.fake_owm import cargar_grabados  # noqa: E402
+from modelos import Observacion, Prevision, ResumenDia  # noqa: E402
+
+
+# --- Lo de antes: los dicts de OWM recorridos en cada petición ---
+
+def _texto_bot_dict(ciudad, clima):
+    desc = clima.get('weather', [{}])[0].get('description', '—').capitalize()
+    temp = clima.get('main', {}).get('temp', '—')
+    feels = clima.get('main', {}).get('feels_like', '—')
+    hum = clima.get('main', {}).get('humidity', '—')
+    wind = clima.get('wind', {})
+    wind_s = wind.get('speed', '—')
+    arrow, label, deg_val = modelos.deg_to_arrow(wind.get('deg', '—'))
+    if deg_val == '—':
+        viento_text = f"{wind_s} m/s"
+    else:
+        viento_text = f"{wind_s} m/s {arrow} {int(deg_val)}° ({label})"
+    return (f'Clima en {ciudad}: {desc}\n'
+            f'Temperatura: {temp}°C (sensación térmica {feels}°C)\n'
+            f'Humedad: {hum}%\n'
+            f'Vento: {viento_text}')
+
+
+def _tarjetas_dict(prevision):
+    tarjetas = []
+    tz_offset = prevision.get('timezone_offset', 0)
+    for day in prevision.get('daily', [])[:7]:
+        fecha = datetime.utcfromtimestamp(day.get('dt', 0) + tz_offset).strftime('%a %d %b')
+        w = day.get('weather', [{}])[0]
+        temp = day.get('temp', {})
+        wind_speed = day.get('wind', {}).get('speed', '—')
+        arrow, label, deg_val = modelos.deg_to_arrow(day.get('wind', {}).get('deg'))
+        if deg_val == '—':
+            viento = f"Viento: {wind_speed} m/s"
+        else:
+            viento = f"Viento: {wind_speed} m/s {arrow} {int(deg_val)}° ({label})"
+        tarjetas.append({
+            'fecha': f"**{fecha}**",
+            'icono': w.get('icon'),
+            'descripcion': w.get('description', '—').capitalize(),
+            'temperaturas': f"{temp.get('day', '—')}°C (min {temp.get('min', '—')} / max {temp.get('max', '—')})",
+            'precipitacion': f"Prob. precipitación: {int(day.get('pop', 0) * 100)}%",
+            'viento': viento,
+        })
+    return tarjetas
+
+
+def _fila_lote_dict(entrada, clima, prevision):
+    main = clima.get('main', {})
+    wind = clima.get('wind', {})
+    weather = (clima.get('weather') or [{}])[0]
+    hoy = (prevision or {}).get('daily') or [{}]
+    hoy_temp = hoy[0].get('temp', {})
+    return {
+        'entrada': entrada['entrada'], 'ciudad': clima.get('name') or entrada['entrada'],
+        'pais': clima.get('sys', {}).get('country'),
+        'lat': entrada.get('lat', clima.get('coord', {}).get('lat')),
+        'lon': entrada.get('lon', clima.get('coord', {}).get('lon')),
+        'temp': main.get('temp'), 'sensacion': main.get('feels_like'), 'humedad': main.get('humidity'),
+        'viento': wind.get('speed'), 'viento_deg': wind.get('deg'),
+        'descripcion': weather.get('description'), 'icono': weather.get('icon'),
+        'min_hoy': hoy_temp.get('min'), 'max_hoy': hoy_temp.get('max'), 'pop_hoy': hoy[0].get('pop'),
+        'error': None, 'clima': clima, 'prevision': prevision,
+    }
+
+
+# --- Medidas ---
+
+def retenida_por_entrada(construir, n=500) -> float:
+    """Bytes que siguen vivos por cada valor que devuelve `construir()` (lo que ocupa en caché)."""
+    construir()
+    tracemalloc.start()
+    valores = [construir() for _ in range(n)]
+    retenida = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del valores
+    return retenida / n
+
+
+def pico_por_llamada(fn, n=50) -> float:
+    """Mediana del pico de memoria asignada durante una llamada a `fn` (bytes)."""
+    fn()
+    picos = []
+    for _ in range(n):
+        tracemalloc.start()
+        fn()
+        picos.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return statistics.median(picos)
+
+
+def us_por_llamada(fn, repeticiones=5) -> float:
+    temporizador = timeit.Timer(fn)
+    numero, _ = temporizador.autorange()
+    return min(temporizador.repeat(repeticiones, numero)) / numero * 1e6
+
+
+def medir() -> dict:
+    """{caso: {'dicts': ..., 'modelos': ...}} en bytes (memoria) y µs (tiempo)."""
+    grabados = cargar_grabados()
+    cuerpo_clima = json.dumps(grabados['weather']).encode()
+    cuerpo_prevision = json.dumps(grabados['forecast']).encode()
+
+    def prevision_dict():
+        city, slots = agregacion.leer_forecast(cuerpo_prevision)
+        zona = city.get('timezone', 0)
+        return {'daily': agregacion.resumen_diario_incremental(slots, zona, max_days=5),
+                'timezone_offset': zona, 'recibido': 0}
+
+    def prevision_modelo():
+        # Como `consultas.leer_prevision`: de los acumuladores a `ResumenDia`, sin dicts
+        city, slots = agregacion.leer_forecast(cuerpo_prevision)
+        zona = city.get('timezone', 0)
+        return Prevision(zona, tuple(ResumenDia(*dia) for dia in agregacion.dias_incremental(slots, zona, max_days=5)), 0)
+
+    clima_d, clima_m = json.loads(cuerpo_clima), Observacion.desde_owm(json.loads(cuerpo_clima))
+    prevision_d, prevision_m = prevision_dict(), prevision_modelo()
+    entrada = {'entrada': 'Madrid', 'lat': 40.42, 'lon': -3.7}
+
+    import app  # sólo para sus tarjetas (importa Streamlit)
+
+    casos = {
+        'leer_prevision': (prevision_dict, prevision_modelo),
+        'texto_bot': (lambda: _texto_bot_dict('Madrid', clima_d),
+                      lambda: telegram_bot._formatear_clima('Madrid', clima_m)),
+        'tarjetas_prevision': (lambda: _tarjetas_dict(prevision_d), lambda: app._tarjetas(prevision_m)),
+        'fila_lote': (lambda: _fila_lote_dict(entrada, clima_d, prevision_d),
+                      lambda: lote._fila_resultado(entrada, None, clima_m, prevision_m)),
+    }
+    resultados = {
+        'cache_clima_bytes': {'dicts': retenida_por_entrada(lambda: json.loads(cuerpo_clima)),
+                              'modelos': retenida_por_entrada(lambda: Observacion.desde_owm(json.loads(cuerpo_clima)))},
+        'cache_prevision_bytes': {'dicts': retenida_por_entrada(prevision_dict),
+                                  'modelos': retenida_por_entrada(prevision_modelo)},
+    }
+    for caso, (con_dicts, con_modelos) in casos.items():
+        resultados[f'{caso}_pico_bytes'] = {'dicts': pico_por_llamada(con_dicts), 'modelos': pico_por_llamada(con_modelos)}
+        resultados[f'{caso}_us'] = {'dicts': us_por_llamada(con_dicts), 'modelos': us_por_llamada(con_modelos)}
+    return {caso: {forma: round(v, 2) for forma, v in r.items()} for caso, r in resultados.items()}
+
+
+def main(args):
+    resultados = medir()
+    print(f'{"":<28} {"dicts":>10} {"modelos":>10} {"cambio":>8}')
+    for caso, r in resultados.items():
+        print(f'{caso:<28} {r["dicts"]:>10.1f} {r["modelos"]:>10.1f} {r["modelos"] / r["dicts"] - 1:>+8.0%}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    main(parser.parse_args())
@@ -0,0 +1,81 @@
+"""Compara el camino actual de la previsión (`json.loads` + `resumen_diario`) con el
+incremental (`leer_forecast` + `resumen_diario_incremental`): tiempo por ciudad y pico
+de memoria (tracemalloc) de una ciudad y de un lote procesado ciudad a ciudad, sin
+contar las salidas que se van guardando.
+
+    python benchmarks/bench_prevision.py --ciudades 1 100 1000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import agregacion  # noqa: E402
+from benchmarks.fake_owm import cargar_grabados, payload_forecast  # noqa: E402
+
+
+def completo(cuerpo):
+    forecast3h = json.loads(cuerpo)
+    return agregacion.resumen_diario(forecast3h, max_days=5)
+
+
+def incremental(cuerpo):
+    city, slots = agregacion.leer_forecast(cuerpo)
+    return agregacion.resumen_diario_incremental(slots, city.get('timezone', 0), max_days=5)
+
+
+MODOS = {'completo': completo, 'incremental': incremental}
+
+
+def _cuerpos(n):
+    """Respuestas de /forecast como bytes, tal como llegan: la grabada y sintéticas."""
+    cuerpos = [json.dumps(cargar_grabados()['forecast']).encode()]
+    for i in range(1, n):
+        fj = payload_forecast((i * 0.731) % 180 - 90, (i * 1.37) % 360 - 180)
+        fj['city']['timezone'] = (i % 27 - 12) * 3600
+        cuerpos.append(json.dumps(fj).encode())
+    return cuerpos
+
+
+def _tiempo_us(fn, cuerpos, repeticiones):
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        for cuerpo in cuerpos:
+            fn(cuerpo)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor / len(cuerpos) * 1e6
+
+
+def _pico_kib(fn, cuerpos):
+    """Pico de memoria procesando el lote ciudad a ciudad, por encima de las salidas guardadas."""
+    salidas = []
+    tracemalloc.start()
+    for cuerpo in cuerpos:
+        salidas.append(fn(cuerpo))
+    actual, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (pico - actual) / 1024
+
+
+def main(args):
+    print(f'{"ciudades":>9} {"modo":>12} {"µs/ciudad":>10} {"pico 1 (KiB)":>13} {"pico lote (KiB)":>16}')
+    for n in args.ciudades:
+        cuerpos = _cuerpos(n)
+        for cuerpo in cuerpos:
+            assert completo(cuerpo) == incremental(cuerpo), 'la salida incremental no coincide'
+        rep = max(1, min(50, 2000 // n))
+        for nombre, fn in MODOS.items():
+            us = _tiempo_us(fn, cuerpos, rep)
+            print(f'{n:>9} {nombre:>12} {us:>10.1f} {_pico_kib(fn, cuerpos[:1]):>13.1f} '
+                  f'{_pico_kib(fn, cuerpos):>16.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ciudades', type=int, nargs='+', default=[1, 100, 1000])
+    main(parser.parse_args())
@@ -0,0 +1,76 @@
+"""Render de una búsqueda en el dashboard (AppTest de Streamlit) con los iconos como URL
+de openweathermap.org (`ICONOS=0`, lo de antes) o servidos desde memoria (`iconos.py`).
+
+Con los datos ya en caché mide el tiempo de servidor del rerun que pinta la búsqueda y
+cuenta las imágenes que el navegador tendría que pedir fuera (a openweathermap.org)
+en cada búsqueda. Con `--latencia-icono` estima lo que eso supone en un enlace lento:
+el navegador pide esos iconos después de recibir la página (hasta 6 a la vez por host).
+
+    python benchmarks/bench_render.py --ciudades 10 --latencia-icono 0.3
+"""
+import argparse
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from benchmarks.fake_owm import iniciar_servidor  # noqa: E402
+
+CONEXIONES_POR_HOST = 6  # las de un navegador con HTTP/1.1
+
+
+def _busqueda(ciudad):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(RAIZ, 'app.py'), default_timeout=60).run()
+    at.selectbox(key='ciudad').set_value(ciudad)
+    inicio = time.perf_counter()
+    at.button[0].click().run()
+    ms = (time.perf_counter() - inicio) * 1000
+    assert not at.exception, at.exception
+    externas = sum(1 for im in at.get('imgs') for img in im.proto.imgs if img.url.startswith('http'))
+    return ms, externas
+
+
+def main(args):
+    servidor = iniciar_servidor(grabados=True)
+    directorio = tempfile.mkdtemp()
+    os.environ.update({
+        'OWM_BASE_URL': servidor.url, 'API_KEY': 'falsa', 'GEO_CACHE_DB': os.path.join(directorio, 'geo.sqlite'),
+        'HISTORICO': '0', 'PRECALENTADO': '0', 'METRICAS_PUERTO_DASHBOARD': '0',
+        'OWM_LLAMADAS_MINUTO': '1000000', 'OWM_RAFAGA': '1000000',
+        'ICONOS_URL': f'{servidor.url}/img/wn', 'ICONOS_DIR': os.path.join(directorio, 'iconos'),
+    })
+    import iconos
+    import nomenclator
+
+    ciudades = nomenclator.opciones(args.ciudades)
+    print(f'{"iconos":>8} {"render p50":>11} {"imágenes fuera/búsqueda":>24} {"espera estimada":>16}')
+    try:
+        for modo, activado in (('url', False), ('memoria', True)):
+            iconos.almacen.activado = activado
+            if activado:
+                iconos.almacen.precargar()
+            for ciudad in ciudades:  # calentar la caché de clima y previsión
+                _busqueda(ciudad)
+            medidas = [_busqueda(ciudad) for ciudad in ciudades]
+            externas = statistics.mean(e for _, e in medidas)
+            # Tandas de `CONEXIONES_POR_HOST` peticiones, cada una con la latencia del enlace
+            espera = math.ceil(externas / CONEXIONES_POR_HOST) * args.latencia_icono * 1000
+            print(f'{modo:>8} {statistics.median(ms for ms, _ in medidas):>9.1f}ms {externas:>24.1f} '
+                  f'{espera:>14.0f}ms')
+    finally:
+        servidor.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ciudades', type=int, default=10)
+    parser.add_argument('--latencia-icono', type=float, default=0.3,
+                        help='latencia de cada icono en un enlace lento (s), para la estimación')
+    main(parser.parse_args())
@@ -0,0 +1,101 @@
+"""Varias réplicas del dashboard (procesos) piden a la vez las mismas ciudades al OWM falso:
+cuenta las llamadas que llegan a OpenWeatherMap con cada backend de `cache_compartida`.
+
+Con `memoria` cada réplica hace sus propias llamadas (y su propia caché de geocoding, como
+en máquinas distintas); con `sqlite` deberían llegar una por ciudad y endpoint.
+
+    python benchmarks/bench_replicas.py --replicas 4 --ciudades 20 --backends memoria sqlite
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from benchmarks.fake_owm import iniciar_servidor  # noqa: E402
+
+
+def _consulta(ciudad):
+    import app
+
+    ubicacion = app.owm.obtener_ubicacion(ciudad)
+    if ubicacion:
+        app.owm.obtener_clima_hoy(ubicacion.lat, ubicacion.lon)
+        app.owm.obtener_prevision_5dias(ubicacion.lat, ubicacion.lon)
+
+
+def _replica(n, entorno, ciudades, hilos, barrera, resultados):
+    os.environ.update(entorno)
+    if entorno['CACHE_BACKEND'] == 'memoria':
+        os.environ['GEO_CACHE_DB'] = os.path.join(entorno['DIR_BENCH'], f'geo_{n}.sqlite')
+    sys.path.insert(0, RAIZ)
+    import app  # noqa: F401  (importar antes de la barrera: Streamlit tarda en cargar)
+
+    barrera.wait()
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(hilos) as pool:
+        list(pool.map(_consulta, ciudades))
+    resultados.put(time.perf_counter() - inicio)
+
+
+def ronda(backend, args, servidor):
+    directorio = tempfile.mkdtemp()
+    entorno = {
+        'CACHE_BACKEND': backend,
+        'CACHE_DB': os.path.join(directorio, 'cache.sqlite'),
+        'GEO_CACHE_DB': os.path.join(directorio, 'geo.sqlite'),
+        'DIR_BENCH': directorio,
+        'OWM_BASE_URL': servidor.url,
+        'API_KEY': 'falsa',
+        'PRECALENTADO': '0',
+        'HISTORICO': '0',
+        'OWM_LLAMADAS_MINUTO': '1000000',
+        'OWM_RAFAGA': '1000000',
+        'METRICAS_PUERTO_DASHBOARD': '0',
+    }
+    ciudades = [f'Replica {backend} {i}' for i in range(args.ciudades)]
+    ctx = multiprocessing.get_context('spawn')
+    barrera = ctx.Barrier(args.replicas + 1)
+    resultados = ctx.Queue()
+    procesos = [ctx.Process(target=_replica, args=(n, entorno, ciudades, args.hilos, barrera, resultados))
+                for n in range(args.replicas)]
+    for p in procesos:
+        p.start()
+    antes = dict(servidor.peticiones)
+    barrera.wait()
+    duraciones = [resultados.get() for _ in procesos]
+    for p in procesos:
+        p.join()
+    llamadas = {ruta: n - antes.get(ruta, 0) for ruta, n in servidor.peticiones.items() if n > antes.get(ruta, 0)}
+    return {'llamadas': llamadas, 'total': sum(llamadas.values()), 'duracion_ms': round(max(duraciones) * 1000, 1)}
+
+
+def main(args):
+    servidor = iniciar_servidor(latencia=args.latencia)
+    ideal = args.ciudades * 3
+    print(f'{args.replicas} réplicas x {args.ciudades} ciudades (mínimo posible: {ideal} llamadas)')
+    print(f'{"backend":>9} {"llamadas":>9} {"geo":>5} {"weather":>8} {"forecast":>9} {"duración":>10}')
+    try:
+        for backend in args.backends:
+            r = ronda(backend, args, servidor)
+            ll = r['llamadas']
+            print(f'{backend:>9} {r["total"]:>9} {ll.get("/geo/1.0/direct", 0):>5} '
+                  f'{ll.get("/data/2.5/weather", 0):>8} {ll.get("/data/2.5/forecast", 0):>9} '
+                  f'{r["duracion_ms"]:>8.1f}ms')
+    finally:
+        servidor.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--replicas', type=int, default=4)
+    parser.add_argument('--ciudades', type=int, default=20)
+    parser.add_argument('--hilos', type=int, default=4, help='sesiones simultáneas por réplica')
+    parser.add_argument('--latencia', type=float, default=0.05, help='latencia del OWM falso (s)')
+    parser.add_argument('--backends', nargs='+', default=['memoria', 'sqlite'])
+    main(parser.parse_args())
@@ -0,0 +1,151 @@
+"""Prueba de carga del bot en modo webhook, sin red.
+
+Arranca el OWM falso, una Bot API falsa y `telegram_bot.py` como proceso aparte en
+modo webhook; luego envía updates sintéticos al webhook con la concurrencia que usa
+Telegram (`max_connections`) y mide, por mensaje, cuánto tarda en llegar la
+respuesta final del bot (p50/p99), además del tiempo de respuesta del propio
+webhook (que crece cuando actúa la contrapresión). Al final para el bot con SIGINT
+y comprueba que sale limpio.
+
+    python benchmarks/bench_webhook.py --mensajes 500 --workers 8 32 --latencia 0.05
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from benchmarks import fake_owm, fake_telegram  # noqa: E402
+
+TOKEN = '123456:bench'
+SECRETO = 'bench-secreto'
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _esperar_puerto(puerto: int, proceso, timeout: float = 20):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f'el bot terminó al arrancar:\n{proceso.stdout.read()}')
+        try:
+            socket.create_connection(('127.0.0.1', puerto), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError('el webhook no llegó a escuchar')
+
+
+def _arrancar_bot(owm_url, telegram_url, puerto, workers, cola):
+    env = dict(
+        os.environ,
+        BOT_TOKEN=TOKEN, API_KEY='falsa', OWM_BASE_URL=owm_url,
+        TELEGRAM_BASE_URL=f'{telegram_url}/bot',
+        BOT_MODO='webhook', WEBHOOK_URL=f'http://127.0.0.1:{puerto}/telegram', WEBHOOK_PUERTO=str(puerto),
+        WEBHOOK_SECRETO=SECRETO, BOT_WORKERS=str(workers), BOT_COLA_MAXIMA=str(cola),
+        GEO_CACHE_DB=os.path.join(tempfile.mkdtemp(), 'geo.sqlite'),
+        PRECALENTADO_DB=os.path.join(tempfile.mkdtemp(), 'precalentado.sqlite'),
+        HISTORICO_DIR=os.path.join(tempfile.mkdtemp(), 'historico'),
+        OWM_LLAMADAS_MINUTO='1000000', OWM_RAFAGA='1000000', METRICAS_PUERTO_BOT='0',
+        PYTHONUNBUFFERED='1',
+    )
+    proceso = subprocess.Popen([sys.executable, os.path.join(RAIZ, 'telegram_bot.py')], env=env, cwd=RAIZ,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    _esperar_puerto(puerto, proceso)
+    return proceso
+
+
+def _percentil(valores, q):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(q * len(valores)))] * 1000 if valores else float('nan')
+
+
+async def _carga(url, telegram, args, ronda):
+    """Envía los updates y espera las respuestas; devuelve (latencias respuesta, latencias webhook)."""
+    enviados = {}
+    webhook = []
+    semaforo = asyncio.Semaphore(args.concurrencia)
+    base_chat = ronda * 1_000_000
+
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=args.concurrencia), timeout=60) as cliente:
+        async def uno(i):
+            chat_id = base_chat + i
+            update = fake_telegram.update_falso(base_chat + i, chat_id, f'clima Ciudad {i % args.ciudades}')
+            async with semaforo:
+                inicio = time.perf_counter()
+                enviados[chat_id] = inicio
+                r = await cliente.post(url, json=update, headers={'X-Telegram-Bot-Api-Secret-Token': SECRETO})
+                webhook.append(time.perf_counter() - inicio)
+                r.raise_for_status()
+
+        await asyncio.gather(*(uno(i) for i in range(args.mensajes)))
+
+    # La respuesta final es la que no es "Buscando clima..." (que no llega si la
+    # consulta ya estaba recordada, ver `admision`)
+    def final(chat_id):
+        return next((t for t, texto in telegram.respuestas.get(chat_id, ()) if not texto.startswith('Buscando')),
+                    None)
+
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        with telegram.lock:
+            listos = sum(final(c) is not None for c in enviados)
+        if listos == len(enviados):
+            break
+        await asyncio.sleep(0.01)
+    with telegram.lock:
+        finales = {c: final(c) for c in enviados}
+    respuestas = [finales[c] - t for c, t in enviados.items() if finales[c] is not None]
+    return respuestas, webhook
+
+
+def main(args):
+    owm = fake_owm.iniciar_servidor(latencia=args.latencia, grabados=True)
+    telegram = fake_telegram.iniciar_servidor()
+    print(f'{args.mensajes} mensajes, concurrencia {args.concurrencia}, OWM {args.latencia * 1000:.0f} ms')
+    print(f'{"workers":>8} {"resp p50":>9} {"resp p99":>9} {"webhook p50":>12} {"webhook p99":>12} '
+          f'{"msg/s":>8} {"salida":>7}')
+    for ronda, workers in enumerate(args.workers):
+        puerto = _puerto_libre()
+        bot = _arrancar_bot(owm.url, telegram.url, puerto, workers, args.cola)
+        try:
+            inicio = time.perf_counter()
+            respuestas, webhook = asyncio.run(_carga(f'http://127.0.0.1:{puerto}/telegram', telegram, args, ronda))
+            duracion = time.perf_counter() - inicio
+        finally:
+            bot.send_signal(signal.SIGINT)
+            try:
+                codigo = bot.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                bot.kill()
+                codigo = 'colgado'
+        perdidos = args.mensajes - len(respuestas)
+        print(f'{workers:>8} {_percentil(respuestas, 0.5):>7.1f}ms {_percentil(respuestas, 0.99):>7.1f}ms '
+              f'{_percentil(webhook, 0.5):>10.1f}ms {_percentil(webhook, 0.99):>10.1f}ms '
+              f'{len(respuestas) / duracion:>8.1f} {codigo!s:>7}' + (f'  ({perdidos} sin respuesta)' if perdidos else ''))
+    owm.shutdown()
+    telegram.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mensajes', type=int, default=500)
+    parser.add_argument('--concurrencia', type=int, default=40, help='entregas simultáneas (max_connections)')
+    parser.add_argument('--ciudades', type=int, default=100, help='ciudades distintas entre los mensajes')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--cola', type=int, default=100, help='BOT_COLA_MAXIMA')
+    parser.add_argument('--latencia', type=float, default=0.05, help='latencia del OWM falso (s)')
+    main(parser.parse_args())
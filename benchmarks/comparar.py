@@ -0,0 +1,58 @@
+"""Compara dos resultados de `benchmarks/suite.py` y marca las regresiones.
+
+    python benchmarks/comparar.py benchmarks/resultados/abc123.json benchmarks/resultados/def456.json
+
+Sale con código 1 si alguna métrica empeora más que `--umbral` (por defecto 10 %),
+para poder usarlo en CI. `ops_s` es mejor cuanto más alto; el resto (ms, µs), al revés.
+Las diferencias de latencia menores que `--ruido-ms` (rondas en caché) no cuentan.
+"""
+import argparse
+import json
+import sys
+
+
+def _aplanar(datos, prefijo=''):
+    for clave, valor in datos.items():
+        ruta = f'{prefijo}{clave}'
+        if isinstance(valor, dict):
+            yield from _aplanar(valor, ruta + '.')
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            yield ruta, valor
+
+
+def comparar(antes: dict, despues: dict, umbral: float = 0.10, ruido_ms: float = 0.05):
+    """Filas (métrica, antes, después, cambio relativo, ¿regresión?) de las métricas comunes."""
+    a = dict(_aplanar({k: v for k, v in antes.items() if k != 'meta'}))
+    d = dict(_aplanar({k: v for k, v in despues.items() if k != 'meta'}))
+    filas = []
+    for metrica in a.keys() & d.keys():
+        if metrica.endswith('.n') or not a[metrica]:
+            continue
+        cambio = (d[metrica] - a[metrica]) / a[metrica]
+        peor = -cambio if metrica.endswith('ops_s') else cambio
+        if metrica.endswith('_ms') and abs(d[metrica] - a[metrica]) < ruido_ms:
+            peor = 0.0
+        filas.append((metrica, a[metrica], d[metrica], cambio, peor > umbral))
+    return sorted(filas)
+
+
+def main(args):
+    with open(args.antes, encoding='utf-8') as f:
+        antes = json.load(f)
+    with open(args.despues, encoding='utf-8') as f:
+        despues = json.load(f)
+    print(f"{antes['meta']['commit']} -> {despues['meta']['commit']}")
+    filas = comparar(antes, despues, args.umbral, args.ruido_ms)
+    for metrica, a, d, cambio, regresion in filas:
+        marca = '  <-- regresión' if regresion else ''
+        print(f'{metrica:<45} {a:>12.3f} {d:>12.3f} {cambio:>+8.1%}{marca}')
+    return 1 if any(f[4] for f in filas) else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('antes')
+    parser.add_argument('despues')
+    parser.add_argument('--umbral', type=float, default=0.10)
+    parser.add_argument('--ruido-ms', type=float, default=0.05)
+    sys.exit(main(parser.parse_args()))
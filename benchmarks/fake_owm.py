@@ -0,0 +1,282 @@
+"""Servidor local que imita OpenWeatherMap para benchmarks sin red ni API key.
+
+Responde a `/geo/1.0/direct`, `/data/2.5/weather`, `/data/2.5/group` (ids que ya
+haya devuelto `/weather`), `/data/2.5/forecast` y a los iconos `/img/wn/<icono>@2x.png`, reproduciendo las respuestas grabadas en `benchmarks/datos/` (con nombre y
+coordenadas adaptados a cada consulta para que cada ciudad sea distinta) o con
+payloads sintéticos. La latencia por petición y la tasa de errores son configurables.
+
+    python benchmarks/fake_owm.py --latencia 0.05 --tasa-error 0.02
+    python benchmarks/fake_owm.py --grabar Madrid   # regraba los payloads con API_KEY
+"""
+import copy
+import json
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def _semilla(texto: str) -> int:
+    return zlib.crc32(texto.encode('utf-8'))
+
+
+def payload_geo(q: str):
+    s = _semilla(q.lower())
+    nombre = q.split(',')[0].strip().title()
+    return [{
+        'name': nombre,
+        'local_names': {'es': nombre, 'en': nombre},
+        'lat': round((s % 18000) / 100 - 90, 4),
+        'lon': round((s // 18000 % 36000) / 100 - 180, 4),
+        'country': 'ES',
+    }]
+
+
+def payload_weather(lat: float, lon: float):
+    s = _semilla(f'{lat:.2f},{lon:.2f}')
+    return {
+        'coord': {'lon': lon, 'lat': lat},
+        'weather': [{'id': 800, 'main': 'Clear', 'description': 'cielo claro', 'icon': '01d'}],
+        'main': {'temp': 10 + s % 20, 'feels_like': 9 + s % 20, 'temp_min': 8, 'temp_max': 25,
+                 'pressure': 1013, 'humidity': 40 + s % 50},
+        'visibility': 10000,
+        'wind': {'speed': round((s % 120) / 10, 1), 'deg': s % 360},
+        'clouds': {'all': s % 100},
+        'dt': 1765800000,
+        'sys': {'country': 'ES'},
+        'timezone': 3600,
+        'id': id_ciudad(lat, lon),
+        'name': f'Ciudad {s % 1000}',
+        'cod': 200,
+    }
+
+
+def id_ciudad(lat: float, lon: float) -> int:
+    """Id de ciudad estable por coordenadas (el grabado tiene uno solo para todas)."""
+    return _semilla(f'{lat:.2f},{lon:.2f}') % 10_000_000 + 1
+
+
+def item_grupo(cuerpo: dict) -> dict:
+    """Un `/weather` tal como aparece en la lista de `/data/2.5/group`."""
+    item = {k: v for k, v in cuerpo.items() if k not in ('base', 'cod', 'timezone')}
+    item['sys'] = dict(cuerpo.get('sys', {}), timezone=cuerpo.get('timezone', 0))
+    return item
+
+
+def payload_forecast(lat: float, lon: float, inicio: int = 1765800000):
+    s = _semilla(f'{lat:.2f},{lon:.2f}')
+    items = []
+    for i in range(40):
+        t = 5 + (s + i * 7) % 20
+        item = {
+            'dt': inicio + i * 10800,
+            'main': {'temp': t, 'feels_like': t - 1, 'temp_min': t - 1.5, 'temp_max': t + 1.5,
+                     'humidity': 50 + i % 40},
+            'weather': [{'id': 500, 'main': 'Rain', 'description': 'lluvia ligera', 'icon': '10d'}],
+            'wind': {'speed': round(((s + i) % 90) / 10, 1), 'deg': (s + i * 23) % 360},
+            'pop': round(((s + i) % 10) / 10, 1),
+        }
+        if i % 5 == 0:
+            item['rain'] = {'3h': 0.4}
+        items.append(item)
+    return {'cod': '200', 'cnt': 40, 'list': items,
+            'city': {'name': f'Ciudad {s % 1000}', 'coord': {'lat': lat, 'lon': lon},
+                     'country': 'ES', 'timezone': 3600}}
+
+
+DATOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'datos')
+ENDPOINTS = {'geo': '/geo/1.0/direct', 'weather': '/data/2.5/weather', 'forecast': '/data/2.5/forecast'}
+RUTA_GRUPO = '/data/2.5/group'
+RUTA_ICONOS = '/img/wn/'
+
+
+def png_icono(codigo: str, lado: int = 100) -> bytes:
+    """PNG en escala de grises de `lado` px (como los @2x de OWM), distinto por icono."""
+    def trozo(tipo, datos):
+        return struct.pack('>I', len(datos)) + tipo + datos + struct.pack('>I', zlib.crc32(tipo + datos))
+
+    gris = _semilla(codigo) % 256
+    filas = b''.join(b'\x00' + bytes([gris]) * lado for _ in range(lado))
+    return (b'\x89PNG\r\n\x1a\n' + trozo(b'IHDR', struct.pack('>IIBBBBB', lado, lado, 8, 0, 0, 0, 0))
+            + trozo(b'IDAT', zlib.compress(filas)) + trozo(b'IEND', b''))
+
+
+def cargar_grabados(carpeta: str = DATOS) -> dict:
+    """{'geo': [...], 'weather': {...}, 'forecast': {...}} desde los JSON grabados."""
+    grabados = {}
+    for nombre in ENDPOINTS:
+        with open(os.path.join(carpeta, f'{nombre}.json'), encoding='utf-8') as f:
+            grabados[nombre] = json.load(f)
+    return grabados
+
+
+def replay_geo(grabado, q: str):
+    sintetico = payload_geo(q)[0]
+    items = copy.deepcopy(grabado[:1])
+    for item in items:
+        item.update(name=sintetico['name'], lat=sintetico['lat'], lon=sintetico['lon'])
+        item.setdefault('local_names', {})['es'] = sintetico['name']
+    return items
+
+
+def replay_weather(grabado, lat: float, lon: float):
+    cuerpo = copy.deepcopy(grabado)
+    cuerpo['coord'] = {'lon': lon, 'lat': lat}
+    cuerpo['id'] = id_ciudad(lat, lon)
+    return cuerpo
+
+
+def replay_forecast(grabado, lat: float, lon: float):
+    cuerpo = copy.deepcopy(grabado)
+    cuerpo.setdefault('city', {})['coord'] = {'lat': lat, 'lon': lon}
+    return cuerpo
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        servidor = self.server
+        with servidor.lock:
+            servidor.peticiones[url.path] = servidor.peticiones.get(url.path, 0) + 1
+            latencia = servidor.latencia + (servidor.rng.uniform(0, servidor.jitter) if servidor.jitter else 0)
+            fallo = servidor.tasa_error and servidor.rng.random() < servidor.tasa_error
+            if fallo:
+                servidor.errores[url.path] = servidor.errores.get(url.path, 0) + 1
+        if latencia:
+            time.sleep(latencia)
+        if fallo:
+            self._responder(servidor.status_error, {'cod': servidor.status_error, 'message': 'error inyectado'})
+            return
+
+        grabados = servidor.grabados
+        if url.path.startswith(RUTA_ICONOS) and url.path.endswith('@2x.png'):
+            self._responder_png(png_icono(url.path[len(RUTA_ICONOS):-len('@2x.png')]))
+            return
+        if url.path == ENDPOINTS['geo']:
+            cuerpo = replay_geo(grabados['geo'], q.get('q', '')) if grabados else payload_geo(q.get('q', ''))
+        elif url.path == RUTA_GRUPO:
+            ids = [int(i) for i in q.get('id', '').split(',') if i.strip()]
+            if not ids or len(ids) > 20:
+                self._responder(400, {'cod': '400', 'message': 'invalid id list'})
+                return
+            with servidor.lock:
+                coords = [servidor.ids[i] for i in ids if i in servidor.ids]
+            lista = [item_grupo(replay_weather(grabados['weather'], lat, lon) if grabados else payload_weather(lat, lon))
+                     for lat, lon in coords]
+            cuerpo = {'cnt': len(lista), 'list': lista}
+        elif url.path in (ENDPOINTS['weather'], ENDPOINTS['forecast']):
+            lat, lon = float(q['lat']), float(q['lon'])
+            if url.path == ENDPOINTS['weather']:
+                cuerpo = replay_weather(grabados['weather'], lat, lon) if grabados else payload_weather(lat, lon)
+                with servidor.lock:
+                    servidor.ids[cuerpo['id']] = (lat, lon)
+            else:
+                cuerpo = replay_forecast(grabados['forecast'], lat, lon) if grabados else payload_forecast(lat, lon)
+        else:
+            self._responder(404, {'cod': '404', 'message': 'not found'})
+            return
+        self._responder(200, cuerpo)
+
+    def _responder_png(self, datos):
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _responder(self, status, cuerpo):
+        datos = json.dumps(cuerpo).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+
+class ServidorOWMFalso(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, direccion=('127.0.0.1', 0), latencia: float = 0.0, jitter: float = 0.0,
+                 tasa_error: float = 0.0, status_error: int = 503, grabados: bool = False, semilla: int = 0):
+        super().__init__(direccion, _Handler)
+        self.latencia = latencia
+        self.jitter = jitter
+        self.tasa_error = tasa_error
+        self.status_error = status_error
+        self.grabados = cargar_grabados() if grabados else None
+        self.rng = random.Random(semilla)
+        self.lock = threading.Lock()
+        self.peticiones = {}
+        self.errores = {}
+        self.ids = {}  # id de ciudad -> (lat, lon), para /data/2.5/group
+
+    @property
+    def url(self) -> str:
+        host, puerto = self.server_address[:2]
+        return f'http://{host}:{puerto}'
+
+
+def iniciar_servidor(latencia: float = 0.0, **kwargs) -> ServidorOWMFalso:
+    """Arranca el servidor en un hilo daemon; usar `.url` como base y `.shutdown()` al acabar.
+
+    `kwargs` van a `ServidorOWMFalso` (jitter, tasa_error, status_error, grabados, semilla).
+    """
+    servidor = ServidorOWMFalso(latencia=latencia, **kwargs)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def grabar(ciudad: str, api_key: str, carpeta: str = DATOS):
+    """Guarda en `carpeta` las respuestas reales de OWM para `ciudad`."""
+    import requests
+
+    base = 'https://api.openweathermap.org'
+    geo = requests.get(base + ENDPOINTS['geo'], params={'q': ciudad, 'limit': 1, 'appid': api_key}, timeout=10)
+    geo.raise_for_status()
+    items = geo.json()
+    if not items:
+        raise SystemExit(f'Ciudad no encontrada: {ciudad}')
+    params = {'lat': items[0]['lat'], 'lon': items[0]['lon'], 'units': 'metric', 'lang': 'es', 'appid': api_key}
+    respuestas = {'geo': items}
+    for nombre in ('weather', 'forecast'):
+        r = requests.get(base + ENDPOINTS[nombre], params=params, timeout=10)
+        r.raise_for_status()
+        respuestas[nombre] = r.json()
+    for nombre, cuerpo in respuestas.items():
+        with open(os.path.join(carpeta, f'{nombre}.json'), 'w', encoding='utf-8') as f:
+            json.dump(cuerpo, f, ensure_ascii=False, indent=1)
+    print(f'Payloads de {ciudad} guardados en {carpeta}')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--puerto', type=int, default=8765)
+    parser.add_argument('--latencia', type=float, default=0.05, help='segundos por petición')
+    parser.add_argument('--jitter', type=float, default=0.0, help='latencia extra aleatoria (0..jitter s)')
+    parser.add_argument('--tasa-error', type=float, default=0.0, help='fracción de respuestas con error')
+    parser.add_argument('--status-error', type=int, default=503)
+    parser.add_argument('--sintetico', action='store_true', help='payloads generados en vez de los grabados')
+    parser.add_argument('--grabar', metavar='CIUDAD', help='regraba benchmarks/datos/ con la API real')
+    args = parser.parse_args()
+    if args.grabar:
+        grabar(args.grabar, os.environ['API_KEY'])
+        raise SystemExit
+    srv = ServidorOWMFalso(('127.0.0.1', args.puerto), latencia=args.latencia, jitter=args.jitter,
+                           tasa_error=args.tasa_error, status_error=args.status_error,
+                           grabados=not args.sintetico)
+    print(f'OWM falso escuchando en {srv.url} (latencia {args.latencia}s, errores {args.tasa_error:.0%})')
+    srv.serve_forever()
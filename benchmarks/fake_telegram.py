@@ -0,0 +1,94 @@
+"""Servidor local que imita la Bot API de Telegram para probar el bot sin red.
+
+Responde a `getMe`, `setWebhook`, `deleteWebhook`, `getUpdates` (vacío) y
+`sendMessage`, y apunta cuándo llega cada respuesta del bot por chat. Se usa con
+`TELEGRAM_BASE_URL=<url>/bot`.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BOT = {'id': 1, 'is_bot': True, 'first_name': 'Clima', 'username': 'clima_bench_bot'}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _parametros(self):
+        largo = int(self.headers.get('Content-Length') or 0)
+        cuerpo = self.rfile.read(largo).decode('utf-8') if largo else ''
+        if 'json' in (self.headers.get('Content-Type') or ''):
+            return json.loads(cuerpo or '{}')
+        return {k: v[0] for k, v in parse_qs(cuerpo).items()}
+
+    def do_POST(self):
+        metodo = urlparse(self.path).path.rsplit('/', 1)[-1]
+        params = self._parametros()
+        servidor = self.server
+        if metodo == 'getMe':
+            resultado = BOT
+        elif metodo in ('setWebhook', 'deleteWebhook', 'close', 'logOut'):
+            resultado = True
+        elif metodo == 'getUpdates':
+            time.sleep(min(float(params.get('timeout') or 0), 0.5))
+            resultado = []
+        elif metodo == 'sendMessage':
+            chat_id = int(params['chat_id'])
+            with servidor.lock:
+                servidor.mensajes += 1
+                servidor.respuestas.setdefault(chat_id, []).append((time.perf_counter(), params.get('text', '')))
+                message_id = servidor.mensajes
+            resultado = {'message_id': message_id, 'date': int(time.time()), 'from': BOT,
+                         'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')}
+        else:
+            self._responder({'ok': False, 'error_code': 404, 'description': 'Not Found'}, 404)
+            return
+        self._responder({'ok': True, 'result': resultado})
+
+    do_GET = do_POST
+
+    def _responder(self, cuerpo, status=200):
+        datos = json.dumps(cuerpo).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+
+class ServidorTelegramFalso(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, direccion=('127.0.0.1', 0)):
+        super().__init__(direccion, _Handler)
+        self.lock = threading.Lock()
+        self.mensajes = 0
+        self.respuestas = {}  # chat_id -> [(perf_counter, texto), ...]
+
+    @property
+    def url(self) -> str:
+        host, puerto = self.server_address[:2]
+        return f'http://{host}:{puerto}'
+
+
+def iniciar_servidor() -> ServidorTelegramFalso:
+    servidor = ServidorTelegramFalso()
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def update_falso(update_id: int, chat_id: int, texto: str) -> dict:
+    """Update de Telegram con un mensaje de texto privado."""
+    usuario = {'id': chat_id, 'is_bot': False, 'first_name': f'Usuario {chat_id}'}
+    return {
+        'update_id': update_id,
+        'message': {'message_id': update_id, 'date': int(time.time()), 'text': texto,
+                    'chat': {'id': chat_id, 'type': 'private'}, 'from': usuario},
+    }
@@ -0,0 +1,353 @@
+"""Suite de benchmarks reproducible contra el OWM falso; escribe los resultados en JSON.
+
+Mide latencia (p50/p95/p99) y throughput del camino de datos del dashboard
+(`obtener_ubicacion` → `obtener_clima_hoy` → `obtener_prevision_5dias`) y de
+`telegram_bot.handle_message`, en frío (cada ciudad es nueva), en caliente (todo
+en caché) y, en el dashboard, con las ciudades precalentadas por `precalentado.py`
+y la caché en memoria vacía (como tras reiniciar Streamlit), el modo lote (una llamada
+por ciudad frente a `/data/2.5/group`), más micro-benchmarks de la agregación (completa
+e incremental), `deg_to_arrow`, el texto del bot y las tarjetas de previsión, el
+nomenclátor y el histórico, la memoria por entrada de caché y por petición con
+`modelos` frente a los dicts de OWM (`bench_modelos.py`) y el arranque en frío de
+los dos (`bench_arranque.py`).
+
+    python benchmarks/suite.py                       # -> benchmarks/resultados/<commit>.json
+    python benchmarks/suite.py --latencia 0.05 --tasa-error 0.02
+    python benchmarks/comparar.py antes.json despues.json
+"""
+import argparse
+import asyncio
+import dataclasses
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from benchmarks import bench_arranque  # noqa: E402
+from benchmarks.fake_owm import cargar_grabados, iniciar_servidor  # noqa: E402
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'desconocido'
+
+
+def _resumen(latencias, duracion):
+    """Latencias en ms y throughput de una ronda."""
+    ms = sorted(x * 1000 for x in latencias)
+
+    def percentil(q):
+        return round(ms[min(len(ms) - 1, int(q * len(ms)))], 3)
+
+    return {
+        'n': len(ms),
+        'media_ms': round(statistics.fmean(ms), 3),
+        'p50_ms': percentil(0.50),
+        'p95_ms': percentil(0.95),
+        'p99_ms': percentil(0.99),
+        'ops_s': round(len(ms) / duracion, 1),
+    }
+
+
+def _limpiar_caches():
+    import geocodificacion
+    import precalentado
+    from cache_clima import cache as cache_clima
+
+    geocodificacion._cache.limpiar()
+    cache_clima.limpiar()
+    precalentado.almacen.limpiar()
+
+
+def _precalentar(ciudades, base_url):
+    """Lo que haría un ciclo de `precalentado.py` con estas ciudades (ya geocodificadas)."""
+    import geocodificacion
+    import precalentado
+    from owm_async import ClienteOWMAsync
+
+    calientes = [{'lat': u.lat, 'lon': u.lon} for u in (geocodificacion.buscar_en_cache(c)[1] for c in ciudades)]
+
+    async def refrescar():
+        owm = ClienteOWMAsync('falsa', base_url=base_url, max_concurrencia=20)
+        try:
+            for endpoint in precalentado.INTERVALOS:
+                await precalentado.refrescar(owm, endpoint, calientes)
+        finally:
+            await owm.cerrar()
+
+    asyncio.run(refrescar())
+
+
+# --- Dashboard ---
+
+def _consulta_dashboard(ciudad):
+    import app
+
+    inicio = time.perf_counter()
+    ubicacion = app.owm.obtener_ubicacion(ciudad)
+    if ubicacion:
+        app.owm.obtener_clima_hoy(ubicacion.lat, ubicacion.lon)
+        app.owm.obtener_prevision_5dias(ubicacion.lat, ubicacion.lon)
+    return time.perf_counter() - inicio
+
+
+def _ronda_dashboard(ciudades, concurrencia):
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(concurrencia) as pool:
+        latencias = list(pool.map(_consulta_dashboard, ciudades))
+    return _resumen(latencias, time.perf_counter() - inicio)
+
+
+def bench_dashboard(args, base_url):
+    from cache_clima import cache as cache_clima
+
+    resultados = {}
+    for c in args.concurrencias:
+        _limpiar_caches()
+        ciudades = [f'Dashboard {c}-{i}' for i in range(args.consultas)]
+        resultados[f'frio_c{c}'] = _ronda_dashboard(ciudades, c)
+        resultados[f'caliente_c{c}'] = _ronda_dashboard(ciudades, c)
+        _precalentar(ciudades, base_url)
+        cache_clima.limpiar()
+        resultados[f'precalentado_c{c}'] = _ronda_dashboard(ciudades, c)
+    return resultados
+
+
+# --- Modo lote ---
+
+def bench_lote(args, servidor):
+    """`lote.consultar_lote` sobre coordenadas: la primera vez una llamada por ciudad (se
+    aprenden los ids de OWM), la segunda en grupos de 20."""
+    import lote
+    from cache_clima import cache as cache_clima
+
+    _limpiar_caches()
+    entradas = [{'entrada': f'lote {i}', 'lat': round(35 + i * 0.037, 4), 'lon': round(-9 + i * 0.051, 4)}
+                for i in range(args.consultas)]
+    resultados = {}
+    for ronda in ('por_ciudad', 'agrupado'):
+        cache_clima.limpiar()
+        antes = dict(servidor.peticiones)
+        inicio = time.perf_counter()
+        lote.consultar_lote(entradas, 'falsa', con_prevision=False, base_url=servidor.url)
+        resultados[ronda] = {
+            'duracion_ms': round((time.perf_counter() - inicio) * 1000, 3),
+            'llamadas_owm': sum(servidor.peticiones.values()) - sum(antes.values()),
+        }
+    return resultados
+
+
+# --- Bot ---
+
+def _update_falso(texto):
+    async def reply_text(_texto):
+        return None
+    return SimpleNamespace(message=SimpleNamespace(text=texto, reply_text=reply_text))
+
+
+async def _ronda_bot(owm, textos, concurrencia):
+    import telegram_bot
+
+    contexto = SimpleNamespace(application=SimpleNamespace(bot_data={'owm': owm}))
+    semaforo = asyncio.Semaphore(concurrencia)
+    latencias = []
+
+    async def uno(texto):
+        async with semaforo:
+            t0 = time.perf_counter()
+            await telegram_bot.handle_message(_update_falso(texto), contexto)
+            latencias.append(time.perf_counter() - t0)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(uno(t) for t in textos))
+    return _resumen(latencias, time.perf_counter() - inicio)
+
+
+async def _bench_bot_async(args, base_url):
+    from owm_async import ClienteOWMAsync
+
+    resultados = {}
+    for c in args.concurrencias:
+        _limpiar_caches()
+        owm = ClienteOWMAsync('falsa', base_url=base_url, max_concurrencia=max(c, 1) * 2)
+        textos = [f'clima Bot {c}-{i}' for i in range(args.consultas)]
+        try:
+            resultados[f'frio_c{c}'] = await _ronda_bot(owm, textos, c)
+            resultados[f'caliente_c{c}'] = await _ronda_bot(owm, textos, c)
+        finally:
+            await owm.cerrar()
+    return resultados
+
+
+def bench_bot(args, base_url):
+    return asyncio.run(_bench_bot_async(args, base_url))
+
+
+# --- Micro-benchmarks ---
+
+def _por_llamada_us(fn, repeticiones=5):
+    """Mejor tiempo por llamada (µs) de `repeticiones` tandas calibradas con autorange."""
+    temporizador = timeit.Timer(fn)
+    numero, _ = temporizador.autorange()
+    return round(min(temporizador.repeat(repeticiones, numero)) / numero * 1e6, 3)
+
+
+def _historico_90_dias(grabado):
+    """Histórico aparte con 90 días de observaciones cada 10 min de una ciudad."""
+    import historico
+
+    h = historico.Historico(directorio=tempfile.mkdtemp(), volcado=3600, max_buffer=10 ** 6)
+    ahora = int(time.time())
+    for i in range(90 * 144):
+        h.registrar_observacion(40.42, -3.70, dataclasses.replace(grabado, dt=ahora - i * 600))
+    h.volcar()
+    return h
+
+
+def bench_micro():
+    from datetime import timedelta
+
+    import agregacion
+    import app
+    import historico
+    import modelos
+    import nomenclator
+    import telegram_bot
+
+    grabados = cargar_grabados()
+    forecast = grabados['forecast']
+    cuerpo = json.dumps(forecast).encode()
+
+    def incremental():
+        city, slots = agregacion.leer_forecast(cuerpo)
+        agregacion.resumen_diario_incremental(slots, city.get('timezone', 0), 5)
+    clima = modelos.Observacion.desde_owm(grabados['weather'])
+    h = _historico_90_dias(clima)
+    ahora = datetime.now(timezone.utc)
+
+    def serie(dias, segundos):
+        return lambda: historico.reducir(h.consultar(40.42, -3.70, ahora - timedelta(days=dias), columnas=['temp']),
+                                         segundos)
+    grados = [None, '—'] + [i * 7.5 for i in range(48)]
+
+    def flechas(funcion):
+        def todas():
+            for g in grados:
+                funcion(g)
+        return todas
+    prevision = modelos.Prevision.desde_owm({'daily': agregacion.resumen_diario(forecast, 5),
+                                             'timezone_offset': forecast['city']['timezone']})
+
+    return {
+        'resumen_diario_forecast3h_us': _por_llamada_us(lambda: agregacion.resumen_diario(forecast, 5)),
+        'json_mas_resumen_diario_us': _por_llamada_us(lambda: agregacion.resumen_diario(json.loads(cuerpo), 5)),
+        'resumen_incremental_streaming_us': _por_llamada_us(incremental),
+        'deg_to_arrow_x50_us': _por_llamada_us(flechas(modelos.deg_to_arrow)),
+        'texto_bot_formatear_us': _por_llamada_us(lambda: telegram_bot._formatear_clima('Madrid', clima)),
+        'texto_bot_memorizado_us': _por_llamada_us(lambda: telegram_bot.texto_clima('Madrid', clima, 40.4, -3.7)),
+        'tarjetas_prevision_us': _por_llamada_us(lambda: app._tarjetas(prevision)),
+        'nomenclator_exacta_us': _por_llamada_us(lambda: nomenclator.buscar('Córdoba, AR')),
+        'nomenclator_parecidas_us': _por_llamada_us(lambda: nomenclator.parecidas('Barclona')),
+        'nomenclator_prefijo_us': _por_llamada_us(lambda: nomenclator.parecidas('san')),
+        'historico_7d_horario_us': _por_llamada_us(serie(7, 3 * 3600)),
+        'historico_90d_diario_us': _por_llamada_us(serie(90, 86400)),
+    }
+
+
+def bench_memoria_modelos():
+    """Bytes por entrada de caché y pico por petición, con dicts de OWM y con `modelos`."""
+    from benchmarks import bench_modelos
+
+    return {f'{caso}_{forma}': v for caso, r in bench_modelos.medir().items()
+            for forma, v in r.items() if caso.endswith('_bytes')}
+
+
+def bench_arranque_frio(repeticiones=3):
+    """Tiempo hasta estar listos en procesos nuevos (sin el desglose por paquete)."""
+    resultados = {}
+    for entrada in bench_arranque.ENTRADAS:
+        r = bench_arranque.medir(entrada, repeticiones)
+        resultados[entrada] = {'listo_ms': r['listo_ms'], 'min_ms': r['min_ms']}
+    return resultados
+
+
+def main(args):
+    # En procesos nuevos, antes de apuntar el entorno al OWM falso
+    arranque = bench_arranque_frio()
+    servidor = iniciar_servidor(latencia=args.latencia, jitter=args.jitter, tasa_error=args.tasa_error,
+                                status_error=args.status_error, grabados=True, semilla=args.semilla)
+    # Configurar antes de importar los módulos de la app (leen el entorno al importarse)
+    os.environ['OWM_BASE_URL'] = servidor.url
+    os.environ['API_KEY'] = 'falsa'
+    os.environ['GEO_CACHE_DB'] = os.path.join(tempfile.mkdtemp(), 'geo.sqlite')
+    os.environ['PRECALENTADO_DB'] = os.path.join(tempfile.mkdtemp(), 'precalentado.sqlite')
+    os.environ['HISTORICO_DIR'] = os.path.join(tempfile.mkdtemp(), 'historico')
+    os.environ['OWM_LLAMADAS_MINUTO'] = os.environ['OWM_RAFAGA'] = '1000000'
+    os.environ['METRICAS_PUERTO_DASHBOARD'] = os.environ['METRICAS_PUERTO_BOT'] = '0'
+
+    inicio = time.perf_counter()
+    resultados = {
+        'meta': {
+            'commit': _commit(),
+            'fecha': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'parametros': {k: v for k, v in vars(args).items() if k != 'salida'},
+        },
+        'dashboard': bench_dashboard(args, servidor.url),
+        'lote': bench_lote(args, servidor),
+        'bot': bench_bot(args, servidor.url),
+        'micro': bench_micro(),
+        'memoria': bench_memoria_modelos(),
+        'arranque': arranque,
+    }
+    resultados['meta']['peticiones_servidor'] = dict(servidor.peticiones)
+    resultados['meta']['errores_inyectados'] = dict(servidor.errores)
+    resultados['meta']['duracion_s'] = round(time.perf_counter() - inicio, 2)
+    servidor.shutdown()
+
+    salida = args.salida or os.path.join(RAIZ, 'benchmarks', 'resultados', f"{resultados['meta']['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+    with open(salida, 'w', encoding='utf-8') as f:
+        json.dump(resultados, f, ensure_ascii=False, indent=2)
+
+    for seccion in ('dashboard', 'bot'):
+        for ronda, r in resultados[seccion].items():
+            print(f'{seccion:>9} {ronda:>16}  p50 {r["p50_ms"]:>8.2f} ms  p99 {r["p99_ms"]:>8.2f} ms  '
+                  f'{r["ops_s"]:>8.1f} ops/s')
+    for ronda, r in resultados['lote'].items():
+        print(f'{"lote":>9} {ronda:>16}  {r["duracion_ms"]:>8.2f} ms  {r["llamadas_owm"]:>5} llamadas')
+    for nombre, us in resultados['micro'].items():
+        print(f'{"micro":>9} {nombre:>35}  {us:>9.2f} µs')
+    for nombre, valor in resultados['memoria'].items():
+        print(f'{"memoria":>9} {nombre:>35}  {valor:>9.0f} B')
+    for entrada, r in resultados['arranque'].items():
+        print(f'{"arranque":>9} {entrada:>16}  {r["listo_ms"]:>8.1f} ms hasta listo')
+    print(f'Resultados en {salida}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latencia', type=float, default=0.02, help='latencia del servidor falso (s)')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--tasa-error', type=float, default=0.0, help='fracción de respuestas 5xx inyectadas')
+    parser.add_argument('--status-error', type=int, default=503)
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--consultas', type=int, default=100, help='consultas por ronda')
+    parser.add_argument('--concurrencias', type=int, nargs='+', default=[1, 10])
+    parser.add_argument('--salida', help='fichero JSON (por defecto benchmarks/resultados/<commit>.json)')
+    main(parser.parse_args())
@@ -0,0 +1,352 @@
+"""Caché de respuestas de clima actual y previsión, compartida por el dashboard y el bot.
+
+- Clave: (endpoint, lat, lon redondeadas, units, lang).
+- TTL por endpoint: OWM refresca el clima actual cada ~10 min y la previsión 3h aún menos.
+- Single-flight: varias peticiones simultáneas de la misma clave hacen una sola llamada.
+- Stale-while-revalidate: una entrada caducada hace poco se sirve al momento mientras
+  se refresca en segundo plano.
+- Antes de llamar a la API se mira el almacén de `precalentado` (ciudades calientes
+  que otro proceso mantiene al día).
+- Con un backend compartido (`CACHE_BACKEND=sqlite|redis`, ver `cache_compartida`) las
+  réplicas del dashboard y el bot comparten entradas, y el single-flight se extiende
+  entre procesos: sólo una réplica llama a la API por clave y ventana de TTL.
+- En memoria se guardan los objetos de `modelos` tal cual; al backend compartido y
+  desde el almacén de `precalentado` viajan en JSON con la forma de OWM (`a_owm`).
+
+Funciona tanto con hilos (Streamlit) como con asyncio (bot de Telegram).
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import cache_compartida
+import precalentado
+from cache_compartida import BackendMemoria
+from metricas import registro
+from modelos import Observacion, Prevision
+
+TTL_POR_ENDPOINT = {
+    'weather': int(os.getenv('CACHE_TTL_WEATHER', 600)),
+    'forecast': int(os.getenv('CACHE_TTL_FORECAST', 1800)),
+}
+# Tiempo extra tras el TTL durante el que se sirve el dato viejo mientras se refresca
+STALE_POR_ENDPOINT = {
+    'weather': int(os.getenv('CACHE_STALE_WEATHER', 600)),
+    'forecast': int(os.getenv('CACHE_STALE_FORECAST', 1800)),
+}
+DECIMALES_COORD = 2  # ~1 km: misma ciudad aunque el geocoding varíe en el 4º decimal
+MODELO_POR_ENDPOINT = {'weather': Observacion, 'forecast': Prevision}
+
+
+def es_cacheable(valor) -> bool:
+    """Los errores (None o dicts con 'error') nunca se guardan."""
+    if valor is None:
+        return False
+    return not (isinstance(valor, dict) and valor.get('error'))
+
+
+def _desde_json(endpoint, valor):
+    """Un valor leído del backend compartido o del precalentado -> su modelo."""
+    modelo = MODELO_POR_ENDPOINT.get(endpoint)
+    return modelo.desde_owm(valor) if modelo is not None and isinstance(valor, dict) else valor
+
+
+def _a_json(valor):
+    return valor.a_owm() if hasattr(valor, 'a_owm') else valor
+
+
+def _texto(clave) -> str:
+    """Clave del backend compartido: 'weather:40.42,-3.7:metric:es'."""
+    endpoint, lat, lon, units, lang = clave
+    return f'{endpoint}:{lat},{lon}:{units}:{lang}'
+
+
+class CacheClima:
+
+    def __init__(self, ttls=None, stale=None, decimales=DECIMALES_COORD, max_entradas=5000, compartido=None,
+                 backend=None):
+        self.ttls = dict(TTL_POR_ENDPOINT, **(ttls or {}))
+        self.stale = dict(STALE_POR_ENDPOINT, **(stale or {}))
+        self.decimales = decimales
+        self.max_entradas = max_entradas
+        self.compartido = compartido  # `precalentado.AlmacenCaliente` o None
+        # Con un backend compartido (`cache_compartida`) se mantiene delante una copia en
+        # memoria con los mismos vencimientos, para no ir al backend en cada acierto
+        self.backend = backend if backend is not None else BackendMemoria(max_entradas)
+        self._local = BackendMemoria(max_entradas) if self.backend.compartido else self.backend
+        self._remoto = self.backend if self.backend.compartido else None
+        self._en_vuelo = {}  # clave -> concurrent.futures.Future
+        self._en_vuelo_async = {}  # (event loop, clave) -> asyncio.Future
+        self._tareas = set()
+        self._lock = threading.Lock()
+        self._refresco = ThreadPoolExecutor(max_workers=4, thread_name_prefix='cache-clima')
+        self.hits = 0
+        self.hits_caducados = 0
+        self.coalescidas = 0
+        self.misses = 0
+        self.refrescos = 0
+        self.precalentadas = 0
+        self.hits_compartidos = 0  # de los hits, los leídos del backend compartido
+        self.de_otra_replica = 0  # misses/refrescos que resolvió otro proceso
+        self.llamadas_api = 0  # `cargar()` que terminaron bien
+
+    def clave(self, endpoint, lat, lon, units='metric', lang='es'):
+        return (endpoint, round(float(lat), self.decimales), round(float(lon), self.decimales), units, lang)
+
+    def _consultar(self, clave, ahora):
+        """'fresco', 'caducado' o None, junto con el valor."""
+        entrada = self._local.leer(clave, ahora)
+        if self._remoto is not None and (entrada is None or ahora >= entrada[1]):
+            # Otra réplica puede tenerlo (o tenerlo más nuevo)
+            remota = self._remoto.leer(_texto(clave), ahora)
+            if remota is not None and (entrada is None or remota[1] > entrada[1]):
+                remota = (_desde_json(clave[0], remota[0]), remota[1], remota[2])
+                self._local.guardar(clave, *remota)
+                entrada = remota
+                self.hits_compartidos += 1
+        if entrada is None:
+            return None, None
+        valor, fresco_hasta, _ = entrada
+        return ('fresco' if ahora < fresco_hasta else 'caducado'), valor
+
+    def _guardar(self, clave, valor, ttl=None):
+        if not es_cacheable(valor):
+            return
+        endpoint = clave[0]
+        ahora = time.time()
+        ttl = min(ttl, self.ttls.get(endpoint, 600)) if ttl is not None else self.ttls.get(endpoint, 600)
+        fresco_hasta = ahora + ttl
+        servible_hasta = fresco_hasta + self.stale.get(endpoint, 0)
+        self._local.guardar(clave, valor, fresco_hasta, servible_hasta)
+        if self._remoto is not None:
+            self._remoto.guardar(_texto(clave), _a_json(valor), fresco_hasta, servible_hasta)
+
+    def _precalentado(self, clave):
+        """`(valor, validez)` del almacén compartido, o `(None, None)` si no lo tiene."""
+        endpoint, lat, lon, units, lang = clave
+        if self.compartido is None or (units, lang) != ('metric', 'es'):
+            return None, None
+        encontrado = self.compartido.leer(endpoint, lat, lon)
+        if encontrado is None:
+            return None, None
+        self.precalentadas += 1
+        return _desde_json(endpoint, encontrado[0]), encontrado[1]
+
+    def _fresca_remota(self, clave):
+        """Entrada fresca que otra réplica dejó en el backend, o None."""
+        entrada = self._remoto.leer(_texto(clave))
+        return entrada if entrada is not None and time.time() < entrada[1] else None
+
+    def _de_otra_replica(self, clave, entrada):
+        entrada = (_desde_json(clave[0], entrada[0]), entrada[1], entrada[2])
+        self._local.guardar(clave, *entrada)
+        self.de_otra_replica += 1
+        return entrada[0]
+
+    # --- API síncrona (Streamlit) ---
+
+    def _resolver_sync(self, clave, cargar):
+        """Almacén precalentado, otra réplica o `cargar()`; deja el valor guardado."""
+        valor, ttl = self._precalentado(clave)
+        if valor is not None:
+            self._guardar(clave, valor, ttl)
+            return valor
+        token = None
+        if self._remoto is not None:
+            token, entrada = cache_compartida.turno(self._remoto, _texto(clave), lambda: self._fresca_remota(clave))
+            if entrada is not None:
+                return self._de_otra_replica(clave, entrada)
+        try:
+            valor = cargar()
+            self.llamadas_api += 1
+            self._guardar(clave, valor)
+        finally:
+            if token is not None:
+                self._remoto.liberar(_texto(clave), token)
+        return valor
+
+    def _cargar_sync(self, clave, cargar, futuro):
+        try:
+            valor = self._resolver_sync(clave, cargar)
+        except BaseException as e:
+            with self._lock:
+                self._en_vuelo.pop(clave, None)
+            futuro.set_exception(e)
+            raise
+        with self._lock:
+            self._en_vuelo.pop(clave, None)
+        futuro.set_result(valor)
+        return valor
+
+    def obtener(self, endpoint, lat, lon, cargar, units='metric', lang='es'):
+        """Devuelve el valor cacheado o llama a `cargar()` (una sola vez por clave en vuelo)."""
+        clave = self.clave(endpoint, lat, lon, units, lang)
+        estado, valor = self._consultar(clave, time.time())
+        with self._lock:
+            if estado != 'fresco':
+                # La consulta va sin el lock: otro hilo pudo terminar de cargarla entretanto
+                entrada = self._local.leer(clave)
+                if entrada is not None and time.time() < entrada[1]:
+                    estado, valor = 'fresco', entrada[0]
+            if estado == 'fresco':
+                self.hits += 1
+                return valor
+            futuro = self._en_vuelo.get(clave)
+            if estado == 'caducado':
+                self.hits_caducados += 1
+                if futuro is None:
+                    futuro = self._en_vuelo[clave] = Future()
+                    self.refrescos += 1
+                    self._refresco.submit(self._cargar_refresco, clave, cargar, futuro)
+                return valor
+            if futuro is not None:
+                self.coalescidas += 1
+                esperar = True
+            else:
+                futuro = self._en_vuelo[clave] = Future()
+                self.misses += 1
+                esperar = False
+        if esperar:
+            return futuro.result()
+        return self._cargar_sync(clave, cargar, futuro)
+
+    def _cargar_refresco(self, clave, cargar, futuro):
+        try:
+            self._cargar_sync(clave, cargar, futuro)
+        except Exception:
+            pass  # se reintentará en la próxima petición; se sigue sirviendo el dato viejo
+
+    # --- API asíncrona (bot) ---
+
+    async def _resolver_async(self, clave, cargar):
+        valor, ttl = self._precalentado(clave)
+        if valor is not None:
+            self._guardar(clave, valor, ttl)
+            return valor
+        token = None
+        if self._remoto is not None:
+            token, entrada = await cache_compartida.turno_async(self._remoto, _texto(clave),
+                                                               lambda: self._fresca_remota(clave))
+            if entrada is not None:
+                return self._de_otra_replica(clave, entrada)
+        try:
+            valor = await cargar()
+            self.llamadas_api += 1
+            self._guardar(clave, valor)
+        finally:
+            if token is not None:
+                self._remoto.liberar(_texto(clave), token)
+        return valor
+
+    async def _cargar_async(self, clave, cargar, futuro):
+        vuelo = (futuro.get_loop(), clave)
+        try:
+            valor = await self._resolver_async(clave, cargar)
+        except asyncio.CancelledError:
+            self._en_vuelo_async.pop(vuelo, None)
+            futuro.cancel()
+            raise
+        except Exception as e:
+            self._en_vuelo_async.pop(vuelo, None)
+            futuro.set_exception(e)
+            futuro.exception()  # marcar como recuperada si nadie espera este futuro
+            raise
+        self._en_vuelo_async.pop(vuelo, None)
+        futuro.set_result(valor)
+        return valor
+
+    async def _cargar_refresco_async(self, clave, cargar, futuro):
+        try:
+            await self._cargar_async(clave, cargar, futuro)
+        except Exception:
+            pass
+
+    async def obtener_async(self, endpoint, lat, lon, cargar, units='metric', lang='es'):
+        """Como `obtener` pero `cargar` es una corrutina.
+
+        Las peticiones en vuelo se agrupan por event loop (el bot usa uno; las
+        consultas por lotes del dashboard crean el suyo en cada hilo).
+        """
+        clave = self.clave(endpoint, lat, lon, units, lang)
+        estado, valor = self._consultar(clave, time.time())
+        if estado == 'fresco':
+            self.hits += 1
+            return valor
+        loop = asyncio.get_running_loop()
+        vuelo = (loop, clave)
+        futuro = self._en_vuelo_async.get(vuelo)
+        if estado == 'caducado':
+            self.hits_caducados += 1
+            if futuro is None:
+                futuro = self._en_vuelo_async[vuelo] = loop.create_future()
+                self.refrescos += 1
+                tarea = asyncio.create_task(self._cargar_refresco_async(clave, cargar, futuro))
+                self._tareas.add(tarea)
+                tarea.add_done_callback(self._tareas.discard)
+            return valor
+        if futuro is not None:
+            self.coalescidas += 1
+            return await asyncio.shield(futuro)
+        futuro = self._en_vuelo_async[vuelo] = loop.create_future()
+        self.misses += 1
+        return await self._cargar_async(clave, cargar, futuro)
+
+    async def esperar_refrescos(self):
+        """Espera los refrescos en segundo plano de este event loop.
+
+        Quien cierra el loop (o el cliente que usan) justo al acabar, como el modo
+        lote con su `asyncio.run`, debe llamarlo antes: si no, los refrescos se
+        cancelan o se quedan sin cliente y el dato caducado sigue sirviéndose.
+        """
+        loop = asyncio.get_running_loop()
+        tareas = [t for t in self._tareas if t.get_loop() is loop]
+        if tareas:
+            await asyncio.gather(*tareas, return_exceptions=True)
+
+    # --- utilidades ---
+
+    def limpiar(self):
+        self._local.limpiar()
+        if self._remoto is not None:
+            self._remoto.limpiar()
+
+    def estadisticas(self) -> dict:
+        servidas = self.hits + self.hits_caducados + self.coalescidas
+        peticiones = servidas + self.misses
+        # Misses y refrescos que llegaron a OWM y respondió (no los precalentados, los de
+        # otra réplica ni los que fallaron)
+        llamadas_api = self.llamadas_api
+        return {
+            'peticiones': peticiones,
+            'hits': self.hits,
+            'hits_caducados': self.hits_caducados,
+            'coalescidas': self.coalescidas,
+            'misses': self.misses,
+            'refrescos': self.refrescos,
+            'precalentadas': self.precalentadas,
+            'hits_compartidos': self.hits_compartidos,
+            'de_otra_replica': self.de_otra_replica,
+            'llamadas_api': llamadas_api,
+            'llamadas_ahorradas': peticiones - llamadas_api,
+            'hit_ratio': round((servidas + self.precalentadas + self.de_otra_replica) / peticiones, 3)
+            if peticiones else 0.0,
+            'entradas': len(self._local),
+        }
+
+
+cache = CacheClima(compartido=precalentado.almacen, backend=cache_compartida.backend)
+
+
+@registro.colector
+def _colector():
+    e = cache.estadisticas()
+    yield ('cache_consultas_total', 'counter', 'Consultas a las cachés por capa y resultado', [
+        ({'capa': 'clima', 'resultado': r}, e[campo])
+        for r, campo in (('hit', 'hits'), ('hit_caducado', 'hits_caducados'),
+                         ('coalescida', 'coalescidas'), ('miss', 'misses'),
+                         ('hit_compartido', 'hits_compartidos'), ('otra_replica', 'de_otra_replica'))
+    ])
+    yield ('cache_clima_llamadas_ahorradas_total', 'counter',
+           'Llamadas a OWM evitadas por la caché de clima/previsión', [({}, e['llamadas_ahorradas'])])
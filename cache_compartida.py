@@ -0,0 +1,382 @@
+"""Backends de caché intercambiables para clima, previsión y geocodificación.
+
+Con varias réplicas de Streamlit detrás de un balanceador, una caché en memoria es
+por proceso: cada réplica repite las mismas llamadas a OpenWeatherMap. Un backend
+compartido guarda los valores fuera del proceso y ofrece un bloqueo por clave para
+que, entre todas las réplicas, sólo una llame a la API por clave y ventana de TTL.
+
+- `BackendMemoria`: dict en el proceso (comportamiento de siempre).
+- `BackendSQLite`: fichero SQLite en modo WAL; réplicas en la misma máquina.
+- `BackendRedis`: servidor Redis (o compatible: Valkey, KeyDB...); réplicas en varias
+  máquinas. Necesita `pip install redis`.
+
+Todos guardan `(valor, fresco_hasta, servible_hasta)` con tiempos absolutos
+(`time.time()`), así el TTL es el mismo lo lea quien lo lea. Los valores de los
+backends compartidos se serializan en JSON. Se elige con `CACHE_BACKEND`.
+
+También guardan el cubo de tokens de `transporte.LimitadorTokens` (`gastar`), para
+que todas las réplicas se repartan las llamadas por minuto del plan de OWM.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+BACKEND = os.getenv('CACHE_BACKEND', 'memoria')  # memoria | sqlite | redis
+RUTA_DB = os.getenv('CACHE_DB', os.path.join('.cache', 'cache_compartida.sqlite'))
+REDIS_URL = os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+# Si quien tiene el bloqueo muere, el bloqueo caduca solo pasado este tiempo
+PLAZO_BLOQUEO = float(os.getenv('CACHE_PLAZO_BLOQUEO', 30))
+# Lo que espera una réplica a que otra traiga el valor antes de pedirlo ella misma
+ESPERA_MAXIMA = float(os.getenv('CACHE_ESPERA_MAXIMA', 10))
+SONDEO = 0.05
+
+
+def _token() -> str:
+    return f'{os.getpid()}:{uuid.uuid4().hex}'
+
+
+def _cubo(tokens, ultimo, ahora, tasa, capacidad, espera_maxima):
+    """Un paso del token bucket: `(tokens, espera, concedida)` (ver `transporte.LimitadorTokens`)."""
+    if tokens is None:
+        tokens, ultimo = capacidad, ahora
+    tokens = min(capacidad, tokens + max(ahora - ultimo, 0.0) * tasa)
+    espera = 0.0 if tokens >= 1 else (1 - tokens) / tasa
+    if espera > espera_maxima:
+        return tokens, espera, False
+    return tokens - 1, espera, True
+
+
+class BackendMemoria:
+    """Entradas y bloqueos en un dict del proceso; seguro entre hilos."""
+
+    compartido = False
+    entre_maquinas = False
+
+    def __init__(self, max_entradas=5000):
+        self.max_entradas = max_entradas
+        self._entradas = {}  # clave -> (valor, fresco_hasta, servible_hasta)
+        self._bloqueos = {}  # clave -> (token, expira)
+        self._cubos = {}  # clave -> (tokens, último relleno)
+        self._lock = threading.Lock()
+
+    def leer(self, clave, ahora=None):
+        """`(valor, fresco_hasta, servible_hasta)` o None si no está o ya no es servible."""
+        ahora = time.time() if ahora is None else ahora
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            if ahora >= entrada[2]:
+                del self._entradas[clave]
+                return None
+            return entrada
+
+    def guardar(self, clave, valor, fresco_hasta, servible_hasta):
+        with self._lock:
+            if len(self._entradas) >= self.max_entradas and clave not in self._entradas:
+                # desalojar la entrada que antes deja de ser servible
+                victima = min(self._entradas, key=lambda k: self._entradas[k][2])
+                del self._entradas[victima]
+            self._entradas[clave] = (valor, fresco_hasta, servible_hasta)
+
+    def bloquear(self, clave, plazo=PLAZO_BLOQUEO):
+        """Token si se consigue el bloqueo de `clave`, None si lo tiene otro."""
+        ahora = time.time()
+        with self._lock:
+            actual = self._bloqueos.get(clave)
+            if actual is not None and actual[1] > ahora:
+                return None
+            token = _token()
+            self._bloqueos[clave] = (token, ahora + plazo)
+            return token
+
+    def liberar(self, clave, token):
+        with self._lock:
+            if self._bloqueos.get(clave, (None,))[0] == token:
+                del self._bloqueos[clave]
+
+    def gastar(self, clave, tasa, capacidad, espera_maxima):
+        """Toma un token del cubo `clave`: `(espera, concedida)`, o None si el backend falla."""
+        ahora = time.time()
+        with self._lock:
+            tokens, ultimo = self._cubos.get(clave, (None, None))
+            tokens, espera, concedida = _cubo(tokens, ultimo, ahora, tasa, capacidad, espera_maxima)
+            self._cubos[clave] = (tokens, max(ahora, ultimo or ahora))
+        return espera, concedida
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def __len__(self):
+        return len(self._entradas)
+
+
+class BackendSQLite:
+    """Fichero SQLite en modo WAL compartido por los procesos de la máquina.
+
+    El bloqueo es una fila en `bloqueos`: un único `INSERT ... ON CONFLICT DO UPDATE`
+    que sólo pisa bloqueos caducados, así que dos procesos no pueden tomarlo a la vez.
+    """
+
+    compartido = True
+    entre_maquinas = False
+
+    def __init__(self, ruta=RUTA_DB):
+        self.ruta = ruta
+        self._conn = None
+        self._lock = threading.Lock()
+        self._escrituras = 0
+
+    def _db(self):
+        if self._conn is None:
+            directorio = os.path.dirname(self.ruta)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            self._conn = sqlite3.connect(self.ruta, timeout=5, check_same_thread=False, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')  # es una caché: basta con no corromperse
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS entradas ('
+                ' clave TEXT PRIMARY KEY, valor TEXT, fresco REAL, servible REAL)'
+            )
+            self._conn.execute('CREATE TABLE IF NOT EXISTS bloqueos (clave TEXT PRIMARY KEY, token TEXT, expira REAL)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS cubos (clave TEXT PRIMARY KEY, tokens REAL, ultimo REAL)')
+        return self._conn
+
+    def leer(self, clave, ahora=None):
+        ahora = time.time() if ahora is None else ahora
+        try:
+            with self._lock:
+                fila = self._db().execute(
+                    'SELECT valor, fresco, servible FROM entradas WHERE clave = ? AND servible > ?', (clave, ahora)
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        if fila is None:
+            return None
+        return json.loads(fila[0]), fila[1], fila[2]
+
+    def guardar(self, clave, valor, fresco_hasta, servible_hasta):
+        texto = json.dumps(valor)
+        try:
+            with self._lock:
+                db = self._db()
+                db.execute('INSERT OR REPLACE INTO entradas VALUES (?, ?, ?, ?)',
+                           (clave, texto, fresco_hasta, servible_hasta))
+                self._escrituras += 1
+                if self._escrituras % 200 == 0:
+                    db.execute('DELETE FROM entradas WHERE servible <= ?', (time.time(),))
+        except sqlite3.Error:
+            pass
+
+    def bloquear(self, clave, plazo=PLAZO_BLOQUEO):
+        token, ahora = _token(), time.time()
+        try:
+            with self._lock:
+                cursor = self._db().execute(
+                    'INSERT INTO bloqueos VALUES (?, ?, ?) ON CONFLICT(clave) DO UPDATE'
+                    ' SET token = excluded.token, expira = excluded.expira WHERE bloqueos.expira <= ?',
+                    (clave, token, ahora + plazo, ahora),
+                )
+        except sqlite3.Error:
+            return token  # sin backend cada proceso se las apaña solo
+        return token if cursor.rowcount == 1 else None
+
+    def liberar(self, clave, token):
+        try:
+            with self._lock:
+                self._db().execute('DELETE FROM bloqueos WHERE clave = ? AND token = ?', (clave, token))
+        except sqlite3.Error:
+            pass
+
+    def gastar(self, clave, tasa, capacidad, espera_maxima):
+        ahora = time.time()
+        try:
+            with self._lock:
+                db = self._db()
+                db.execute('BEGIN IMMEDIATE')  # leer y descontar sin que otro proceso se cuele
+                try:
+                    fila = db.execute('SELECT tokens, ultimo FROM cubos WHERE clave = ?', (clave,)).fetchone()
+                    tokens, ultimo = fila if fila is not None else (None, None)
+                    tokens, espera, concedida = _cubo(tokens, ultimo, ahora, tasa, capacidad, espera_maxima)
+                    db.execute('INSERT OR REPLACE INTO cubos VALUES (?, ?, ?)',
+                               (clave, tokens, max(ahora, ultimo or ahora)))
+                    db.execute('COMMIT')
+                except BaseException:
+                    db.execute('ROLLBACK')
+                    raise
+        except sqlite3.Error:
+            return None
+        return espera, concedida
+
+    def limpiar(self):
+        try:
+            with self._lock:
+                self._db().execute('DELETE FROM entradas')
+        except sqlite3.Error:
+            pass
+
+    def __len__(self):
+        try:
+            with self._lock:
+                return self._db().execute('SELECT COUNT(*) FROM entradas WHERE servible > ?',
+                                          (time.time(),)).fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+
+class BackendRedis:
+    """Servidor Redis o compatible. Las entradas caducan solas (`PX`) al dejar de ser
+    servibles y el bloqueo es `SET NX PX`; se libera con un script que comprueba el token."""
+
+    compartido = True
+    entre_maquinas = True
+    PREFIJO = 'weather:'
+    _LIBERAR = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+    # `_cubo` en Lua; los números vuelven como texto porque Redis trunca los de Lua a enteros
+    _GASTAR = """
+local tasa, capacidad, ahora, maxima = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local cubo = redis.call('hmget', KEYS[1], 'tokens', 'ultimo')
+local tokens, ultimo = tonumber(cubo[1]) or capacidad, tonumber(cubo[2]) or ahora
+tokens = math.min(capacidad, tokens + math.max(ahora - ultimo, 0) * tasa)
+local espera = 0
+if tokens < 1 then espera = (1 - tokens) / tasa end
+if espera > maxima then return {tostring(espera), 0} end
+redis.call('hset', KEYS[1], 'tokens', tostring(tokens - 1), 'ultimo', tostring(math.max(ahora, ultimo)))
+redis.call('expire', KEYS[1], math.ceil(capacidad / tasa) + 60)
+return {tostring(espera), 1}
+"""
+
+    def __init__(self, url=REDIS_URL):
+        import redis  # dependencia opcional: sólo si CACHE_BACKEND=redis
+
+        self._errores = redis.RedisError
+        self._redis = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        self._liberar = self._redis.register_script(self._LIBERAR)
+        self._gastar = self._redis.register_script(self._GASTAR)
+
+    def leer(self, clave, ahora=None):
+        try:
+            texto = self._redis.get(self.PREFIJO + clave)
+        except self._errores:
+            return None
+        if texto is None:
+            return None
+        valor, fresco_hasta, servible_hasta = json.loads(texto)
+        if (time.time() if ahora is None else ahora) >= servible_hasta:
+            return None
+        return valor, fresco_hasta, servible_hasta
+
+    def guardar(self, clave, valor, fresco_hasta, servible_hasta):
+        vida_ms = int((servible_hasta - time.time()) * 1000)
+        if vida_ms <= 0:
+            return
+        try:
+            self._redis.set(self.PREFIJO + clave, json.dumps([valor, fresco_hasta, servible_hasta]), px=vida_ms)
+        except self._errores:
+            pass
+
+    def bloquear(self, clave, plazo=PLAZO_BLOQUEO):
+        token = _token()
+        try:
+            tomado = self._redis.set(f'{self.PREFIJO}bloqueo:{clave}', token, nx=True, px=int(plazo * 1000))
+        except self._errores:
+            return token
+        return token if tomado else None
+
+    def liberar(self, clave, token):
+        try:
+            self._liberar(keys=[f'{self.PREFIJO}bloqueo:{clave}'], args=[token])
+        except self._errores:
+            pass
+
+    def gastar(self, clave, tasa, capacidad, espera_maxima):
+        try:
+            espera, concedida = self._gastar(keys=[f'{self.PREFIJO}cubo:{clave}'],
+                                             args=[tasa, capacidad, time.time(), min(espera_maxima, 1e9)])
+        except self._errores:
+            return None
+        return float(espera), bool(concedida)
+
+    def _interna(self, clave: bytes) -> bool:
+        return b':bloqueo:' in clave or b':cubo:' in clave
+
+    def limpiar(self):
+        try:
+            claves = [c for c in self._redis.scan_iter(self.PREFIJO + '*') if not self._interna(c)]
+            if claves:
+                self._redis.delete(*claves)
+        except self._errores:
+            pass
+
+    def __len__(self):
+        try:
+            return sum(1 for c in self._redis.scan_iter(self.PREFIJO + '*') if not self._interna(c))
+        except self._errores:
+            return 0
+
+
+def crear_backend(nombre: str = BACKEND):
+    if nombre == 'redis':
+        try:
+            return BackendRedis()
+        except ImportError:
+            print('CACHE_BACKEND=redis necesita `pip install redis`; uso sqlite.')
+            nombre = 'sqlite'
+    if nombre == 'sqlite':
+        return BackendSQLite()
+    return BackendMemoria()
+
+
+def _turno(backend, clave, leer, espera):
+    """Generador con la lógica de `turno`: produce las pausas y devuelve el resultado."""
+    limite = time.monotonic() + espera
+    while True:
+        hallado = leer()
+        if hallado is not None:
+            return None, hallado
+        token = backend.bloquear(clave)
+        if token is not None:
+            # Otra réplica pudo guardarlo justo antes de soltar el bloqueo
+            hallado = leer()
+            if hallado is not None:
+                backend.liberar(clave, token)
+                return None, hallado
+            return token, None
+        if time.monotonic() >= limite:
+            return None, None
+        yield SONDEO
+
+
+def turno(backend, clave, leer, espera=ESPERA_MAXIMA):
+    """Single-flight entre procesos para `clave`.
+
+    Devuelve `(token, None)` si le toca a este proceso llamar a la API (guardar el
+    valor y después `backend.liberar(clave, token)`), `(None, hallado)` con lo que
+    devuelva `leer()` si otro proceso ya lo trajo, o `(None, None)` si tras `espera`
+    segundos nadie lo ha traído (se carga sin bloqueo).
+    """
+    pasos = _turno(backend, clave, leer, espera)
+    try:
+        while True:
+            time.sleep(next(pasos))
+    except StopIteration as fin:
+        return fin.value
+
+
+async def turno_async(backend, clave, leer, espera=ESPERA_MAXIMA):
+    """Como `turno`, esperando con `asyncio.sleep`."""
+    pasos = _turno(backend, clave, leer, espera)
+    try:
+        while True:
+            await asyncio.sleep(next(pasos))
+    except StopIteration as fin:
+        return fin.value
+
+
+backend = crear_backend()
@@ -0,0 +1,123 @@
+"""Camino de datos común: geocodificación, clima actual y previsión de OpenWeatherMap.
+
+El dashboard usa `ClienteOWM` (síncrono, `requests`) y el bot, el modo lote y el
+precalentado `owm_async.ClienteOWMAsync`; los dos sólo difieren en el transporte.
+Parámetros, timeouts (los de `transporte`), qué cuenta como error, el paso a
+`modelos` y lo que se apunta al histórico y a los ids de OWM están aquí una vez:
+
+- una ciudad que no existe es `None` (y se cachea);
+- un fallo de red o de la API es `ErrorOWM` (y no se cachea).
+"""
+import time
+from typing import Optional
+
+import agregacion
+import geocodificacion
+import historico
+import transporte
+from cache_clima import cache as cache_clima
+from modelos import Observacion, Prevision, ResumenDia, Ubicacion
+
+PARAMETROS = {'units': 'metric', 'lang': 'es'}
+DIAS_PREVISION = 5
+
+
+class ErrorOWM(Exception):
+    """OpenWeatherMap no respondió o respondió con error."""
+
+
+def error_de_respuesta(respuesta) -> ErrorOWM:
+    try:
+        detalle = respuesta.json().get('message')
+    except (ValueError, AttributeError):
+        detalle = respuesta.text
+    return ErrorOWM(f'OpenWeatherMap respondió {respuesta.status_code}: {detalle or "sin detalle"}')
+
+
+def error_de_red(excepcion: Exception) -> ErrorOWM:
+    """Sin `str()` de la excepción de red: lleva la URL y, con ella, la API key."""
+    if isinstance(excepcion, transporte.LimiteLlamadasExcedido):
+        return ErrorOWM(str(excepcion))
+    return ErrorOWM(f'No se pudo conectar con OpenWeatherMap ({type(excepcion).__name__})')
+
+
+# --- De la respuesta al modelo (sirve para `requests` y para `httpx`) ---
+
+def leer_ubicacion(nombre: str, respuesta) -> Optional[Ubicacion]:
+    """Respuesta de `/geo/1.0/direct` -> ubicación (o `None`), ya guardada en la caché."""
+    if respuesta.status_code != 200:
+        raise error_de_respuesta(respuesta)
+    ubicacion = geocodificacion.parsear_ubicacion(respuesta.json())
+    geocodificacion.guardar_en_cache(nombre, ubicacion)
+    return ubicacion
+
+
+def registrar_clima(lat: float, lon: float, clima: Observacion) -> Observacion:
+    """Lo que se hace con cada clima recibido, venga de `/weather` o de `/group`."""
+    # El id de ciudad permite luego pedirla junto a otras en /data/2.5/group
+    geocodificacion.guardar_id_owm(lat, lon, clima.id)
+    historico.registrar_observacion(lat, lon, clima)
+    return clima
+
+
+def leer_clima(lat: float, lon: float, respuesta) -> Observacion:
+    """Respuesta de `/data/2.5/weather` -> observación."""
+    if respuesta.status_code != 200:
+        raise error_de_respuesta(respuesta)
+    return registrar_clima(lat, lon, Observacion.desde_owm(respuesta.json()))
+
+
+def leer_prevision(lat: float, lon: float, respuesta) -> Prevision:
+    """Respuesta de `/data/2.5/forecast` -> previsión diaria.
+
+    Slot a slot: no se monta el árbol de dicts de los 40 slots, ni listas ni dicts por día.
+    """
+    if respuesta.status_code != 200:
+        raise error_de_respuesta(respuesta)
+    try:
+        city, slots = agregacion.leer_forecast(respuesta.content)
+        zona = city.get('timezone', 0)
+        slots = historico.registrando_prevision(lat, lon, slots)
+        dias = agregacion.dias_incremental(slots, zona, max_days=DIAS_PREVISION)
+    except (ValueError, KeyError, TypeError) as e:
+        raise ErrorOWM(f'Previsión con formato inesperado: {e}') from e
+    return Prevision(zona, tuple(ResumenDia(*dia) for dia in dias), int(time.time()))
+
+
+# --- Cliente síncrono (dashboard) ---
+
+class ClienteOWM:
+    """Misma interfaz que `owm_async.ClienteOWMAsync`, sin `await`."""
+
+    def __init__(self, api_key: str, timeout=transporte.TIMEOUT):
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def _get(self, ruta: str, params: dict):
+        try:
+            return transporte.get(transporte.url_owm(ruta), params=dict(params, appid=self.api_key),
+                                  timeout=self.timeout)
+        except transporte.requests.RequestException as e:  # red, reintentos agotados o limitador
+            raise error_de_red(e) from e
+
+    def obtener_ubicacion(self, nombre: str) -> Optional[Ubicacion]:
+        """Una sola llamada a la API, o ninguna si está en el nomenclátor o en caché."""
+        encontrado, ubicacion = geocodificacion.buscar_en_cache(nombre)
+        if encontrado:
+            return ubicacion
+        token, hallada = geocodificacion.turno(nombre)
+        if hallada is not None:
+            return hallada[0]
+        try:
+            return leer_ubicacion(nombre, self._get('/geo/1.0/direct', {'q': nombre, 'limit': 1}))
+        finally:
+            geocodificacion.soltar(nombre, token)
+
+    def obtener_clima_hoy(self, lat: float, lon: float) -> Observacion:
+        # Cacheado por coordenadas; peticiones simultáneas comparten una sola llamada
+        return cache_clima.obtener('weather', lat, lon, lambda: leer_clima(
+            lat, lon, self._get('/data/2.5/weather', dict(PARAMETROS, lat=lat, lon=lon))))
+
+    def obtener_prevision_5dias(self, lat: float, lon: float) -> Prevision:
+        return cache_clima.obtener('forecast', lat, lon, lambda: leer_prevision(
+            lat, lon, self._get('/data/2.5/forecast', dict(PARAMETROS, lat=lat, lon=lon))))
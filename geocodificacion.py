@@ -0,0 +1,394 @@
+"""Caché de geocodificación compartida por el dashboard, el bot y el modo lote.
+
+Una sola llamada a `/geo/1.0/direct` (ver `consultas`) devuelve coordenadas, nombre
+en español y país; la `modelos.Ubicacion` resultante se guarda en una caché LRU en
+memoria respaldada por SQLite en disco (con TTL y tamaño máximo), de modo que
+búsquedas repetidas no gastan cuota.
+
+También recuerda el id de ciudad de OWM de cada coordenada (viene en `/weather`),
+que es lo que pide `/data/2.5/group` para traer varias ciudades en una llamada.
+
+El SQLite ya lo comparten los procesos de una máquina; con `CACHE_BACKEND=redis` la
+capa de disco pasa a ser el backend de `cache_compartida`, para réplicas en varias
+máquinas. Una ciudad que no está en caché la pide a la API una sola réplica.
+"""
+import asyncio
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import cache_compartida
+import nomenclator
+from metricas import registro
+from modelos import Ubicacion
+
+TTL_GEO = int(os.getenv('GEO_CACHE_TTL', 24 * 3600))
+# Las ciudades no encontradas se recuerdan menos tiempo (erratas, ciudades nuevas...)
+TTL_NO_ENCONTRADA = int(os.getenv('GEO_CACHE_TTL_MISS', 3600))
+MAX_MEMORIA = int(os.getenv('GEO_CACHE_MAX_MEMORIA', 512))
+MAX_DISCO = int(os.getenv('GEO_CACHE_MAX_DISCO', 20000))
+RUTA_DB = os.getenv('GEO_CACHE_DB', os.path.join('.cache', 'geocodificacion.sqlite'))
+TTL_ID_OWM = int(os.getenv('GEO_CACHE_TTL_ID', 30 * 24 * 3600))
+VOLCADO = float(os.getenv('GEO_CACHE_VOLCADO', 1))  # segundos entre escrituras al SQLite
+
+
+def normalizar_consulta(nombre: str) -> str:
+    """Clave de caché: minúsculas y espacios colapsados ('  Madrid ,ES' -> 'madrid ,es')."""
+    return ' '.join((nombre or '').lower().split())
+
+
+class CacheGeocodificacion:
+    """LRU en memoria + almacén SQLite con TTL y desalojo por tamaño.
+
+    Los valores son serializables en JSON o `None` (ciudad no encontrada); con
+    `modelo` (p.ej. `Ubicacion`) en memoria se guardan objetos del modelo y al disco
+    van con su `a_owm()`. Es segura entre hilos (Streamlit ejecuta cada sesión en su
+    propio hilo). Con `backend` (un backend de `cache_compartida`) se usa éste en
+    lugar del SQLite. Cada caché usa su propia `tabla` (o prefijo en el backend), así
+    que ni el desalojo ni `limpiar` de una tocan las entradas de otra.
+
+    Las escrituras (entradas nuevas y, en el SQLite, la hora de último uso de las
+    leídas) se acumulan y un hilo las vuelca cada `volcado` segundos, como
+    `precalentado`: `set` no espera al disco, al backend ni a otro proceso.
+    Las lecturas van por otra conexión (WAL: no esperan a los escritores) y desde
+    asyncio con `get_async`, fuera del event loop.
+    """
+
+    def __init__(self, ruta=RUTA_DB, ttl=TTL_GEO, ttl_no_encontrada=TTL_NO_ENCONTRADA,
+                 max_memoria=MAX_MEMORIA, max_disco=MAX_DISCO, backend=None, modelo=None,
+                 tabla='geocache', volcado=VOLCADO):
+        self.ruta = ruta
+        self.prefijo = 'geo:' if tabla == 'geocache' else tabla + ':'
+        self.backend = backend
+        self.modelo = modelo
+        self.tabla = tabla
+        self.volcado = volcado
+        self.ttl = ttl
+        self.ttl_no_encontrada = ttl_no_encontrada
+        self.max_memoria = max_memoria
+        self.max_disco = max_disco
+        self._memoria = OrderedDict()  # clave -> (expira, valor)
+        self._pendientes = {}  # clave -> (json, expira): por escribir en disco
+        self._usadas = {}  # clave -> hora de la última lectura de disco, por escribir
+        self._lock = threading.Lock()  # memoria y pendientes
+        self._lock_lectura = threading.Lock()
+        self._lock_escritura = threading.Lock()
+        self._lector = None
+        self._escritor = None
+        self._hilo = None
+        self._escrituras = 0
+        self.hits_memoria = 0
+        self.hits_disco = 0
+        self.misses = 0
+
+    def _conectar(self):
+        directorio = os.path.dirname(self.ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        conn = sqlite3.connect(self.ruta, timeout=5, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {self.tabla} ('
+                     ' clave TEXT PRIMARY KEY, valor TEXT, expira REAL, usado REAL)')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {self.tabla}_usado ON {self.tabla}(usado)')
+        conn.commit()
+        return conn
+
+    def _db_lectura(self):
+        if self._lector is None:
+            self._lector = self._conectar()
+        return self._lector
+
+    def _db_escritura(self):
+        if self._escritor is None:
+            self._escritor = self._conectar()
+        return self._escritor
+
+    def _desde_json(self, valor):
+        return self.modelo.desde_owm(valor) if self.modelo is not None and valor is not None else valor
+
+    def _a_json(self, valor):
+        return valor.a_owm() if self.modelo is not None and valor is not None else valor
+
+    def _guardar_memoria(self, clave, expira, valor):
+        self._memoria[clave] = (expira, valor)
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_memoria:
+            self._memoria.popitem(last=False)
+
+    def _buscar_memoria(self, clave, ahora):
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada is not None:
+                if entrada[0] > ahora:
+                    self._memoria.move_to_end(clave)
+                    return 'memoria', entrada[1]
+                del self._memoria[clave]
+            pendiente = self._pendientes.get(clave)
+            if pendiente is not None and pendiente[1] > ahora:
+                # Salió de la LRU antes de llegar al disco
+                valor = self._desde_json(json.loads(pendiente[0]))
+                self._guardar_memoria(clave, pendiente[1], valor)
+                return 'memoria', valor
+        return None, None
+
+    def _buscar_disco(self, clave, ahora):
+        if self.backend is not None:
+            entrada = self.backend.leer(self.prefijo + clave, ahora)
+            if entrada is None:
+                return None, None
+            valor, expira = self._desde_json(entrada[0]), entrada[2]
+        else:
+            try:
+                with self._lock_lectura:
+                    fila = self._db_lectura().execute(f'SELECT valor, expira FROM {self.tabla} WHERE clave = ?',
+                                                      (clave,)).fetchone()
+            except sqlite3.Error:
+                fila = None
+            if not fila or fila[1] <= ahora:
+                return None, None
+            valor, expira = self._desde_json(json.loads(fila[0])), fila[1]
+        with self._lock:
+            self._guardar_memoria(clave, expira, valor)
+            if self.backend is None:
+                self._usadas[clave] = ahora
+                self._arrancar_hilo()
+        return 'disco', valor
+
+    def _buscar(self, clave):
+        """`('memoria'|'disco', valor)` o `(None, None)`, sin tocar los contadores."""
+        ahora = time.time()
+        capa, valor = self._buscar_memoria(clave, ahora)
+        if capa is None:
+            capa, valor = self._buscar_disco(clave, ahora)
+        return capa, valor
+
+    def _contar(self, capa, valor):
+        if capa == 'memoria':
+            self.hits_memoria += 1
+        elif capa == 'disco':
+            self.hits_disco += 1
+        else:
+            self.misses += 1
+        return capa is not None, valor
+
+    def get(self, clave):
+        """Devuelve `(encontrado, valor)`; `valor` puede ser `None` si se cacheó un 'no encontrada'."""
+        return self._contar(*self._buscar(clave))
+
+    async def get_async(self, clave):
+        """Como `get`; si no está en memoria, el disco (o el backend) se lee en otro hilo."""
+        ahora = time.time()
+        capa, valor = self._buscar_memoria(clave, ahora)
+        if capa is None:
+            capa, valor = await asyncio.to_thread(self._buscar_disco, clave, ahora)
+        return self._contar(capa, valor)
+
+    def en_memoria(self, clave):
+        """`(encontrado, valor)` mirando sólo la memoria: no bloquea ni cuenta."""
+        capa, valor = self._buscar_memoria(clave, time.time())
+        return capa is not None, valor
+
+    def set(self, clave, valor):
+        ttl = self.ttl if valor is not None else self.ttl_no_encontrada
+        expira = time.time() + ttl
+        with self._lock:
+            self._guardar_memoria(clave, expira, valor)
+            self._pendientes[clave] = (json.dumps(self._a_json(valor)), expira)
+            self._arrancar_hilo()
+
+    def _arrancar_hilo(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, daemon=True, name=f'{self.tabla}-volcado')
+            self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            time.sleep(self.volcado)
+            self.volcar()
+
+    def volcar(self):
+        """Escribe las entradas y usos pendientes (lo hace el hilo; también al salir)."""
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+            usadas, self._usadas = self._usadas, {}
+        if not pendientes and not usadas:
+            return
+        if self.backend is not None:
+            for clave, (texto, expira) in pendientes.items():
+                try:
+                    self.backend.guardar(self.prefijo + clave, json.loads(texto), expira, expira)
+                except Exception:
+                    pass  # como abajo: se volverá a preguntar
+            return
+        ahora = time.time()
+        with self._lock_escritura:
+            try:
+                db = self._db_escritura()
+                with db:
+                    db.executemany(f'UPDATE {self.tabla} SET usado = ? WHERE clave = ?',
+                                   [(usado, clave) for clave, usado in usadas.items()])
+                    db.executemany(
+                        f'INSERT OR REPLACE INTO {self.tabla} (clave, valor, expira, usado) VALUES (?, ?, ?, ?)',
+                        [(clave, texto, expira, ahora) for clave, (texto, expira) in pendientes.items()],
+                    )
+                    self._escrituras += len(pendientes)
+                    # Limpieza periódica: caducados y, si sobra, los menos usados
+                    if self._escrituras >= 100:
+                        self._escrituras = 0
+                        self._desalojar(db, ahora)
+            except sqlite3.Error:
+                pass  # es una caché: perder un volcado sólo cuesta volver a preguntar
+
+    def _desalojar(self, db, ahora):
+        db.execute(f'DELETE FROM {self.tabla} WHERE expira <= ?', (ahora,))
+        total = db.execute(f'SELECT COUNT(*) FROM {self.tabla}').fetchone()[0]
+        sobrantes = total - self.max_disco
+        if sobrantes > 0:
+            db.execute(
+                f'DELETE FROM {self.tabla} WHERE clave IN '
+                f'(SELECT clave FROM {self.tabla} ORDER BY usado ASC LIMIT ?)',
+                (sobrantes,),
+            )
+
+    def limpiar(self):
+        with self._lock:
+            self._memoria.clear()
+            self._pendientes.clear()
+            self._usadas.clear()
+        if self.backend is not None:
+            return  # el backend caduca solo; no se puede vaciar un prefijo
+        with self._lock_escritura:
+            try:
+                db = self._db_escritura()
+                with db:
+                    db.execute(f'DELETE FROM {self.tabla}')
+            except sqlite3.Error:
+                pass
+
+    def estadisticas(self) -> dict:
+        hits = self.hits_memoria + self.hits_disco
+        total = hits + self.misses
+        return {
+            'hits_memoria': self.hits_memoria,
+            'hits_disco': self.hits_disco,
+            'misses': self.misses,
+            'hit_ratio': round(hits / total, 3) if total else 0.0,
+            'entradas_memoria': len(self._memoria),
+        }
+
+
+# El SQLite ya se comparte en la máquina; un backend entre máquinas (Redis) lo sustituye
+_backend = cache_compartida.backend if cache_compartida.backend.entre_maquinas else None
+_cache = CacheGeocodificacion(backend=_backend, modelo=Ubicacion)
+# Misma tabla, claves 'id_owm:lat,lon'; instancia aparte para no mezclar sus hits con los de geocoding
+_ids_owm = CacheGeocodificacion(ttl=TTL_ID_OWM, max_memoria=MAX_DISCO, backend=_backend, tabla='ids_owm')
+atexit.register(_cache.volcar)
+atexit.register(_ids_owm.volcar)
+
+
+def parsear_ubicacion(items):
+    """Respuesta de `/geo/1.0/direct` -> `Ubicacion`, o `None` si no hay resultados."""
+    return Ubicacion.desde_owm(items[0]) if items else None
+
+
+def buscar_en_cache(nombre: str):
+    """`(encontrado, ubicacion)` sin tocar la red (nomenclátor local y caché); lo usan
+    también los clientes asíncronos."""
+    clave = normalizar_consulta(nombre)
+    if not clave:
+        return True, None
+    ubicacion = nomenclator.buscar(nombre)
+    if ubicacion:
+        return True, ubicacion
+    return _cache.get(clave)
+
+
+async def buscar_en_cache_async(nombre: str):
+    """Como `buscar_en_cache`, sin leer el disco en el event loop."""
+    clave = normalizar_consulta(nombre)
+    if not clave:
+        return True, None
+    ubicacion = nomenclator.buscar(nombre)
+    if ubicacion:
+        return True, ubicacion
+    return await _cache.get_async(clave)
+
+
+def guardar_en_cache(nombre: str, ubicacion):
+    clave = normalizar_consulta(nombre)
+    if clave:
+        _cache.set(clave, ubicacion)
+
+
+def _ya_guardada(clave):
+    capa, valor = _cache._buscar(clave)
+    return None if capa is None else (valor,)
+
+
+def turno(nombre: str):
+    """Single-flight de la consulta `nombre` entre hilos y réplicas (ver `cache_compartida.turno`).
+
+    `(token, None)`: hay que pedirla y luego `soltar(nombre, token)`; `(None, (ubicacion,))`:
+    otra petición ya la guardó.
+    """
+    clave = normalizar_consulta(nombre)
+    return cache_compartida.turno(cache_compartida.backend, 'geo:' + clave, lambda: _ya_guardada(clave))
+
+
+async def turno_async(nombre: str):
+    clave = normalizar_consulta(nombre)
+    return await cache_compartida.turno_async(cache_compartida.backend, 'geo:' + clave,
+                                              lambda: _ya_guardada(clave))
+
+
+def soltar(nombre: str, token):
+    if token is not None:
+        if cache_compartida.backend.compartido:
+            # Las otras réplicas que esperan este turno la buscan en el disco
+            _cache.volcar()
+        cache_compartida.backend.liberar('geo:' + normalizar_consulta(nombre), token)
+
+
+async def soltar_async(nombre: str, token):
+    if token is not None:
+        await asyncio.to_thread(soltar, nombre, token)
+
+
+def _clave_id(lat: float, lon: float) -> str:
+    return f'{float(lat):.2f},{float(lon):.2f}'
+
+def id_owm(lat: float, lon: float):
+    """Id de ciudad de OWM ya visto para estas coordenadas (redondeadas a 2 decimales), o `None`."""
+    encontrado, valor = _ids_owm.get(_clave_id(lat, lon))
+    return valor if encontrado else None
+
+
+async def id_owm_async(lat: float, lon: float):
+    encontrado, valor = await _ids_owm.get_async(_clave_id(lat, lon))
+    return valor if encontrado else None
+
+
+def guardar_id_owm(lat: float, lon: float, id_ciudad):
+    """Recuerda el id; se llama en cada respuesta de `/weather`, así que sólo mira la memoria."""
+    encontrado, valor = _ids_owm.en_memoria(_clave_id(lat, lon))
+    if id_ciudad and (not encontrado or valor != id_ciudad):
+        _ids_owm.set(_clave_id(lat, lon), int(id_ciudad))
+
+
+def estadisticas() -> dict:
+    """Contadores de hits/misses de la caché de geocodificación."""
+    return _cache.estadisticas()
+
+
+@registro.colector
+def _colector():
+    e = _cache.estadisticas()
+    yield ('cache_consultas_total', 'counter', 'Consultas a las cachés por capa y resultado', [
+        ({'capa': 'geocodificacion', 'resultado': 'hit_memoria'}, e['hits_memoria']),
+        ({'capa': 'geocodificacion', 'resultado': 'hit_disco'}, e['hits_disco']),
+        ({'capa': 'geocodificacion', 'resultado': 'miss'}, e['misses']),
+    ])
@@ -0,0 +1,427 @@
+"""Histórico local de observaciones y previsiones en Parquet.
+
+Cada respuesta de `/data/2.5/weather` y cada slot de `/data/2.5/forecast` que llega
+de OpenWeatherMap (dashboard, bot, modo lote o precalentado) se apunta en un buffer
+en memoria; un hilo en segundo plano lo escribe por lotes como ficheros Parquet
+tipados, particionados por ciudad y día:
+
+    .cache/historico/observaciones/ciudad=40.42_-3.70/dia=2025-10-18/<lote>.parquet
+    .cache/historico/previsiones/ciudad=40.42_-3.70/dia=2025-10-18/<lote>.parquet
+
+Sólo se añaden ficheros (escritura atómica con `os.replace`), así que dashboard, bot y
+precalentado pueden escribir a la vez. `consultar` lee sólo las particiones del rango
+con memoria mapeada y filtra en Arrow; `reducir` agrega por intervalos para pintar
+meses de datos sin pasar por dicts. `compactar` une los ficheros de los días cerrados.
+
+pyarrow (y con él pandas) se importa al primer volcado o consulta, no al importar el
+módulo: apuntar es sólo un append y el volcado va en su hilo, así que el arranque del
+dashboard y del bot no paga esos ~0,5 s.
+"""
+import argparse
+import atexit
+import functools
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING
+
+from metricas import registro
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+    from modelos import Observacion
+
+ACTIVADO = os.getenv('HISTORICO', '1') != '0'
+DIRECTORIO = os.getenv('HISTORICO_DIR', os.path.join('.cache', 'historico'))
+VOLCADO = float(os.getenv('HISTORICO_VOLCADO', 60))  # segundos entre escrituras
+MAX_BUFFER = int(os.getenv('HISTORICO_MAX_BUFFER', 2000))  # respuestas que adelantan la escritura
+DECIMALES_COORD = 2  # los mismos que `cache_clima`
+
+
+@functools.cache
+def esquemas() -> dict:
+    """Esquemas Arrow de cada tipo (importa pyarrow la primera vez)."""
+    import pyarrow as pa
+
+    ts = pa.timestamp('s', tz='UTC')
+    texto = pa.dictionary(pa.int16(), pa.string())
+    return {
+        'observaciones': pa.schema([
+            ('ts', ts),
+            ('temp', pa.float32()), ('sensacion', pa.float32()),
+            ('temp_min', pa.float32()), ('temp_max', pa.float32()),
+            ('humedad', pa.int16()), ('presion', pa.int16()),
+            ('viento', pa.float32()), ('viento_deg', pa.int16()), ('nubes', pa.int16()),
+            ('lluvia_1h', pa.float32()), ('nieve_1h', pa.float32()),
+            ('descripcion', texto), ('icono', texto),
+        ]),
+        # Un slot 3h por fila; `emitido` es cuándo se pidió la previsión
+        'previsiones': pa.schema([
+            ('emitido', ts), ('ts', ts),
+            ('temp', pa.float32()), ('temp_min', pa.float32()), ('temp_max', pa.float32()),
+            ('humedad', pa.int16()), ('viento', pa.float32()), ('viento_deg', pa.int16()),
+            ('pop', pa.float32()), ('lluvia_3h', pa.float32()), ('nieve_3h', pa.float32()),
+            ('descripcion', texto), ('icono', texto),
+        ]),
+    }
+
+
+# Columna de tiempo que decide el día de la partición
+_COLUMNA_DIA = {'observaciones': 'ts', 'previsiones': 'emitido'}
+
+filas_escritas = registro.contador('historico_filas_total', 'Filas escritas en el histórico', ('tipo',))
+filas_descartadas = registro.contador('historico_filas_descartadas_total',
+                                      'Filas del histórico que no encajan en el esquema', ('tipo',))
+latencia_escritura = registro.histograma('historico_escritura_segundos', 'Tiempo de cada volcado del histórico')
+
+
+def ciudad(lat: float, lon: float) -> str:
+    """Nombre de la partición de una ciudad: coordenadas redondeadas ('40.42_-3.70')."""
+    return f'{float(lat):.{DECIMALES_COORD}f}_{float(lon):.{DECIMALES_COORD}f}'
+
+
+def _dia(ts: int) -> str:
+    return time.strftime('%Y-%m-%d', time.gmtime(ts))
+
+
+def _entero(valor):
+    # OWM a veces manda 55.0 donde el esquema pide int16 (humedad, grados...)
+    return int(round(valor)) if isinstance(valor, float) else valor
+
+
+def _fila_observacion(clima: 'Observacion') -> dict:
+    return {
+        'ts': clima.dt or int(time.time()),
+        'temp': clima.temp, 'sensacion': clima.sensacion,
+        'temp_min': clima.temp_min, 'temp_max': clima.temp_max,
+        'humedad': _entero(clima.humedad), 'presion': _entero(clima.presion),
+        'viento': clima.viento, 'viento_deg': _entero(clima.viento_deg),
+        'nubes': _entero(clima.nubes), 'lluvia_1h': clima.lluvia_1h, 'nieve_1h': clima.nieve_1h,
+        'descripcion': clima.descripcion, 'icono': clima.icono,
+    }
+
+
+def _fila_prevision(it: dict, emitido: int) -> dict:
+    main = it.get('main') or {}
+    wind = it.get('wind') or {}
+    weather = (it.get('weather') or [{}])[0]
+    return {
+        'emitido': emitido, 'ts': it['dt'],
+        'temp': main.get('temp'), 'temp_min': main.get('temp_min'), 'temp_max': main.get('temp_max'),
+        'humedad': _entero(main.get('humidity')), 'viento': wind.get('speed'), 'viento_deg': _entero(wind.get('deg')),
+        'pop': it.get('pop'),
+        'lluvia_3h': (it.get('rain') or {}).get('3h'), 'nieve_3h': (it.get('snow') or {}).get('3h'),
+        'descripcion': weather.get('description'), 'icono': weather.get('icon'),
+    }
+
+
+def _filas_prevision(forecast3h, emitido: int):
+    # Las previsiones leídas en streaming llegan ya como filas (ver `registrando_prevision`)
+    if isinstance(forecast3h, list):
+        return forecast3h
+    filas = []
+    for it in forecast3h.get('list') or []:
+        _apuntar_fila(filas, it, emitido)
+    return filas
+
+
+def _apuntar_fila(filas: list, it: dict, emitido: int):
+    try:
+        filas.append(_fila_prevision(it, emitido))
+    except (AttributeError, KeyError, TypeError):
+        filas_descartadas.inc(tipo='previsiones')  # un slot sin `dt` no tira el resto
+
+
+class Historico:
+    """Buffer de respuestas + escritor en segundo plano + lectura por rangos."""
+
+    def __init__(self, directorio=DIRECTORIO, volcado=VOLCADO, max_buffer=MAX_BUFFER, activado=ACTIVADO):
+        self.directorio = directorio
+        self.volcado = volcado
+        self.max_buffer = max_buffer
+        self.activado = activado
+        self._buffer = []  # (tipo, ciudad, recibido, respuesta)
+        self._lock = threading.Lock()
+        self._lock_escritura = threading.Lock()
+        self._despertar = threading.Event()
+        self._hilo = None
+        self._ultima_obs = {}  # ciudad -> dt de la última observación apuntada (evita duplicados)
+        self._secuencia = 0
+        self._fs = None  # pyarrow.fs.LocalFileSystem, al primer `consultar`
+
+    # --- ingesta (camino de la petición: sólo un append) ---
+
+    def _apuntar(self, tipo, lat, lon, respuesta):
+        if not self.activado or not respuesta:
+            return
+        with self._lock:
+            self._buffer.append((tipo, ciudad(lat, lon), int(time.time()), respuesta))
+            lleno = len(self._buffer) >= self.max_buffer
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._bucle, daemon=True, name='historico')
+                self._hilo.start()
+        if lleno:
+            self._despertar.set()
+
+    def registrar_observacion(self, lat: float, lon: float, clima: 'Observacion'):
+        """Apunta una observación de `/data/2.5/weather` (se escribe en el próximo volcado)."""
+        self._apuntar('observaciones', lat, lon, clima)
+
+    def registrar_prevision(self, lat: float, lon: float, forecast3h: dict):
+        """Apunta una respuesta cruda de `/data/2.5/forecast` (todos sus slots 3h)."""
+        self._apuntar('previsiones', lat, lon, forecast3h)
+
+    def registrando_prevision(self, lat: float, lon: float, slots):
+        """Deja pasar los slots de una previsión leída en streaming y los apunta al acabar.
+
+        Sólo se guarda la fila de cada slot, no la respuesta entera.
+        """
+        if not self.activado:
+            yield from slots
+            return
+        emitido = int(time.time())
+        filas = []
+        for it in slots:
+            _apuntar_fila(filas, it, emitido)
+            yield it
+        self._apuntar('previsiones', lat, lon, filas)
+
+    def _bucle(self):
+        while True:
+            self._despertar.wait(self.volcado)
+            self._despertar.clear()
+            try:
+                self.volcar()
+            except Exception:
+                pass  # el histórico no debe tumbar el proceso; se reintenta en el próximo volcado
+
+    # --- escritura ---
+
+    def volcar(self):
+        """Convierte el buffer en tablas Arrow y escribe un Parquet por partición.
+
+        Una fila que no encaja en el esquema se descarta sola (y se cuenta), sin llevarse
+        el resto de su partición; si falla la escritura de una partición, sus respuestas
+        vuelven al buffer para el próximo volcado.
+        """
+        with self._lock:
+            buffer, self._buffer = self._buffer, []
+        if not buffer:
+            return
+        reencolar = []
+        with self._lock_escritura, latencia_escritura.medir():
+            particiones = {}  # (tipo, ciudad, dia) -> ([filas], [entradas del buffer])
+            ultimas = {}  # ciudad -> dt de la última observación de este volcado
+            for entrada in buffer:
+                tipo, c, recibido, respuesta = entrada
+                try:
+                    if tipo == 'observaciones':
+                        fila = _fila_observacion(respuesta)
+                        # Dashboard, bot y caché piden a menudo la misma observación de OWM
+                        if ultimas.get(c, self._ultima_obs.get(c)) == fila['ts']:
+                            continue
+                        ultimas[c] = fila['ts']
+                        clave, filas = (tipo, c, _dia(fila['ts'])), [fila]
+                    else:
+                        clave, filas = (tipo, c, _dia(recibido)), _filas_prevision(respuesta, recibido)
+                except (AttributeError, KeyError, TypeError, ValueError, OverflowError):
+                    filas_descartadas.inc(tipo=tipo)
+                    continue
+                filas_particion, entradas = particiones.setdefault(clave, ([], []))
+                filas_particion.extend(filas)
+                entradas.append(entrada)
+            for (tipo, c, dia), (filas, entradas) in particiones.items():
+                tabla = self._tabla(tipo, filas)
+                if tabla.num_rows == 0:
+                    continue
+                try:
+                    self._escribir(tipo, c, dia, tabla.sort_by(_COLUMNA_DIA[tipo]))
+                except Exception:
+                    reencolar += entradas
+                    continue
+                filas_escritas.inc(tabla.num_rows, tipo=tipo)
+                if tipo == 'observaciones':
+                    self._ultima_obs[c] = max(self._ultima_obs.get(c, 0), *(f['ts'] for f in filas))
+        if reencolar:
+            with self._lock:
+                self._buffer[:0] = reencolar
+
+    def _tabla(self, tipo, filas) -> 'pa.Table':
+        import pyarrow as pa
+
+        esquema = esquemas()[tipo]
+        try:
+            return pa.Table.from_pylist(filas, schema=esquema)
+        except (TypeError, ValueError, OverflowError):
+            pass
+        # Alguna fila no encaja: se convierten una a una para descartar sólo ésas
+        buenas = []
+        for fila in filas:
+            try:
+                pa.Table.from_pylist([fila], schema=esquema)
+            except (TypeError, ValueError, OverflowError):
+                filas_descartadas.inc(tipo=tipo)
+                continue
+            buenas.append(fila)
+        return pa.Table.from_pylist(buenas, schema=esquema)
+
+    def _ruta(self, tipo, c, dia=None):
+        ruta = os.path.join(self.directorio, tipo, f'ciudad={c}')
+        return os.path.join(ruta, f'dia={dia}') if dia else ruta
+
+    def _escribir(self, tipo, c, dia, tabla, nombre=None):
+        carpeta = self._ruta(tipo, c, dia)
+        os.makedirs(carpeta, exist_ok=True)
+        if nombre is None:
+            self._secuencia += 1
+            nombre = f'{time.time_ns()}-{os.getpid()}-{self._secuencia}.parquet'
+        destino = os.path.join(carpeta, nombre)
+        temporal = os.path.join(carpeta, f'.{nombre}.tmp')
+        import pyarrow.parquet as pq
+
+        pq.write_table(tabla, temporal, compression='zstd')
+        os.replace(temporal, destino)  # los lectores nunca ven un fichero a medias
+        return destino
+
+    # --- lectura ---
+
+    def _ficheros(self, tipo, c, desde, hasta):
+        ficheros = []
+        dia = desde.date()
+        while dia <= hasta.date():
+            carpeta = self._ruta(tipo, c, dia.isoformat())
+            try:
+                ficheros += [os.path.join(carpeta, f) for f in sorted(os.listdir(carpeta)) if f.endswith('.parquet')]
+            except FileNotFoundError:
+                pass
+            dia += timedelta(days=1)
+        return ficheros
+
+    def consultar(self, lat: float, lon: float, desde: datetime, hasta: datetime = None,
+                  tipo: str = 'observaciones', columnas=None) -> 'pa.Table':
+        """Filas de `tipo` de la ciudad con `desde <= ts < hasta` (UTC; sin `hasta`, hasta
+        ahora mismo), ordenadas por tiempo.
+
+        Sólo abre las particiones de los días del rango, con memoria mapeada, y lee sólo
+        `columnas` (más las de tiempo). Las filas repetidas (mismo `ts` apuntado por
+        varios procesos, o una compactación a medias) salen una vez.
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.dataset as ds
+        import pyarrow.fs as pafs
+
+        esquema = esquemas()[tipo]
+        columna_dia = _COLUMNA_DIA[tipo]
+        if columnas is not None:
+            columnas = list(dict.fromkeys([columna_dia, 'ts', *columnas]))
+        ficheros = self._ficheros(tipo, ciudad(lat, lon), desde, hasta or datetime.now(timezone.utc))
+        if not ficheros:
+            return esquema.empty_table().select(columnas) if columnas else esquema.empty_table()
+        if self._fs is None:
+            self._fs = pafs.LocalFileSystem(use_mmap=True)
+        conjunto = ds.dataset(ficheros, schema=esquema, format='parquet', filesystem=self._fs)
+        filtro = pc.field(columna_dia) >= pa.scalar(desde, esquema.field(columna_dia).type)
+        if hasta is not None:
+            filtro &= pc.field(columna_dia) < pa.scalar(hasta, esquema.field(columna_dia).type)
+        tabla = conjunto.to_table(columns=columnas, filter=filtro).sort_by([(columna_dia, 'ascending'), ('ts', 'ascending')])
+        return _sin_repetidas(tabla, tipo)
+
+    # --- mantenimiento ---
+
+    def compactar(self, antes_de: str = None) -> int:
+        """Une en un fichero cada partición con varios, de días anteriores a `antes_de`
+        (por defecto hoy, UTC: los días abiertos siguen recibiendo ficheros). Devuelve
+        cuántas particiones compactó. Debe ejecutarlo un solo proceso (el precalentado o la CLI).
+
+        El compactado se pone en su sitio antes de borrar los originales: si se
+        interrumpe entre medias sólo quedan filas repetidas, que `consultar` ya omite y
+        la siguiente compactación elimina.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        antes_de = antes_de or _dia(int(time.time()))
+        compactadas = 0
+        for tipo in _COLUMNA_DIA:
+            base = os.path.join(self.directorio, tipo)
+            if not os.path.isdir(base):
+                continue
+            for carpeta_ciudad in os.scandir(base):
+                for carpeta_dia in os.scandir(carpeta_ciudad.path):
+                    if carpeta_dia.name[len('dia='):] >= antes_de:
+                        continue
+                    ficheros = sorted(f.path for f in os.scandir(carpeta_dia.path) if f.name.endswith('.parquet'))
+                    if len(ficheros) < 2:
+                        continue
+                    tabla = pa.concat_tables(pq.read_table(f, schema=esquemas()[tipo], memory_map=True)
+                                             for f in ficheros)
+                    tabla = tabla.sort_by([(_COLUMNA_DIA[tipo], 'ascending'), ('ts', 'ascending')])
+                    c = carpeta_ciudad.name[len('ciudad='):]
+                    self._escribir(tipo, c, carpeta_dia.name[len('dia='):], _sin_repetidas(tabla, tipo),
+                                   nombre=f'{time.time_ns()}-compactado.parquet')
+                    for f in ficheros:
+                        os.remove(f)
+                    compactadas += 1
+        return compactadas
+
+
+def _sin_repetidas(tabla: 'pa.Table', tipo: str) -> 'pa.Table':
+    """Quita las filas consecutivas con la misma clave (`ts`; en previsiones, `emitido` y `ts`)."""
+    import numpy as np
+    import pyarrow as pa
+
+    if tabla.num_rows < 2:
+        return tabla
+    distintas = np.zeros(tabla.num_rows - 1, dtype=bool)
+    for columna in dict.fromkeys([_COLUMNA_DIA[tipo], 'ts']):
+        valores = tabla[columna].to_numpy()
+        distintas |= valores[1:] != valores[:-1]
+    return tabla.filter(pa.array(np.r_[True, distintas]))
+
+
+def reducir(tabla: 'pa.Table', segundos: int, columnas=('temp',), columna_ts: str = 'ts') -> 'pa.Table':
+    """Agrega `tabla` en intervalos de `segundos`: media, mínimo y máximo de cada columna.
+
+    Devuelve una tabla con `ts` (inicio del intervalo) y `<col>_mean/_min/_max`, ordenada.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    ts = pa.timestamp('s', tz='UTC')
+    if tabla.num_rows == 0:
+        return pa.table({'ts': pa.array([], ts)})
+    marca = pc.cast(tabla[columna_ts], pa.int64())
+    intervalo = pc.multiply(pc.divide(marca, pa.scalar(segundos, pa.int64())), pa.scalar(segundos, pa.int64()))
+    trabajo = pa.table({'intervalo': intervalo, **{c: tabla[c] for c in columnas}})
+    agregados = [(c, f) for c in columnas for f in ('mean', 'min', 'max')]
+    resultado = trabajo.group_by('intervalo').aggregate(agregados).sort_by('intervalo')
+    return resultado.append_column('ts', pc.cast(resultado['intervalo'], ts)).drop_columns(['intervalo'])
+
+
+historico = Historico()
+atexit.register(historico.volcar)
+registrar_observacion = historico.registrar_observacion
+registrar_prevision = historico.registrar_prevision
+registrando_prevision = historico.registrando_prevision
+consultar = historico.consultar
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--compactar', action='store_true', help='unir los ficheros de los días cerrados')
+    parser.add_argument('--ciudad', metavar='LAT,LON', help='resumen horario de los últimos --dias días')
+    parser.add_argument('--dias', type=int, default=7)
+    args = parser.parse_args()
+    if args.compactar:
+        print(f'{historico.compactar()} particiones compactadas')
+    if args.ciudad:
+        lat, lon = (float(x) for x in args.ciudad.split(','))
+        desde = datetime.now(timezone.utc) - timedelta(days=args.dias)
+        print(reducir(consultar(lat, lon, desde, columnas=['temp']), 3600).to_pandas().to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
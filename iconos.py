@@ -0,0 +1,140 @@
+"""Iconos del tiempo de OpenWeatherMap servidos desde memoria.
+
+OWM usa un conjunto fijo de 18 iconos (`01d` ... `50n`). En vez de que el navegador
+pida `openweathermap.org/img/wn/<icono>@2x.png` en cada render (la cabecera y cada
+día de la previsión), se descargan una vez a `ICONOS_DIR` y se pasan como bytes a
+`st.image`: Streamlit los sirve desde el propio servidor, sin salir a internet.
+Un icono que aún no está se descarga en segundo plano y, mientras, se usa su URL;
+si la descarga falla no se reintenta hasta pasados `ICONOS_REINTENTO` segundos.
+
+    python iconos.py          # descargarlos todos de antemano (p.ej. al desplegar)
+"""
+import argparse
+import os
+import threading
+import time
+
+import transporte
+from metricas import registro
+
+ACTIVADO = os.getenv('ICONOS', '1') != '0'
+URL_BASE = os.getenv('ICONOS_URL', 'https://openweathermap.org/img/wn').rstrip('/')
+DIRECTORIO = os.getenv('ICONOS_DIR', os.path.join('.cache', 'iconos'))
+REINTENTO = float(os.getenv('ICONOS_REINTENTO', 300))  # segundos sin volver a pedir uno que falló
+CODIGOS = tuple(f'{n}{m}' for n in ('01', '02', '03', '04', '09', '10', '11', '13', '50') for m in 'dn')
+_FIRMA_PNG = b'\x89PNG\r\n\x1a\n'
+
+iconos_servidos = registro.contador('iconos_servidos_total', 'Iconos pintados, por origen', ('origen',))
+descargas = registro.contador('iconos_descargas_total', 'Descargas de iconos de OpenWeatherMap', ('resultado',))
+
+
+class AlmacenIconos:
+    """Bytes de cada icono en memoria, respaldados por un fichero en disco."""
+
+    def __init__(self, directorio=DIRECTORIO, url_base=URL_BASE, activado=ACTIVADO, reintento=REINTENTO):
+        self.directorio = directorio
+        self.url_base = url_base
+        self.activado = activado
+        self.reintento = reintento
+        self._bytes = {}  # código -> PNG
+        self._pendientes = set()
+        self._fallos = {}  # código -> time.monotonic() a partir del que se vuelve a intentar
+        self._lock = threading.Lock()
+
+    def url(self, codigo: str) -> str:
+        return f'{self.url_base}/{codigo}@2x.png'
+
+    def _ruta(self, codigo):
+        return os.path.join(self.directorio, f'{codigo}@2x.png')
+
+    def _leer_disco(self, codigo):
+        try:
+            with open(self._ruta(codigo), 'rb') as f:
+                datos = f.read()
+        except OSError:
+            return None
+        return datos if datos.startswith(_FIRMA_PNG) else None
+
+    def descargar(self, codigo: str):
+        """Baja el icono, lo guarda en disco y en memoria; None si falla.
+
+        Si no se puede escribir en disco, el icono se queda sólo en memoria.
+        """
+        try:
+            r = transporte.sesion.get(self.url(codigo), timeout=transporte.TIMEOUT)
+            datos = r.content if r.status_code == 200 else b''
+        except Exception:
+            datos = b''
+        if not datos.startswith(_FIRMA_PNG):
+            descargas.inc(resultado='error')
+            self._fallos[codigo] = time.monotonic() + self.reintento
+            return None
+        temporal = f'{self._ruta(codigo)}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            with open(temporal, 'wb') as f:
+                f.write(datos)
+            os.replace(temporal, self._ruta(codigo))
+        except OSError:
+            descargas.inc(resultado='sin_disco')
+        else:
+            descargas.inc(resultado='ok')
+        self._bytes[codigo] = datos
+        self._fallos.pop(codigo, None)
+        return datos
+
+    def _descargar_en_segundo_plano(self, codigo):
+        try:
+            self.descargar(codigo)
+        finally:
+            with self._lock:
+                self._pendientes.discard(codigo)
+
+    def obtener(self, codigo: str):
+        """PNG del icono para `st.image`; si aún no está, su URL (y se descarga aparte)."""
+        if not self.activado or codigo not in CODIGOS:
+            iconos_servidos.inc(origen='url')
+            return self.url(codigo)
+        datos = self._bytes.get(codigo)
+        if datos is None and self._fallos.get(codigo, 0) > time.monotonic():
+            iconos_servidos.inc(origen='url')
+            return self.url(codigo)
+        if datos is not None:
+            iconos_servidos.inc(origen='memoria')
+            return datos
+        datos = self._leer_disco(codigo)
+        if datos is not None:
+            self._bytes[codigo] = datos
+            iconos_servidos.inc(origen='disco')
+            return datos
+        with self._lock:
+            nuevo = codigo not in self._pendientes
+            self._pendientes.add(codigo)
+        if nuevo:
+            threading.Thread(target=self._descargar_en_segundo_plano, args=(codigo,),
+                             name=f'icono-{codigo}', daemon=True).start()
+        iconos_servidos.inc(origen='url')
+        return self.url(codigo)
+
+    def precargar(self) -> int:
+        """Descarga los iconos que falten en disco; devuelve cuántos hay."""
+        return sum(1 for codigo in CODIGOS
+                   if (self._leer_disco(codigo) or self.descargar(codigo)) is not None)
+
+    def limpiar(self):
+        self._bytes.clear()
+        self._fallos.clear()
+
+
+almacen = AlmacenIconos()
+icono = almacen.obtener
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+    print(f'{almacen.precargar()}/{len(CODIGOS)} iconos en {DIRECTORIO}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Consulta por lotes: clima actual y previsión de muchas ciudades a la vez.
+
+Pensado para monitorizar decenas o cientos de sitios desde el dashboard. Las
+consultas van en paralelo (con un máximo de peticiones simultáneas) sobre un solo
+pool de conexiones, y un fallo en una ciudad no afecta a las demás.
+"""
+import asyncio
+import csv
+import io
+from typing import TYPE_CHECKING, Optional
+
+from cache_clima import cache as cache_clima
+from consultas import ErrorOWM
+
+if TYPE_CHECKING:
+    from modelos import Observacion, Prevision, Ubicacion
+    from owm_async import ClienteOWMAsync
+
+MAX_CONCURRENCIA_LOTE = 10
+
+
+def _coordenadas(texto: str):
+    """'40.41, -3.70' -> (40.41, -3.7); None si no son dos números válidos."""
+    partes = [p.strip() for p in texto.replace(';', ',').split(',')]
+    if len(partes) != 2:
+        return None
+    try:
+        lat, lon = float(partes[0]), float(partes[1])
+    except ValueError:
+        return None
+    if -90 <= lat <= 90 and -180 <= lon <= 180:
+        return lat, lon
+    return None
+
+
+def parsear_entradas(texto: str):
+    """Convierte texto libre o CSV en una lista de entradas para `consultar_lote`.
+
+    Acepta una ciudad o un par `lat,lon` por línea, o un CSV con cabecera que tenga
+    columna `ciudad` (o `city`/`nombre`) y/o columnas `lat` y `lon`.
+    Devuelve dicts `{'entrada': str, 'ciudad': str}` o `{'entrada': str, 'lat', 'lon'}`.
+    """
+    lineas = [l for l in (texto or '').splitlines() if l.strip()]
+    if not lineas:
+        return []
+
+    cabecera = [c.strip().lower() for c in next(csv.reader([lineas[0]]))]
+    col_ciudad = next((c for c in ('ciudad', 'city', 'nombre', 'name') if c in cabecera), None)
+    if col_ciudad or ('lat' in cabecera and 'lon' in cabecera):
+        entradas = []
+        for fila in csv.DictReader(io.StringIO('\n'.join(lineas))):
+            fila = {(k or '').strip().lower(): (v or '').strip() for k, v in fila.items()}
+            coords = _coordenadas(f"{fila.get('lat', '')},{fila.get('lon', '')}")
+            nombre = fila.get(col_ciudad, '') if col_ciudad else ''
+            if coords:
+                entradas.append({'entrada': nombre or f'{coords[0]},{coords[1]}',
+                                 'lat': coords[0], 'lon': coords[1]})
+            elif nombre:
+                entradas.append({'entrada': nombre, 'ciudad': nombre})
+        return entradas
+
+    entradas = []
+    vistos = set()
+    for linea in lineas:
+        linea = linea.strip()
+        if linea.lower() in vistos:
+            continue
+        vistos.add(linea.lower())
+        coords = _coordenadas(linea)
+        if coords:
+            entradas.append({'entrada': linea, 'lat': coords[0], 'lon': coords[1]})
+        else:
+            entradas.append({'entrada': linea, 'ciudad': linea})
+    return entradas
+
+
+def _fila_resultado(entrada, ubicacion: 'Optional[Ubicacion]', clima: 'Observacion',
+                    prevision: 'Optional[Prevision]'):
+    """Aplana lo que muestra la tabla del modo lote."""
+    hoy = prevision.dias[0] if prevision is not None and prevision.dias else None
+    return {
+        'entrada': entrada['entrada'],
+        'ciudad': (ubicacion.nombre_local if ubicacion else None) or clima.nombre or entrada['entrada'],
+        'pais': clima.pais or (ubicacion.pais if ubicacion else None),
+        'lat': entrada.get('lat', clima.lat),
+        'lon': entrada.get('lon', clima.lon),
+        'temp': clima.temp,
+        'sensacion': clima.sensacion,
+        'humedad': clima.humedad,
+        'viento': clima.viento,
+        'viento_deg': clima.viento_deg,
+        'descripcion': clima.descripcion,
+        'icono': clima.icono,
+        'min_hoy': hoy.temp_min if hoy else None,
+        'max_hoy': hoy.temp_max if hoy else None,
+        'pop_hoy': hoy.pop if hoy else None,
+        'error': None,
+        'clima': clima,
+        'prevision': prevision,
+    }
+
+
+async def _consultar_una(owm: 'ClienteOWMAsync', entrada: dict, con_prevision: bool):
+    ubicacion = None
+    if 'lat' in entrada:
+        lat, lon = entrada['lat'], entrada['lon']
+    else:
+        ubicacion = await owm.obtener_ubicacion(entrada['ciudad'])
+        if not ubicacion:
+            return {'entrada': entrada['entrada'], 'error': 'Ciudad no encontrada'}
+        lat, lon = ubicacion.lat, ubicacion.lon
+        entrada = dict(entrada, lat=lat, lon=lon)
+
+    async def prevision_o_nada():
+        try:
+            return await owm.obtener_prevision_5dias(lat, lon)
+        except ErrorOWM:
+            return None  # la fila sigue valiendo, sin mín/máx ni lluvia de hoy
+
+    try:
+        if con_prevision:
+            clima, prevision = await asyncio.gather(owm.obtener_clima_hoy(lat, lon), prevision_o_nada())
+        else:
+            clima, prevision = await owm.obtener_clima_hoy(lat, lon), None
+    except ErrorOWM:
+        return {'entrada': entrada['entrada'], 'lat': lat, 'lon': lon,
+                'error': 'Error al obtener datos del clima'}
+    return _fila_resultado(entrada, ubicacion, clima, prevision)
+
+
+async def consultar_lote_async(entradas, api_key: str, max_concurrencia: int = MAX_CONCURRENCIA_LOTE,
+                               con_prevision: bool = True, **kwargs_cliente):
+    """Consulta todas las entradas en paralelo; devuelve una fila por entrada, en orden."""
+    from owm_async import ClienteOWMAsync  # httpx sólo al primer lote, no al abrir el dashboard
+
+    owm = ClienteOWMAsync(api_key, max_concurrencia=max_concurrencia, **kwargs_cliente)
+    try:
+        resultados = await asyncio.gather(
+            *(_consultar_una(owm, e, con_prevision) for e in entradas),
+            return_exceptions=True,
+        )
+    finally:
+        # Los refrescos stale-while-revalidate que lanzó el lote usan este cliente y este loop
+        await cache_clima.esperar_refrescos()
+        await owm.cerrar()
+    filas = []
+    for entrada, r in zip(entradas, resultados):
+        if isinstance(r, Exception):
+            r = {'entrada': entrada['entrada'], 'error': str(r) or type(r).__name__}
+        filas.append(r)
+    return filas
+
+
+def consultar_lote(entradas, api_key: str, max_concurrencia: int = MAX_CONCURRENCIA_LOTE,
+                   con_prevision: bool = True, **kwargs_cliente):
+    """Versión síncrona para Streamlit (cada ejecución del script va en su propio hilo)."""
+    return asyncio.run(consultar_lote_async(entradas, api_key, max_concurrencia,
+                                            con_prevision, **kwargs_cliente))
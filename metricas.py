@@ -0,0 +1,243 @@
+"""Instrumentación ligera: contadores e histogramas de latencia exportables en
+formato de texto de Prometheus.
+
+Cada proceso (dashboard o bot) fija su `origen` con `configurar()`; se añade como
+etiqueta a todas las series al exportar, así que medir no cuesta más que un lock y
+una búsqueda binaria. Los contadores que ya llevan otros módulos (cachés,
+limitador) se exportan con colectores que sólo se evalúan al consultar.
+"""
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BUCKETS_SEGUNDOS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_BYTES = (256, 1024, 4096, 16384, 65536, 262144)
+
+_origen = 'desconocido'
+
+
+def configurar(origen: str):
+    """Etiqueta `origen` de todas las series de este proceso ('dashboard', 'bot'...)."""
+    global _origen
+    _origen = origen
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _etiquetas_texto(etiquetas: dict) -> str:
+    partes = [f'{k}="{_escapar(v)}"' for k, v in etiquetas.items()]
+    return '{' + ','.join(partes) + '}' if partes else ''
+
+
+def medido(histograma, **etiquetas):
+    """Decorador: observa en `histograma` la duración de cada llamada."""
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                histograma.observar(time.perf_counter() - inicio, **etiquetas)
+        return envoltura
+    return decorador
+
+
+class Contador:
+    tipo = 'counter'
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, valor=1, **etiquetas):
+        clave = tuple(etiquetas.get(e, '') for e in self.etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def muestras(self):
+        with self._lock:
+            for clave, valor in self._valores.items():
+                yield self.nombre, dict(zip(self.etiquetas, clave)), valor
+
+    def instantanea(self):
+        with self._lock:
+            return [dict(zip(self.etiquetas, clave), valor=valor) for clave, valor in self._valores.items()]
+
+
+class Histograma:
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, tuple(etiquetas)
+        self.buckets = tuple(buckets)
+        self._series = {}  # clave -> [cuentas por bucket (+Inf al final), suma, total]
+        self._lock = threading.Lock()
+
+    def observar(self, valor, **etiquetas):
+        clave = tuple(etiquetas.get(e, '') for e in self.etiquetas)
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    @contextmanager
+    def medir(self, **etiquetas):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **etiquetas)
+
+    def muestras(self):
+        with self._lock:
+            series = [(clave, list(s[0]), s[1], s[2]) for clave, s in self._series.items()]
+        for clave, cuentas, suma, total in series:
+            base = dict(zip(self.etiquetas, clave))
+            acumulado = 0
+            for limite, n in zip(self.buckets + ('+Inf',), cuentas):
+                acumulado += n
+                yield f'{self.nombre}_bucket', dict(base, le=limite), acumulado
+            yield f'{self.nombre}_sum', base, suma
+            yield f'{self.nombre}_count', base, total
+
+    def _percentil(self, cuentas, total, q):
+        objetivo = q * total
+        acumulado = 0
+        for limite, n in zip(self.buckets + (float('inf'),), cuentas):
+            acumulado += n
+            if acumulado >= objetivo:
+                return limite
+        return float('inf')
+
+    def instantanea(self):
+        """Por serie: total, media y percentiles aproximados (límite superior del bucket)."""
+        with self._lock:
+            series = [(clave, list(s[0]), s[1], s[2]) for clave, s in self._series.items()]
+        return [
+            dict(zip(self.etiquetas, clave), total=total, media=suma / total if total else 0.0,
+                 p50=self._percentil(cuentas, total, 0.5), p95=self._percentil(cuentas, total, 0.95),
+                 p99=self._percentil(cuentas, total, 0.99))
+            for clave, cuentas, suma, total in series
+        ]
+
+
+class Registro:
+
+    def __init__(self):
+        self._metricas = {}
+        self._colectores = {}  # módulo.nombre -> función
+        self._lock = threading.Lock()
+
+    def _registrar(self, metrica):
+        with self._lock:
+            return self._metricas.setdefault(metrica.nombre, metrica)
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        return self._registrar(Contador(nombre, ayuda, etiquetas))
+
+    def histograma(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        return self._registrar(Histograma(nombre, ayuda, etiquetas, buckets))
+
+    def colector(self, funcion):
+        """`funcion()` -> iterable de (nombre, tipo, ayuda, [(etiquetas, valor), ...]).
+
+        Se llama sólo al exportar; sirve para publicar contadores que ya existen.
+        Una función con el mismo nombre sustituye a la anterior (p.ej. la de cada
+        `telegram_bot.crear_aplicacion`), así que no se duplican muestras.
+        """
+        with self._lock:
+            self._colectores[f'{funcion.__module__}.{funcion.__qualname__}'] = funcion
+        return funcion
+
+    def exportar_prometheus(self) -> str:
+        lineas = []
+        origen = {'origen': _origen}
+        with self._lock:
+            metricas = list(self._metricas.values())
+            colectores = list(self._colectores.values())
+        for m in metricas:
+            lineas.append(f'# HELP {m.nombre} {m.ayuda}')
+            lineas.append(f'# TYPE {m.nombre} {m.tipo}')
+            for nombre, etiquetas, valor in m.muestras():
+                lineas.append(f'{nombre}{_etiquetas_texto(dict(origen, **etiquetas))} {valor}')
+        # Varios colectores pueden aportar a la misma familia (p.ej. cache_consultas_total)
+        familias = {}
+        for colector in colectores:
+            try:
+                for nombre, tipo, ayuda, muestras in colector():
+                    familias.setdefault(nombre, (tipo, ayuda, []))[2].extend(muestras)
+            except Exception:
+                continue
+        for nombre, (tipo, ayuda, muestras) in familias.items():
+            lineas.append(f'# HELP {nombre} {ayuda}')
+            lineas.append(f'# TYPE {nombre} {tipo}')
+            for etiquetas, valor in muestras:
+                lineas.append(f'{nombre}{_etiquetas_texto(dict(origen, **etiquetas))} {valor}')
+        return '\n'.join(lineas) + '\n'
+
+    def instantanea(self) -> dict:
+        """Vista para el dashboard: {nombre: (tipo, filas)}."""
+        with self._lock:
+            metricas = list(self._metricas.values())
+        return {m.nombre: (m.tipo, m.instantanea()) for m in metricas}
+
+
+registro = Registro()
+
+# --- Métricas comunes ---
+
+peticiones_owm = registro.contador(
+    'owm_peticiones_total', 'Peticiones HTTP a OpenWeatherMap', ('endpoint', 'status'))
+latencia_owm = registro.histograma(
+    'owm_peticion_segundos', 'Latencia de cada intento de petición a OpenWeatherMap', ('endpoint',))
+bytes_owm = registro.histograma(
+    'owm_respuesta_bytes', 'Tamaño del cuerpo de las respuestas de OpenWeatherMap', ('endpoint',),
+    buckets=BUCKETS_BYTES)
+latencia_agregacion = registro.histograma(
+    'agregacion_segundos', 'Tiempo de los pasos de agregación del forecast', ('paso',))
+latencia_peticion = registro.histograma(
+    'peticion_segundos', 'Tiempo total por petición de usuario (búsqueda o mensaje)', ('tipo', 'resultado'))
+
+
+# --- Servidor HTTP local ---
+
+class _HandlerMetricas(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        cuerpo = registro.exportar_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+
+def iniciar_servidor(puerto: int, host: str = '127.0.0.1'):
+    """Sirve `/metrics` en un hilo daemon. Devuelve el servidor o `None` si el puerto
+    está ocupado (p.ej. otra réplica en la misma máquina) o `puerto` es 0."""
+    if not puerto:
+        return None
+    try:
+        servidor = ThreadingHTTPServer((host, int(puerto)), _HandlerMetricas)
+    except OSError:
+        return None
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True, name='metricas').start()
+    return servidor
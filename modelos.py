@@ -0,0 +1,208 @@
+"""Modelo de datos común del dashboard, el bot, el modo lote y el histórico.
+
+Cada respuesta de OpenWeatherMap se lee una sola vez (en `consultas`) a uno de estos
+objetos, y es lo que guardan las cachés en memoria y lo que pintan las dos
+interfaces: atributos con tipo en lugar de dicts anidados que cada consumidor
+recorría con cadenas de `.get(...)`. Con `__slots__` no llevan `__dict__`.
+
+`desde_owm` lee la forma de la API y `a_owm` la devuelve (sólo los campos del
+modelo). Es la que se guarda en JSON en las cachés compartidas (SQLite, Redis,
+precalentado), así que lo que ya estaba guardado sigue valiendo.
+"""
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+
+def _numero(valor):
+    """La agregación marca con '—' lo que falta."""
+    return None if valor == '—' else valor
+
+
+@dataclass
+class Ubicacion:
+    """Una ciudad geocodificada (por la API o por el nomenclátor local)."""
+
+    __slots__ = ('lat', 'lon', 'nombre', 'nombre_es', 'pais', 'region')
+    lat: float
+    lon: float
+    nombre: Optional[str]
+    nombre_es: Optional[str]
+    pais: Optional[str]
+    region: Optional[str]
+
+    @classmethod
+    def desde_owm(cls, item: dict) -> 'Ubicacion':
+        """Un elemento de `/geo/1.0/direct`; de `local_names` sólo se queda el español."""
+        return cls(item['lat'], item['lon'], item.get('name'), (item.get('local_names') or {}).get('es'),
+                   item.get('country'), item.get('state'))
+
+    def a_owm(self) -> dict:
+        return {
+            'lat': self.lat, 'lon': self.lon, 'name': self.nombre,
+            'local_names': {'es': self.nombre_es} if self.nombre_es else {},
+            'country': self.pais, 'state': self.region,
+        }
+
+    @property
+    def nombre_local(self) -> Optional[str]:
+        """El nombre en español si la API lo trae; si no, el genérico."""
+        return self.nombre_es or self.nombre
+
+
+@dataclass
+class Observacion:
+    """Clima actual de `/data/2.5/weather` (o un elemento de `/data/2.5/group`)."""
+
+    __slots__ = ('id', 'dt', 'nombre', 'pais', 'lat', 'lon', 'zona', 'temp', 'sensacion', 'temp_min',
+                 'temp_max', 'humedad', 'presion', 'visibilidad', 'nubes', 'viento', 'viento_deg',
+                 'lluvia_1h', 'nieve_1h', 'descripcion', 'icono')
+    id: Optional[int]
+    dt: Optional[int]
+    nombre: Optional[str]
+    pais: Optional[str]
+    lat: Optional[float]
+    lon: Optional[float]
+    zona: int  # segundos respecto a UTC
+    temp: Optional[float]
+    sensacion: Optional[float]
+    temp_min: Optional[float]
+    temp_max: Optional[float]
+    humedad: Optional[int]
+    presion: Optional[int]
+    visibilidad: Optional[int]
+    nubes: Optional[int]
+    viento: Optional[float]
+    viento_deg: Optional[float]
+    lluvia_1h: Optional[float]
+    nieve_1h: Optional[float]
+    descripcion: Optional[str]
+    icono: Optional[str]
+
+    @classmethod
+    def desde_owm(cls, datos: dict) -> 'Observacion':
+        main = datos.get('main') or {}
+        viento = datos.get('wind') or {}
+        coord = datos.get('coord') or {}
+        sys_ = datos.get('sys') or {}
+        tiempo = (datos.get('weather') or [{}])[0]
+        zona = datos.get('timezone')
+        if zona is None:  # en `/data/2.5/group` va dentro de `sys`
+            zona = sys_.get('timezone', 0)
+        return cls(
+            datos.get('id'), datos.get('dt'), datos.get('name'), sys_.get('country'),
+            coord.get('lat'), coord.get('lon'), zona,
+            main.get('temp'), main.get('feels_like'), main.get('temp_min'), main.get('temp_max'),
+            main.get('humidity'), main.get('pressure'), datos.get('visibility'),
+            (datos.get('clouds') or {}).get('all'), viento.get('speed'), viento.get('deg'),
+            (datos.get('rain') or {}).get('1h'), (datos.get('snow') or {}).get('1h'),
+            tiempo.get('description'), tiempo.get('icon'),
+        )
+
+    def a_owm(self) -> dict:
+        datos = {
+            'id': self.id, 'dt': self.dt, 'name': self.nombre, 'timezone': self.zona,
+            'coord': {'lat': self.lat, 'lon': self.lon},
+            'sys': {'country': self.pais},
+            'main': {'temp': self.temp, 'feels_like': self.sensacion, 'temp_min': self.temp_min,
+                     'temp_max': self.temp_max, 'humidity': self.humedad, 'pressure': self.presion},
+            'visibility': self.visibilidad,
+            'clouds': {'all': self.nubes},
+            'wind': {'speed': self.viento, 'deg': self.viento_deg},
+            'weather': [{'description': self.descripcion, 'icon': self.icono}],
+        }
+        if self.lluvia_1h is not None:
+            datos['rain'] = {'1h': self.lluvia_1h}
+        if self.nieve_1h is not None:
+            datos['snow'] = {'1h': self.nieve_1h}
+        return datos
+
+
+@dataclass
+class ResumenDia:
+    """Un día de la previsión, agregado de sus slots de 3 h (ver `agregacion`)."""
+
+    __slots__ = ('dt', 'temp', 'temp_min', 'temp_max', 'pop', 'viento', 'viento_deg', 'descripcion', 'icono')
+    dt: int
+    temp: Optional[float]  # media del día
+    temp_min: Optional[float]
+    temp_max: Optional[float]
+    pop: float
+    viento: Optional[float]
+    viento_deg: Optional[float]
+    descripcion: Optional[str]
+    icono: Optional[str]
+
+    @classmethod
+    def desde_owm(cls, dia: dict) -> 'ResumenDia':
+        """Un elemento de `daily` tal como lo dan las funciones de `agregacion`."""
+        temp = dia.get('temp') or {}
+        viento = dia.get('wind') or {}
+        tiempo = (dia.get('weather') or [{}])[0]
+        return cls(
+            dia.get('dt', 0), _numero(temp.get('day')), _numero(temp.get('min')), _numero(temp.get('max')),
+            dia.get('pop', 0), _numero(viento.get('speed')), _numero(viento.get('deg')),
+            tiempo.get('description'), tiempo.get('icon'),
+        )
+
+    def a_owm(self) -> dict:
+        return {
+            'dt': self.dt,
+            'temp': {'day': self.temp, 'min': self.temp_min, 'max': self.temp_max},
+            'pop': self.pop,
+            'wind': {'speed': self.viento, 'deg': self.viento_deg},
+            'weather': [{'description': self.descripcion, 'icon': self.icono}],
+        }
+
+
+@dataclass
+class Prevision:
+    """Previsión diaria de una ciudad."""
+
+    __slots__ = ('zona', 'dias', 'recibido')
+    zona: int  # segundos respecto a UTC
+    dias: Tuple[ResumenDia, ...]
+    recibido: Optional[int]  # cuándo llegó de la API: identifica esta previsión
+
+    @classmethod
+    def desde_owm(cls, datos: dict) -> 'Prevision':
+        """`{'daily', 'timezone_offset', 'recibido'}`, lo que se guardaba antes en las cachés."""
+        return cls(datos.get('timezone_offset', 0),
+                   tuple(ResumenDia.desde_owm(dia) for dia in datos.get('daily') or ()),
+                   datos.get('recibido'))
+
+    def a_owm(self) -> dict:
+        return {'daily': [dia.a_owm() for dia in self.dias], 'timezone_offset': self.zona,
+                'recibido': self.recibido}
+
+
+# --- Presentación común del dashboard y el bot ---
+
+_FLECHAS = ('⬆️', '↗️', '➡️', '↘️', '⬇️', '↙️', '⬅️', '↖️')
+_PUNTOS = ('N', 'NE', 'E', 'SE', 'S', 'SO', 'O', 'NO')
+
+
+def o_raya(valor):
+    """`valor`, o '—' si falta."""
+    return '—' if valor is None else valor
+
+
+def deg_to_arrow(deg):
+    """Convierte grados en una flecha y una etiqueta de dirección (8 puntos).
+    Devuelve tupla (arrow, compass_label, deg) donde deg puede ser '—' si no disponible.
+    """
+    try:
+        if deg is None:
+            return ('', '—', '—')
+        d = float(deg) % 360
+    except Exception:
+        return ('', '—', '—')
+    idx = int(((d + 22.5) % 360) // 45)
+    return (_FLECHAS[idx], _PUNTOS[idx], round(d, 0))
+
+
+def texto_viento(velocidad, grados) -> str:
+    """'3.4 m/s ↗️ 45° (NE)', o sólo la velocidad si no hay dirección."""
+    flecha, punto, valor = deg_to_arrow(grados)
+    if valor == '—':
+        return f'{o_raya(velocidad)} m/s'
+    return f'{o_raya(velocidad)} m/s {flecha} {int(valor)}° ({punto})'
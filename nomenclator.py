@@ -0,0 +1,373 @@
+"""Nomenclátor local: resuelve nombres de ciudad a coordenadas sin llamar a la API.
+
+Se construye a partir de `datos/ciudades.tsv` (o de un volcado `cities*.txt` de
+GeoNames, con `NOMENCLATOR_FUENTE`) a un índice compacto en `.cache/nomenclator/`
+que se abre con `np.load(mmap_mode='r')`, así que varios procesos comparten las
+páginas y arrancar no cuesta leer el fichero entero:
+
+- `registros.npy`: coordenadas, población, país y offsets de los textos.
+- `claves.npy` / `prefijos.npy`: nombres normalizados (sin tildes ni mayúsculas)
+  ordenados, con sus primeros bytes en ancho fijo para buscar por bisección
+  (`np.searchsorted`) nombres exactos y, para las sugerencias, prefijos.
+- `trigramas.npy` / `tri_inicio.npy` / `tri_claves.npy`: índice invertido de
+  trigramas para encontrar nombres con erratas.
+- `cadenas.bin`: todos los textos en UTF-8 terminados en `\\0`.
+
+Si la consulta no está tal cual en el nomenclátor, la geocodificación sigue por
+OpenWeatherMap como siempre; los nombres parecidos sólo se proponen (`parecidas`).
+"""
+import json
+import mmap
+import os
+import shutil
+import threading
+import unicodedata
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from metricas import registro
+from modelos import Ubicacion
+
+ACTIVADO = os.getenv('NOMENCLATOR', '1') != '0'
+FUENTE = os.getenv('NOMENCLATOR_FUENTE', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                      'datos', 'ciudades.tsv'))
+DIRECTORIO = os.getenv('NOMENCLATOR_DIR', os.path.join('.cache', 'nomenclator'))
+# Ante nombres repetidos (Córdoba, Valencia, Mérida...) gana este país
+PAIS_PREFERIDO = os.getenv('NOMENCLATOR_PAIS', 'ES').upper()
+VERSION = 1
+ANCHO_PREFIJO = 24  # bytes de cada clave en `prefijos.npy`
+
+DTYPE_REGISTRO = np.dtype([('lat', '<f4'), ('lon', '<f4'), ('poblacion', '<u4'), ('pais', 'S2'),
+                           ('nombre', '<u4'), ('nombre_es', '<u4'), ('region', '<u4')])
+DTYPE_CLAVE = np.dtype([('texto', '<u4'), ('registro', '<u4'), ('alternativo', 'u1')])
+
+
+def normalizar(texto: str) -> str:
+    """'  L'Hospitalet de  LLOBREGAT ' -> 'l hospitalet de llobregat' (sin tildes ni signos)."""
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    limpio = ''.join(c if c.isalnum() else ' ' for c in descompuesto if not unicodedata.combining(c))
+    return ' '.join(limpio.lower().split())
+
+
+def _trigramas(clave: str):
+    relleno = f'  {clave} '
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+
+def _id_trigrama(trigrama: str) -> int:
+    return zlib.crc32(trigrama.encode('utf-8'))
+
+
+def _distancia(a: str, b: str, maximo: int) -> int:
+    """Damerau-Levenshtein (letras cambiadas de sitio cuentan 1) con corte en `maximo`."""
+    if abs(len(a) - len(b)) > maximo:
+        return maximo + 1
+    previa, anterior = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        actual = [i]
+        for j, cb in enumerate(b, 1):
+            d = min(anterior[j] + 1, actual[j - 1] + 1, anterior[j - 1] + (ca != cb))
+            if previa is not None and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                d = min(d, previa[j - 2] + 1)
+            actual.append(d)
+        if min(actual) > maximo:
+            return maximo + 1
+        previa, anterior = anterior, actual
+    return anterior[-1]
+
+
+def _max_erratas(clave: str) -> int:
+    """Erratas que admite `parecidas`: ninguna en nombres muy cortos."""
+    if len(clave) < 5:
+        return 1
+    return 2 if len(clave) < 10 else 3
+
+
+# --- Construcción del índice ---
+
+def _leer_fuente(ruta: str):
+    """Filas (nombre, nombre_es, alternativos, lat, lon, pais, region, poblacion).
+
+    Acepta el TSV incluido (con cabecera) o `cities*.txt` de GeoNames (19 columnas).
+    """
+    with open(ruta, encoding='utf-8') as f:
+        primera = f.readline().rstrip('\n').split('\t')
+        geonames = primera[0] != 'nombre'
+        if geonames:
+            f.seek(0)
+        for linea in f:
+            c = linea.rstrip('\n').split('\t')
+            if geonames:
+                if len(c) < 15:
+                    continue
+                alternativos = [a for a in c[3].split(',') if a][:20]
+                yield c[1], c[1], [c[2]] + alternativos, float(c[4]), float(c[5]), c[8], c[10], int(c[14] or 0)
+            elif len(c) >= 8:
+                yield c[0], c[1] or c[0], [a for a in c[2].split(',') if a], float(c[3]), float(c[4]), \
+                    c[5], c[6], int(c[7] or 0)
+
+
+def _huella(ruta: str) -> dict:
+    st = os.stat(ruta)
+    return {'version': VERSION, 'fuente': os.path.abspath(ruta), 'tamano': st.st_size, 'mtime': st.st_mtime}
+
+
+def construir(fuente: str = FUENTE, directorio: str = DIRECTORIO):
+    """Genera el índice de `fuente` en `directorio` (se escribe aparte y se renombra)."""
+    cadenas = bytearray()
+    offsets = {}
+
+    def texto(s):
+        if s not in offsets:
+            offsets[s] = len(cadenas)
+            cadenas.extend(s.encode('utf-8') + b'\0')
+        return offsets[s]
+
+    filas = sorted(_leer_fuente(fuente), key=lambda f: -f[7])
+    registros = np.zeros(len(filas), dtype=DTYPE_REGISTRO)
+    claves = {}  # (clave, registro) -> alternativo
+    for i, (nombre, nombre_es, alternativos, lat, lon, pais, region, poblacion) in enumerate(filas):
+        registros[i] = (lat, lon, poblacion, pais.encode('ascii', 'ignore')[:2],
+                        texto(nombre), texto(nombre_es), texto(region))
+        for n, alternativo in [(nombre, 0), (nombre_es, 0)] + [(a, 1) for a in alternativos]:
+            clave = normalizar(n)
+            if clave:
+                claves[clave, i] = min(alternativo, claves.get((clave, i), 1))
+
+    # Ordenadas por texto; a igualdad, nombre principal antes que alternativo y luego población
+    orden = sorted(claves.items(), key=lambda e: (e[0][0].encode('utf-8'), e[1], e[0][1]))
+    tabla = np.zeros(len(orden), dtype=DTYPE_CLAVE)
+    prefijos = np.zeros(len(orden), dtype=f'S{ANCHO_PREFIJO}')
+    postings = {}
+    for j, ((clave, i), alternativo) in enumerate(orden):
+        tabla[j] = (texto(clave), i, alternativo)
+        prefijos[j] = clave.encode('utf-8')[:ANCHO_PREFIJO]
+        for t in _trigramas(clave):
+            postings.setdefault(_id_trigrama(t), []).append(j)
+    ids = np.array(sorted(postings), dtype='<u4')
+    inicio = np.zeros(len(ids) + 1, dtype='<u4')
+    inicio[1:] = np.cumsum([len(postings[t]) for t in ids.tolist()])
+    tri_claves = np.array([j for t in ids.tolist() for j in postings[t]], dtype='<u4')
+
+    temporal = f'{directorio}.tmp-{os.getpid()}-{threading.get_ident()}'
+    os.makedirs(temporal, exist_ok=True)
+    for nombre, arr in (('registros', registros), ('claves', tabla), ('prefijos', prefijos), ('trigramas', ids),
+                        ('tri_inicio', inicio), ('tri_claves', tri_claves)):
+        np.save(os.path.join(temporal, f'{nombre}.npy'), arr)
+    with open(os.path.join(temporal, 'cadenas.bin'), 'wb') as f:
+        f.write(cadenas)
+    with open(os.path.join(temporal, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(dict(_huella(fuente), registros=len(registros), claves=len(tabla)), f)
+    shutil.rmtree(directorio, ignore_errors=True)
+    try:
+        os.replace(temporal, directorio)
+    except OSError:  # otro proceso lo construyó a la vez; vale el suyo
+        shutil.rmtree(temporal, ignore_errors=True)
+
+
+def _indice_vigente(fuente: str, directorio: str) -> bool:
+    try:
+        with open(os.path.join(directorio, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    huella = _huella(fuente)
+    return all(meta.get(k) == v for k, v in huella.items())
+
+
+# --- Consulta ---
+
+class Nomenclator:
+
+    def __init__(self, directorio: str = DIRECTORIO, pais_preferido: str = PAIS_PREFERIDO):
+        self.directorio = directorio
+        self.pais_preferido = pais_preferido.encode('ascii')
+
+        def cargar(nombre):
+            return np.load(os.path.join(directorio, f'{nombre}.npy'), mmap_mode='r')
+
+        self._registros = cargar('registros')
+        self._claves = cargar('claves')
+        self._prefijos = cargar('prefijos')
+        self._trigramas = cargar('trigramas')
+        self._tri_inicio = cargar('tri_inicio')
+        self._tri_claves = cargar('tri_claves')
+        with open(os.path.join(directorio, 'cadenas.bin'), 'rb') as f:
+            self._cadenas = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._registros)
+
+    def _texto(self, offset) -> str:
+        offset = int(offset)
+        return self._cadenas[offset:self._cadenas.find(b'\0', offset)].decode('utf-8')
+
+    def _clave(self, j) -> bytes:
+        offset = int(self._claves[j]['texto'])
+        return self._cadenas[offset:self._cadenas.find(b'\0', offset)]
+
+    def _desde_prefijo(self, objetivo: bytes):
+        """Índices de las claves cuyos primeros bytes coinciden con los de `objetivo`."""
+        corto = objetivo[:ANCHO_PREFIJO]
+        j = int(np.searchsorted(self._prefijos, corto))
+        while j < len(self._prefijos) and self._prefijos[j].startswith(corto):
+            yield j
+            j += 1
+
+    def _ubicacion(self, i) -> Ubicacion:
+        r = self._registros[i]
+        return Ubicacion(round(float(r['lat']), 4), round(float(r['lon']), 4), self._texto(r['nombre']),
+                         self._texto(r['nombre_es']), r['pais'].decode('ascii'), self._texto(r['region']) or None)
+
+    def _orden(self, j):
+        """Clave de ranking: nombre principal, país preferido y población."""
+        i = int(self._claves[j]['registro'])
+        r = self._registros[i]
+        return (int(self._claves[j]['alternativo']), r['pais'] != self.pais_preferido, -int(r['poblacion']))
+
+    def _exactas(self, clave: str):
+        objetivo = clave.encode('utf-8')
+        for j in self._desde_prefijo(objetivo):
+            if len(objetivo) < ANCHO_PREFIJO:
+                if self._prefijos[j] != objetivo:
+                    break
+                yield j
+            elif self._clave(j) == objetivo:
+                yield j
+
+    def _candidatas_trigramas(self, clave: str, limite: int = 30):
+        """(clave, índice, coincidencia Dice) de las claves que más trigramas comparten."""
+        propios = _trigramas(clave)
+        ids = np.array([_id_trigrama(t) for t in propios], dtype='<u4')
+        posiciones = np.searchsorted(self._trigramas, ids)
+        cuenta = Counter()
+        for t, p in zip(ids.tolist(), posiciones.tolist()):
+            if p < len(self._trigramas) and int(self._trigramas[p]) == t:
+                cuenta.update(self._tri_claves[self._tri_inicio[p]:self._tri_inicio[p + 1]].tolist())
+        for j, comunes in cuenta.most_common(limite):
+            texto = self._clave(j).decode('utf-8')
+            yield texto, j, 2 * comunes / (len(propios) + len(_trigramas(texto)))
+
+    @staticmethod
+    def _separar(consulta: str):
+        """'Madrid, ES' -> ('madrid', b'ES'); el país sólo si es un código de 2 letras."""
+        partes = [p.strip() for p in (consulta or '').split(',')]
+        pais = partes[-1].upper() if len(partes) > 1 and len(partes[-1]) == 2 and partes[-1].isalpha() else None
+        return normalizar(partes[0]), pais.encode('ascii') if pais else None
+
+    def _filtrar(self, indices, pais):
+        return [j for j in indices if pais is None or self._registros[int(self._claves[j]['registro'])]['pais'] == pais]
+
+    def buscar(self, consulta: str):
+        """`modelos.Ubicacion`, como la de `geocodificacion.parsear_ubicacion`, o `None`.
+
+        Sólo resuelve el nombre tal cual (sin tildes ni mayúsculas). Un principio de
+        nombre o una errata pueden ser otra ciudad que no está aquí ("Kobe" no es
+        København, "Parma" no es Palma), así que van a OpenWeatherMap; las
+        parecidas sólo se proponen (`parecidas`).
+        """
+        clave, pais = self._separar(consulta)
+        if not clave:
+            return None
+        indices = self._filtrar(list(self._exactas(clave)), pais)
+        if not indices:
+            self.misses += 1
+            return None
+        self.hits += 1
+        j = min(indices, key=self._orden)
+        return self._ubicacion(int(self._claves[j]['registro']))
+
+    def _empiezan_por(self, clave: str, limite: int = 30):
+        """Claves que empiezan por `clave` (completarla cuenta como una errata en `parecidas`)."""
+        objetivo = clave.encode('utf-8')
+        for n, j in enumerate(self._desde_prefijo(objetivo)):
+            if n == limite:
+                break
+            if len(objetivo) <= ANCHO_PREFIJO or self._clave(j).startswith(objetivo):
+                yield self._clave(j).decode('utf-8'), j
+
+    def parecidas(self, consulta: str, limite: int = 3, minimo: float = 0.4):
+        """Sugerencias para responder '¿quisiste decir...?', la más cercana primero.
+
+        Los trigramas y los nombres que empiezan por la consulta sólo preseleccionan;
+        ordena la distancia de edición a la clave que coincide y, a igualdad, la
+        diferencia de longitud ('Madird' -> Madrid antes que Chennai por su
+        alternativo 'Madras').
+        """
+        clave, pais = self._separar(consulta)
+        if not clave:
+            return []
+        maximo = _max_erratas(clave)
+        candidatas = [((1, len(texto) - len(clave), 0.0) + self._orden(j), j)
+                      for texto, j in self._empiezan_por(clave) if texto != clave]
+        for texto, j, dice in self._candidatas_trigramas(clave):
+            distancia = _distancia(clave, texto, maximo)
+            if dice >= minimo or distancia <= maximo:
+                candidatas.append(((distancia, abs(len(texto) - len(clave)), -dice) + self._orden(j), j))
+        candidatas = self._filtrar([j for _, j in sorted(candidatas)], pais)
+        resultado, vistos = [], set()
+        for j in candidatas:
+            i = int(self._claves[j]['registro'])
+            if i not in vistos:
+                vistos.add(i)
+                resultado.append(self._ubicacion(i))
+            if len(resultado) == limite:
+                break
+        return resultado
+
+    def opciones(self, limite: int = 5000):
+        """'Nombre, PAÍS' de las ciudades más pobladas, sin repetidos (para el desplegable)."""
+        vistas = {}
+        for i in range(min(len(self._registros), limite)):
+            r = self._registros[i]
+            vistas.setdefault(f"{self._texto(r['nombre_es'])}, {r['pais'].decode('ascii')}", None)
+        return list(vistas)
+
+
+_nomenclator = None
+_no_disponible = False
+_lock = threading.Lock()
+
+
+def _obtener():
+    """Nomenclátor compartido; lo construye la primera vez (o si cambió la fuente)."""
+    global _nomenclator, _no_disponible
+    if _nomenclator is not None or _no_disponible or not ACTIVADO:
+        return _nomenclator
+    with _lock:
+        if _nomenclator is None and not _no_disponible:
+            try:
+                if not _indice_vigente(FUENTE, DIRECTORIO):
+                    construir(FUENTE, DIRECTORIO)
+                _nomenclator = Nomenclator(DIRECTORIO)
+            except (OSError, ValueError):
+                _no_disponible = True  # sin datos: todo va a la API
+    return _nomenclator
+
+
+def buscar(consulta: str):
+    n = _obtener()
+    return n.buscar(consulta) if n else None
+
+
+def parecidas(consulta: str, limite: int = 3):
+    n = _obtener()
+    return n.parecidas(consulta, limite) if n else []
+
+
+def opciones(limite: int = 5000):
+    n = _obtener()
+    return n.opciones(limite) if n else []
+
+
+@registro.colector
+def _colector():
+    n = _nomenclator
+    yield ('cache_consultas_total', 'counter', 'Consultas a las cachés por capa y resultado', [
+        ({'capa': 'nomenclator', 'resultado': 'hit'}, n.hits if n else 0),
+        ({'capa': 'nomenclator', 'resultado': 'miss'}, n.misses if n else 0),
+    ])
@@ -0,0 +1,194 @@
+"""Cliente asíncrono de OpenWeatherMap para el bot de Telegram.
+
+Usa un único `httpx.AsyncClient` con pool de conexiones keep-alive, timeouts por
+petición y un semáforo que limita las peticiones simultáneas a la API, de modo que
+los handlers `async` del bot nunca bloquean el event loop.
+
+Las peticiones de clima actual que coinciden en el tiempo (modo lote, precalentado,
+ráfagas del bot) se juntan en una sola llamada a `/data/2.5/group` de hasta 20
+ciudades, siempre que ya se conozca su id de OWM; la respuesta se reparte por
+ciudad.
+
+Lo que se hace con cada respuesta (errores, modelos, histórico) es lo mismo que en
+el cliente síncrono del dashboard: ver `consultas`.
+"""
+import asyncio
+import os
+from typing import Optional
+
+import httpx
+
+import consultas
+import geocodificacion
+import transporte
+from cache_clima import cache as cache_clima
+from metricas import registro
+from modelos import Observacion, Prevision, Ubicacion
+
+OWM_BASE_URL = transporte.OWM_BASE_URL
+MAX_CONCURRENCIA = int(os.getenv('OWM_MAX_CONCURRENCIA', 20))
+GRUPO_MAXIMO = 20  # ids por llamada que admite /data/2.5/group
+# Cuánto espera la primera petición de clima a que lleguen otras para agruparlas (0 desactiva)
+GRUPO_VENTANA = float(os.getenv('OWM_GRUPO_VENTANA', 0.005))
+
+ciudades_agrupadas = registro.contador(
+    'owm_grupo_ciudades_total', 'Clima actual servido por /data/2.5/group en vez de una llamada por ciudad')
+grupo_fallos = registro.contador(
+    'owm_grupo_fallos_total', 'Llamadas a /data/2.5/group fallidas (sus ciudades se piden una a una)', ('motivo',))
+
+
+class ClienteOWMAsync:
+    """Cliente compartido por todos los chats; crear dentro del event loop que lo usa."""
+
+    def __init__(self, api_key: str, base_url: str = OWM_BASE_URL,
+                 max_concurrencia: int = MAX_CONCURRENCIA, timeout: float = transporte.TIMEOUT_LECTURA,
+                 ventana_grupo: float = GRUPO_VENTANA):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.ventana_grupo = ventana_grupo
+        self._grupo = {}  # id de OWM -> Future con el clima, pendientes de la próxima llamada
+        self._temporizador = None
+        self._tareas = set()
+        self._en_curso = 0  # peticiones de clima actual sin responder todavía
+        self._semaforo = asyncio.Semaphore(max_concurrencia)
+        self.en_espera = 0  # peticiones esperando un hueco del semáforo
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=transporte.TIMEOUT_CONEXION),
+            limits=httpx.Limits(max_connections=max_concurrencia,
+                                max_keepalive_connections=max_concurrencia),
+        )
+
+    async def _get(self, ruta: str, params: dict, timeout: float = None):
+        """GET a la API (limitador y reintentos de `transporte`); `ErrorOWM` si falla la red."""
+        params = dict(params, appid=self.api_key)
+        self.en_espera += 1
+        try:
+            await self._semaforo.acquire()
+        finally:
+            self.en_espera -= 1
+        try:
+            return await transporte.get_async(self._client, f'{self.base_url}{ruta}', params=params,
+                                              timeout=timeout or self.timeout)
+        except (httpx.HTTPError, transporte.LimiteLlamadasExcedido) as e:
+            raise consultas.error_de_red(e) from e
+        finally:
+            self._semaforo.release()
+
+    @property
+    def saturado(self) -> bool:
+        """Hay peticiones haciendo cola porque todas las conexiones están ocupadas."""
+        return self.en_espera > 0
+
+    async def obtener_ubicacion(self, nombre: str) -> Optional[Ubicacion]:
+        """Como `consultas.ClienteOWM.obtener_ubicacion`, compartiendo su caché."""
+        encontrado, ubicacion = await geocodificacion.buscar_en_cache_async(nombre)
+        if encontrado:
+            return ubicacion
+        token, hallada = await geocodificacion.turno_async(nombre)
+        if hallada is not None:
+            return hallada[0]
+        try:
+            return consultas.leer_ubicacion(nombre, await self._get('/geo/1.0/direct', {'q': nombre, 'limit': 1}))
+        finally:
+            await geocodificacion.soltar_async(nombre, token)
+
+    async def obtener_clima_hoy(self, lat: float, lon: float) -> Observacion:
+        return await cache_clima.obtener_async('weather', lat, lon,
+                                               lambda: self._pedir_clima_hoy(lat, lon))
+
+    async def _pedir_clima_hoy(self, lat: float, lon: float) -> Observacion:
+        self._en_curso += 1
+        try:
+            id_ciudad = await geocodificacion.id_owm_async(lat, lon) if self.ventana_grupo > 0 else None
+            if id_ciudad is not None and await self._hay_con_quien_agrupar():
+                clima = await asyncio.shield(self._agrupar(id_ciudad))
+                if clima is not None:
+                    return consultas.registrar_clima(lat, lon, clima)
+            # Id desconocido, petición sola, sola en su ventana o fallo del grupo: por coordenadas
+            return consultas.leer_clima(lat, lon, await self._get('/data/2.5/weather',
+                                                                  dict(consultas.PARAMETROS, lat=lat, lon=lon)))
+        finally:
+            self._en_curso -= 1
+
+    async def _hay_con_quien_agrupar(self) -> bool:
+        """Si no hay grupo abierto ni otra petición en curso, esperar la ventana sólo añade latencia.
+
+        Antes de decidirlo se cede el turno una vez, para que las tareas lanzadas a la
+        vez (un `gather`) lleguen a contarse.
+        """
+        if self._grupo or self._en_curso > 1:
+            return True
+        await asyncio.sleep(0)
+        return bool(self._grupo) or self._en_curso > 1
+
+    def _agrupar(self, id_ciudad: int) -> asyncio.Future:
+        futuro = self._grupo.get(id_ciudad)
+        if futuro is None:
+            futuro = self._grupo[id_ciudad] = asyncio.get_running_loop().create_future()
+            if len(self._grupo) >= GRUPO_MAXIMO:
+                self._enviar_grupo()
+            elif self._temporizador is None:
+                self._temporizador = asyncio.get_running_loop().call_later(self.ventana_grupo, self._enviar_grupo)
+        return futuro
+
+    def _enviar_grupo(self):
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+        lote, self._grupo = self._grupo, {}
+        if len(lote) == 1:
+            # Nadie más en la ventana: mejor la llamada normal por coordenadas
+            next(iter(lote.values())).set_result(None)
+            return
+        tarea = asyncio.create_task(self._pedir_grupo(lote))
+        self._tareas.add(tarea)
+        tarea.add_done_callback(self._tareas.discard)
+
+    async def _pedir_grupo(self, lote: dict):
+        """Una llamada a `/data/2.5/group`; cada futuro recibe su ciudad o `None` si no vino.
+
+        Con `None` esa ciudad se pide sola. Sólo se absorben los fallos de red, de la
+        API y de formato (contados en `owm_grupo_fallos_total`); cualquier otra
+        excepción llega también a quien espera cada ciudad.
+        """
+        items = {}
+        try:
+            r = await self._get('/data/2.5/group', dict(consultas.PARAMETROS, id=','.join(map(str, lote))))
+            if r.status_code == 200:
+                items = {item['id']: Observacion.desde_owm(item) for item in r.json().get('list', [])}
+            else:
+                grupo_fallos.inc(motivo='respuesta')
+        except (httpx.HTTPError, consultas.ErrorOWM):
+            grupo_fallos.inc(motivo='red')
+        except (ValueError, KeyError):
+            grupo_fallos.inc(motivo='formato')
+        except Exception as e:
+            # Es una tarea que nadie espera: la excepción llega por los futuros, sin relanzarla
+            for futuro in lote.values():
+                if not futuro.done():
+                    futuro.set_exception(e)
+        finally:
+            for id_ciudad, futuro in lote.items():
+                if not futuro.done():
+                    futuro.set_result(items.get(id_ciudad))
+        if items:
+            ciudades_agrupadas.inc(len(items))
+
+    async def obtener_prevision_5dias(self, lat: float, lon: float) -> Prevision:
+        return await cache_clima.obtener_async('forecast', lat, lon,
+                                               lambda: self._pedir_prevision(lat, lon))
+
+    async def _pedir_prevision(self, lat: float, lon: float) -> Prevision:
+        return consultas.leer_prevision(lat, lon, await self._get('/data/2.5/forecast',
+                                                                  dict(consultas.PARAMETROS, lat=lat, lon=lon)))
+
+    async def cerrar(self):
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+        for futuro in self._grupo.values():
+            if not futuro.done():
+                futuro.set_result(None)
+        self._grupo = {}
+        await self._client.aclose()
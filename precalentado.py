@@ -0,0 +1,362 @@
+"""Precalentado de las ciudades más consultadas ("calientes").
+
+Dashboard y bot apuntan cada búsqueda en un almacén SQLite compartido
+(`.cache/precalentado.sqlite`) con una frecuencia que decae con el tiempo. Un
+proceso aparte, `python precalentado.py`, mantiene el clima actual y la previsión
+resumida de las N ciudades más consultadas, refrescándolas al ritmo al que
+OpenWeatherMap actualiza los datos y dentro de un presupuesto de llamadas por
+minuto. `cache_clima` mira el almacén antes de llamar a la API, así que esas
+ciudades se sirven sin esperar a OWM aunque Streamlit o el bot se reinicien.
+"""
+import argparse
+import asyncio
+import atexit
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from metricas import registro
+
+if TYPE_CHECKING:
+    from modelos import Ubicacion
+
+ACTIVADO = os.getenv('PRECALENTADO', '1') != '0'
+RUTA_DB = os.getenv('PRECALENTADO_DB', os.path.join('.cache', 'precalentado.sqlite'))
+TOP = int(os.getenv('PRECALENTADO_TOP', 50))
+# Llamadas a OWM por minuto que puede gastar el proceso de precalentado (el plan gratuito da 60)
+PRESUPUESTO_MINUTO = float(os.getenv('PRECALENTADO_PRESUPUESTO_MINUTO', 10))
+# Cada consulta cuenta 1 y vale la mitad tras VIDA_MEDIA; por debajo de MINIMO no es caliente
+VIDA_MEDIA = float(os.getenv('PRECALENTADO_VIDA_MEDIA', 24 * 3600))
+MINIMO = float(os.getenv('PRECALENTADO_MINIMO', 2))
+# OWM recalcula el clima actual cada ~10 min y la previsión 3h con menos frecuencia
+INTERVALOS = {
+    'weather': int(os.getenv('PRECALENTADO_INTERVALO_WEATHER', 600)),
+    'forecast': int(os.getenv('PRECALENTADO_INTERVALO_FORECAST', 1800)),
+}
+DESFASE = int(os.getenv('PRECALENTADO_DESFASE', 60))  # tras cada marca, para que OWM ya haya publicado
+MARGEN = int(os.getenv('PRECALENTADO_MARGEN', 300))  # validez extra por si un ciclo se retrasa
+VOLCADO = float(os.getenv('PRECALENTADO_VOLCADO', 5))  # cada cuánto se escriben las frecuencias (s)
+CONCURRENCIA = int(os.getenv('PRECALENTADO_CONCURRENCIA', 4))
+METRICAS_PUERTO = int(os.getenv('METRICAS_PUERTO_PRECALENTADO', 9103))
+DECIMALES_COORD = 2  # los mismos que `cache_clima`
+LOTE_WEATHER = 20  # ciudades por llamada a /data/2.5/group
+
+
+def clave(lat: float, lon: float) -> str:
+    return f'{float(lat):.{DECIMALES_COORD}f},{float(lon):.{DECIMALES_COORD}f}'
+
+
+def decaer(puntos: float, desde: float, ahora: float) -> float:
+    return puntos * 0.5 ** (max(ahora - desde, 0.0) / VIDA_MEDIA)
+
+
+class AlmacenCaliente:
+    """Frecuencias de consulta y datos precalentados en SQLite (WAL), compartidos entre procesos.
+
+    Las consultas se acumulan en memoria y un hilo las vuelca cada `volcado` segundos
+    (como el buffer de `historico`): apuntar una búsqueda es sólo sumar en un dict, sin
+    esperar a SQLite, y no bloquea el bucle de eventos del bot.
+    """
+
+    def __init__(self, ruta=RUTA_DB, volcado=VOLCADO, activado=ACTIVADO):
+        self.ruta = ruta
+        self.volcado = volcado
+        self.activado = activado
+        self._conn = None
+        self._lock = threading.Lock()  # la conexión SQLite
+        self._lock_pendientes = threading.Lock()
+        self._pendientes = {}  # clave -> [lat, lon, nombre, consultas]
+        self._hilo = None
+        self.hits = 0
+        self.misses = 0
+
+    def _db(self):
+        if self._conn is None:
+            directorio = os.path.dirname(self.ruta)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            # autocommit: las transacciones se abren a mano con BEGIN IMMEDIATE
+            self._conn = sqlite3.connect(self.ruta, timeout=5, check_same_thread=False, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS frecuencia ('
+                ' clave TEXT PRIMARY KEY, lat REAL, lon REAL, nombre TEXT, puntos REAL, ultima REAL)'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS datos ('
+                ' endpoint TEXT, clave TEXT, valor TEXT, obtenido REAL, expira REAL,'
+                ' PRIMARY KEY (endpoint, clave))'
+            )
+        return self._conn
+
+    # --- frecuencias (dashboard y bot) ---
+
+    def registrar(self, lat: float, lon: float, nombre: str = None):
+        """Apunta una consulta de la ciudad; el hilo de volcado la escribe después."""
+        if not self.activado:
+            return
+        c = clave(lat, lon)
+        with self._lock_pendientes:
+            pendiente = self._pendientes.get(c)
+            if pendiente is None:
+                self._pendientes[c] = [lat, lon, nombre, 1]
+            else:
+                pendiente[3] += 1
+                pendiente[2] = nombre or pendiente[2]
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._bucle, daemon=True, name='precalentado-volcado')
+                self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            time.sleep(self.volcado)
+            try:
+                self.volcar()
+            except Exception:
+                pass  # las frecuencias son orientativas; se reintenta en el próximo volcado
+
+    def volcar(self):
+        with self._lock_pendientes:
+            pendientes, self._pendientes = self._pendientes, {}
+        if not pendientes:
+            return
+        ahora = time.time()
+        with self._lock:
+            try:
+                db = self._db()
+                # IMMEDIATE: dashboard y bot pueden volcar a la vez la misma ciudad
+                db.execute('BEGIN IMMEDIATE')
+                try:
+                    for c, (lat, lon, nombre, consultas) in pendientes.items():
+                        fila = db.execute('SELECT puntos, ultima, nombre FROM frecuencia WHERE clave = ?',
+                                          (c,)).fetchone()
+                        puntos = consultas + (decaer(fila[0], fila[1], ahora) if fila else 0.0)
+                        db.execute(
+                            'INSERT OR REPLACE INTO frecuencia (clave, lat, lon, nombre, puntos, ultima)'
+                            ' VALUES (?, ?, ?, ?, ?, ?)',
+                            (c, lat, lon, nombre or (fila[2] if fila else None), puntos, ahora),
+                        )
+                    db.execute('COMMIT')
+                except BaseException:
+                    db.execute('ROLLBACK')
+                    raise
+            except sqlite3.Error:
+                pass  # las frecuencias son orientativas: perder un volcado no importa
+
+    def calientes(self, n: int, minimo: float = MINIMO):
+        """Las `n` ciudades con más consultas (decaídas a hoy), de más a menos."""
+        ahora = time.time()
+        with self._lock:
+            filas = self._db().execute('SELECT clave, lat, lon, nombre, puntos, ultima FROM frecuencia').fetchall()
+        ciudades = [
+            {'clave': c, 'lat': lat, 'lon': lon, 'nombre': nombre, 'puntos': decaer(puntos, ultima, ahora)}
+            for c, lat, lon, nombre, puntos, ultima in filas
+        ]
+        ciudades = [c for c in ciudades if c['puntos'] >= minimo]
+        ciudades.sort(key=lambda c: c['puntos'], reverse=True)
+        return ciudades[:n]
+
+    def podar(self, minimo: float = 0.05):
+        """Borra las ciudades olvidadas y los datos caducados."""
+        ahora = time.time()
+        with self._lock:
+            db = self._db()
+            filas = db.execute('SELECT clave, puntos, ultima FROM frecuencia').fetchall()
+            olvidadas = [(c,) for c, puntos, ultima in filas if decaer(puntos, ultima, ahora) < minimo]
+            db.execute('BEGIN IMMEDIATE')
+            db.executemany('DELETE FROM frecuencia WHERE clave = ?', olvidadas)
+            db.execute('DELETE FROM datos WHERE expira <= ?', (ahora,))
+            db.execute('COMMIT')
+
+    # --- datos precalentados ---
+
+    def leer(self, endpoint: str, lat: float, lon: float):
+        """`(valor, segundos_de_validez)` si hay un dato precalentado vigente, si no `None`."""
+        if not self.activado:
+            return None
+        ahora = time.time()
+        with self._lock:
+            try:
+                fila = self._db().execute('SELECT valor, expira FROM datos WHERE endpoint = ? AND clave = ?',
+                                          (endpoint, clave(lat, lon))).fetchone()
+            except sqlite3.Error:
+                fila = None
+        if fila is None or fila[1] <= ahora:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(fila[0]), fila[1] - ahora
+
+    def guardar(self, endpoint: str, lat: float, lon: float, valor, validez: float):
+        ahora = time.time()
+        with self._lock:
+            self._db().execute(
+                'INSERT OR REPLACE INTO datos (endpoint, clave, valor, obtenido, expira) VALUES (?, ?, ?, ?, ?)',
+                (endpoint, clave(lat, lon), json.dumps(valor), ahora, ahora + validez),
+            )
+
+    def limpiar(self):
+        with self._lock_pendientes:
+            self._pendientes.clear()
+        with self._lock:
+            db = self._db()
+            db.execute('DELETE FROM frecuencia')
+            db.execute('DELETE FROM datos')
+
+    def estadisticas(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+almacen = AlmacenCaliente()
+atexit.register(almacen.volcar)
+
+
+def registrar(ubicacion: 'Ubicacion', nombre: str = None):
+    """Apunta una consulta de `ubicacion` (de `geocodificacion`) para el precalentado."""
+    if ubicacion:
+        almacen.registrar(ubicacion.lat, ubicacion.lon, nombre or ubicacion.nombre_local)
+
+
+refrescos = registro.contador('precalentado_refrescos_total', 'Refrescos del precalentado por endpoint y resultado',
+                              ('endpoint', 'resultado'))
+_estado = {'ciudades': None}  # sólo en el proceso de refresco
+
+
+@registro.colector
+def _colector():
+    e = almacen.estadisticas()
+    yield ('cache_consultas_total', 'counter', 'Consultas a las cachés por capa y resultado', [
+        ({'capa': 'precalentado', 'resultado': 'hit'}, e['hits']),
+        ({'capa': 'precalentado', 'resultado': 'miss'}, e['misses']),
+    ])
+    if _estado['ciudades'] is not None:
+        yield ('precalentado_ciudades', 'gauge', 'Ciudades que mantiene calientes el precalentado',
+               [({}, _estado['ciudades'])])
+
+
+# --- Proceso de refresco ---
+
+def llamadas_ciclo(n: int) -> int:
+    """Llamadas para refrescar `n` ciudades en todos los endpoints: la previsión es una
+    por ciudad y el clima actual va en grupos de `LOTE_WEATHER` (ver `owm_async`)."""
+    return n + math.ceil(n / LOTE_WEATHER)
+
+
+def limite_ciudades(presupuesto: float = PRESUPUESTO_MINUTO, top: int = TOP) -> int:
+    """Cuántas ciudades caben en el presupuesto.
+
+    En el peor caso todos los endpoints tocan a la vez, y ese ciclo, al ritmo del
+    presupuesto, tiene que acabar antes del siguiente refresco del endpoint más frecuente.
+    """
+    # Al ritmo de su limitador (ráfaga 1): 1 llamada y luego `presupuesto - 1` por minuto
+    por_ciclo = 1 + max(presupuesto - 1, 1) * min(INTERVALOS.values()) / 60
+    n = max(top, 0)
+    while n > 0 and llamadas_ciclo(n) > por_ciclo:
+        n -= 1
+    return n
+
+
+def proxima_marca(intervalo: int, ahora: float) -> float:
+    """Siguiente múltiplo de `intervalo` (hora UTC) más `DESFASE`."""
+    return (math.floor((ahora - DESFASE) / intervalo) + 1) * intervalo + DESFASE
+
+
+async def refrescar(owm, endpoint: str, ciudades, almacen_=None) -> int:
+    """Pide `endpoint` para cada ciudad y lo guarda en el almacén (el `a_owm()` de su modelo);
+    devuelve cuántas fueron bien.
+
+    Usa los `_pedir_*` de `ClienteOWMAsync`, que no pasan por la caché en memoria; al
+    lanzarse todas a la vez, el clima actual sale en grupos de 20 ciudades por llamada.
+    """
+    almacen_ = almacen_ or almacen
+    pedir = owm._pedir_clima_hoy if endpoint == 'weather' else owm._pedir_prevision
+    validez = INTERVALOS[endpoint] + MARGEN
+
+    async def una(ciudad):
+        valor = await pedir(ciudad['lat'], ciudad['lon'])
+        almacen_.guardar(endpoint, ciudad['lat'], ciudad['lon'], valor.a_owm(), validez)
+        return True
+
+    resultados = await asyncio.gather(*(una(c) for c in ciudades), return_exceptions=True)
+    bien = sum(r is True for r in resultados)
+    refrescos.inc(bien, endpoint=endpoint, resultado='ok')
+    refrescos.inc(len(resultados) - bien, endpoint=endpoint, resultado='error')
+    return bien
+
+
+async def ejecutar(api_key: str, top: int = TOP, presupuesto: float = PRESUPUESTO_MINUTO, una_vez: bool = False):
+    """Bucle del proceso de precalentado: refresca cada endpoint en sus marcas de tiempo."""
+    import historico
+    import transporte
+    from owm_async import ClienteOWMAsync
+
+    # Este proceso sólo gasta su presupuesto: limitador propio, sin ráfagas ni rechazos
+    transporte.limitador = transporte.LimitadorTokens(por_minuto=presupuesto, rafaga=1,
+                                                      espera_maxima=float('inf'))
+    n = limite_ciudades(presupuesto, top)
+    owm = ClienteOWMAsync(api_key, max_concurrencia=CONCURRENCIA)
+    # Al arrancar se refresca todo, luego cada endpoint en su marca
+    proximo = dict.fromkeys(INTERVALOS, 0.0)
+    try:
+        while True:
+            ahora = time.time()
+            pendientes = [e for e in INTERVALOS if proximo[e] <= ahora]
+            if pendientes:
+                almacen.volcar()
+                ciudades = almacen.calientes(n)
+                _estado['ciudades'] = len(ciudades)
+                for endpoint in pendientes:  # 'weather' primero: es el que antes caduca
+                    inicio = time.perf_counter()
+                    bien = await refrescar(owm, endpoint, ciudades)
+                    print(f'{time.strftime("%H:%M:%S")} {endpoint}: {bien}/{len(ciudades)} ciudades '
+                          f'en {time.perf_counter() - inicio:.1f}s')
+                    proximo[endpoint] = proxima_marca(INTERVALOS[endpoint], time.time())
+                almacen.podar()
+                historico.historico.compactar()  # este proceso es el único que compacta
+                if una_vez:
+                    return
+            await asyncio.sleep(max(min(proximo.values()) - time.time(), 0.0))
+    finally:
+        await owm.cerrar()
+
+
+def main():
+    from dotenv import load_dotenv
+
+    import metricas
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--top', type=int, default=TOP, help='máximo de ciudades calientes')
+    parser.add_argument('--presupuesto', type=float, default=PRESUPUESTO_MINUTO, help='llamadas/minuto a OWM')
+    parser.add_argument('--una-vez', action='store_true', help='un solo ciclo y salir')
+    parser.add_argument('--listar', action='store_true', help='mostrar las ciudades calientes y salir')
+    args = parser.parse_args()
+
+    n = limite_ciudades(args.presupuesto, args.top)
+    if args.listar:
+        for c in almacen.calientes(n):
+            print(f"{c['puntos']:8.1f}  {c['nombre'] or '—'} ({c['clave']})")
+        return
+    api_key = os.getenv('API_KEY')
+    if not api_key:
+        print('Pone `API_KEY` (OpenWeatherMap) en el archivo .env antes de ejecutar este script.')
+        return
+
+    metricas.configurar('precalentado')
+    if not args.una_vez and metricas.iniciar_servidor(METRICAS_PUERTO):
+        print(f'Métricas en http://127.0.0.1:{METRICAS_PUERTO}/metrics')
+    print(f'Precalentado: hasta {n} ciudades con {args.presupuesto:g} llamadas/min '
+          f'(weather cada {INTERVALOS["weather"]}s, forecast cada {INTERVALOS["forecast"]}s). Ctrl-C para parar.')
+    try:
+        asyncio.run(ejecutar(api_key, args.top, args.presupuesto, una_vez=args.una_vez))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
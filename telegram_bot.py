@@ -1,114 +1,283 @@
+import asyncio
+import importlib.util
+import math
 import os
-import requests
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
 from dotenv import load_dotenv
 from telegram import Update
-from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters
+from telegram.ext import Application, ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters
+
+import geocodificacion
+import metricas
+import nomenclator
+import precalentado
+from admision import Admision
+from consultas import ErrorOWM
+from modelos import Observacion, o_raya, texto_viento
+from owm_async import ClienteOWMAsync
 
 load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 API_KEY = os.getenv('API_KEY')
+METRICAS_PUERTO = int(os.getenv('METRICAS_PUERTO_BOT', 9102))
+# Servidor Bot API propio (o el falso de los benchmarks); por defecto api.telegram.org
+TELEGRAM_BASE_URL = os.getenv('TELEGRAM_BASE_URL')
+
+# Updates procesados a la vez y cuántos más se aceptan antes de frenar la entrada
+WORKERS = int(os.getenv('BOT_WORKERS', 32))
+COLA_MAXIMA = int(os.getenv('BOT_COLA_MAXIMA', 100))
+
+# Modo webhook: URL pública (detrás del proxy inverso) y dónde escucha el bot
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_ESCUCHA = os.getenv('WEBHOOK_ESCUCHA', '127.0.0.1')
+WEBHOOK_PUERTO = int(os.getenv('WEBHOOK_PUERTO', 8443))
+WEBHOOK_SECRETO = os.getenv('WEBHOOK_SECRETO')
+WEBHOOK_MAX_CONEXIONES = int(os.getenv('WEBHOOK_MAX_CONEXIONES', 40))
+BOT_MODO = os.getenv('BOT_MODO', 'webhook' if WEBHOOK_URL else 'polling')
+
+# Respuestas ya formateadas: (ciudad, lat, lon, dt de la observación) -> texto
+MAX_TEXTOS = 2000
+_textos = OrderedDict()
+
+metricas.configurar('bot')
+
+
+class ColaConContrapresion(asyncio.Queue):
+    """`update_queue` de PTB que deja de aceptar updates cuando hay demasiados sin terminar.
+
+    El webhook y el polling hacen `await update_queue.put(update)`. Con `limite`
+    updates pendientes (o `limite_saturado` si el cliente de OWM ya tiene peticiones
+    haciendo cola) esa espera retrasa la respuesta HTTP a Telegram, que no abre más de
+    `max_connections` entregas a la vez: la carga se frena en origen en vez de
+    acumular tareas en memoria.
+    """
+
+    def __init__(self, limite: int, limite_saturado: int, saturado=lambda: False):
+        super().__init__()
+        self.limite = limite
+        self.limite_saturado = limite_saturado
+        self.saturado = saturado
+        self.pendientes = 0
+        self.esperas = 0
+        self.tiempo_espera = 0.0
+        self._hueco = asyncio.Event()
+
+    def _llena(self) -> bool:
+        return self.pendientes >= (self.limite_saturado if self.saturado() else self.limite)
+
+    async def put(self, item):
+        # Las señales internas de PTB (p.ej. la de parada) nunca esperan
+        if isinstance(item, Update) and self._llena():
+            self.esperas += 1
+            inicio = time.perf_counter()
+            while self._llena():
+                self._hueco.clear()
+                await self._hueco.wait()
+            self.tiempo_espera += time.perf_counter() - inicio
+        return await super().put(item)
+
+    def put_nowait(self, item):
+        super().put_nowait(item)
+        self.pendientes += 1
 
+    def task_done(self):
+        super().task_done()
+        self.pendientes -= 1
+        self._hueco.set()
 
-def obtener_coordenadas_simple(nombre):
-    url = 'http://api.openweathermap.org/geo/1.0/direct'
-    params = {'q': nombre, 'limit': 1, 'appid': API_KEY}
-    r = requests.get(url, params=params, timeout=10)
-    if r.status_code != 200:
-        return None
-    items = r.json()
-    if not items:
-        return None
-    return items[0]['lat'], items[0]['lon']
 
+async def _iniciar_cliente(app: Application):
+    # El cliente httpx se crea dentro del event loop del bot y se comparte entre chats
+    app.bot_data['owm'] = ClienteOWMAsync(API_KEY)
 
-def obtener_clima_hoy_simple(lat, lon):
-    url = 'https://api.openweathermap.org/data/2.5/weather'
-    params = {'lat': lat, 'lon': lon, 'appid': API_KEY, 'units': 'metric', 'lang': 'es'}
-    r = requests.get(url, params=params, timeout=10)
-    if r.status_code != 200:
-        return None
-    return r.json()
+
+async def _cerrar_cliente(app: Application):
+    owm = app.bot_data.pop('owm', None)
+    if owm is not None:
+        await owm.cerrar()
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text('Hola! Mándame el nombre de una ciudad y te digo el clima actual. Ej: "Madrid" o "clima Barcelona"')
 
 
-def deg_to_arrow(deg):
-    """Convierte grados en una flecha y etiqueta cardinal breve (8 puntos).
-    Retorna (arrow, label, deg_value) — deg_value es '—' si no disponible.
-    """
-    try:
-        if deg is None:
-            return ('', '—', '—')
-        d = float(deg) % 360
-    except Exception:
-        return ('', '—', '—')
-
-    arrows = ['⬆️', '↗️', '➡️', '↘️', '⬇️', '↙️', '⬅️', '↖️']
-    labels = ['N', 'NE', 'E', 'SE', 'S', 'SO', 'O', 'NO']
-    idx = int(((d + 22.5) % 360) // 45)
-    return (arrows[idx], labels[idx], round(d, 0))
+PREFIJOS_CIUDAD = (
+    'que tiempo hace en ', 'qué tiempo hace en ', 'el tiempo en ', 'el clima en ',
+    'clima en ', 'clima de ', 'clima ', 'tiempo en ', 'tiempo de ', 'tiempo ',
+    'weather in ', 'weather ',
+)
 
 
 def parse_ciudad(text: str) -> str:
     """Extrae nombre de ciudad del texto del usuario de forma simple."""
     if not text:
         return ''
-    t = text.lower().strip()
-    for prefix in ('clima en ', 'clima ', 'tiempo en ', 'tiempo ', 'weather in ', 'weather '):
-        if t.startswith(prefix):
-            return text[len(prefix):].strip()
-    return text.strip()
+    t = text.strip().strip('¿?¡!.').strip()
+    for prefix in PREFIJOS_CIUDAD:
+        if t.lower().startswith(prefix):
+            return t[len(prefix):].strip()
+    return t
+
+
+def _texto_no_encontrada(ciudad: str) -> str:
+    """Respuesta cuando no hay ciudad; con sugerencias del nomenclátor si se parece a alguna."""
+    parecidas = nomenclator.parecidas(ciudad)
+    if parecidas:
+        opciones = ', '.join(f'{u.nombre_local} ({u.pais})' for u in parecidas)
+        return f'No encontré "{ciudad}". ¿Quisiste decir {opciones}?'
+    return 'No encontré la ciudad. Prueba con otra o escribe más específica, p.ej. "Madrid, ES"'
+
+
+def _formatear_clima(ciudad: str, clima: Observacion) -> str:
+    return (
+        f'Clima en {ciudad}: {(clima.descripcion or "—").capitalize()}\n'
+        f'Temperatura: {o_raya(clima.temp)}°C (sensación térmica {o_raya(clima.sensacion)}°C)\n'
+        f'Humedad: {o_raya(clima.humedad)}%\n'
+        f'Vento: {texto_viento(clima.viento, clima.viento_deg)}'
+    )
+
+
+def texto_clima(ciudad: str, clima: Observacion, lat: float, lon: float) -> str:
+    """Respuesta del bot para `clima`, formateada una vez por ciudad y observación (`dt`)."""
+    clave = (ciudad, lat, lon, clima.dt)
+    if clave[3] is None:
+        return _formatear_clima(ciudad, clima)
+    texto = _textos.get(clave)
+    if texto is None:
+        texto = _textos[clave] = _formatear_clima(ciudad, clima)
+        if len(_textos) > MAX_TEXTOS:
+            _textos.popitem(last=False)
+    else:
+        _textos.move_to_end(clave)
+    return texto
+
+
+def _admision(context) -> Admision:
+    # `crear_aplicacion` la crea; los benchmarks llaman al handler con un contexto mínimo
+    return context.application.bot_data.setdefault('admision', Admision())
+
+
+async def _consultar_ciudad(owm: ClienteOWMAsync, ciudad: str):
+    """`(resultado, ubicacion, clima)` de `ciudad`; lo comparten los chats que la piden a la vez."""
+    try:
+        ubicacion = await owm.obtener_ubicacion(ciudad)
+    except ErrorOWM:
+        return 'error', None, None
+    if not ubicacion:
+        return 'no_encontrada', None, None
+    try:
+        clima = await owm.obtener_clima_hoy(ubicacion.lat, ubicacion.lon)
+    except ErrorOWM:
+        return 'error', ubicacion, None
+    return 'ok', ubicacion, clima
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    inicio = time.perf_counter()
+    resultado = 'excepcion'
+    try:
+        resultado = await _responder_clima(update, context)
+    finally:
+        metricas.latencia_peticion.observar(time.perf_counter() - inicio, tipo='mensaje', resultado=resultado)
+
+
+async def _responder_clima(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+    """Responde al mensaje; devuelve el resultado para las métricas."""
     text = update.message.text if update.message and update.message.text else None
     if not text:
         await update.message.reply_text('Sólo puedo procesar texto con el nombre de la ciudad.')
-        return
+        return 'sin_texto'
 
     ciudad = parse_ciudad(text)
     if not ciudad:
         await update.message.reply_text('Dime la ciudad, por ejemplo: Madrid')
-        return
+        return 'sin_ciudad'
 
-    await update.message.reply_text(f'Buscando clima para "{ciudad}"...')
+    admision = _admision(context)
+    chat = update.effective_chat.id if getattr(update, 'effective_chat', None) else None
+    espera = admision.admitir(chat)
+    if espera:
+        if admision.avisar(chat):
+            await update.message.reply_text(f'Vas muy rápido: prueba otra vez en {math.ceil(espera)} s.')
+        return 'limitado'
 
-    coords = obtener_coordenadas_simple(ciudad)
-    if not coords:
-        await update.message.reply_text('No encontré la ciudad. Prueba con otra o escribe más específica, p.ej. "Madrid, ES"')
-        return
-
-    lat, lon = coords
-    clima = obtener_clima_hoy_simple(lat, lon)
-    if not clima:
+    # Misma clave que la caché de geocodificación: 'Madrid' y ' madrid' son la misma consulta
+    clave = geocodificacion.normalizar_consulta(ciudad)
+    if admision.recordada(clave) is None:
+        await update.message.reply_text(f'Buscando clima para "{ciudad}"...')
+    owm = context.application.bot_data['owm']
+    (resultado, ubicacion, clima), _ = await admision.resolver(
+        clave, lambda: _consultar_ciudad(owm, ciudad), recordar=lambda r: r[0] == 'ok')
+    if resultado == 'no_encontrada':
+        await update.message.reply_text(_texto_no_encontrada(ciudad))
+        return resultado
+    precalentado.registrar(ubicacion)  # cada mensaje cuenta, aunque no haya llamado a la API
+    if resultado == 'error':
         await update.message.reply_text('Error al obtener datos del clima.')
-        return
+        return resultado
+
+    resp = texto_clima(ciudad, clima, ubicacion.lat, ubicacion.lon)
+    await update.message.reply_text(resp)
+    return 'ok'
 
-    desc = clima.get('weather', [{}])[0].get('description', '—').capitalize()
-    temp = clima.get('main', {}).get('temp', '—')
-    feels = clima.get('main', {}).get('feels_like', '—')
-    hum = clima.get('main', {}).get('humidity', '—')
-    wind = clima.get('wind', {})
-    wind_s = wind.get('speed', '—')
-    wind_deg = wind.get('deg', '—')
-
-    # Formatear viento con flecha/etiqueta si hay grado disponible
-    arrow, label, deg_val = deg_to_arrow(wind_deg)
-    if deg_val == '—':
-        viento_text = f"{wind_s} m/s"
-    else:
-        viento_text = f"{wind_s} m/s {arrow} {int(deg_val)}° ({label})"
 
-    resp = (
-        f'Clima en {ciudad}: {desc}\n'
-        f'Temperatura: {temp}°C (sensación térmica {feels}°C)\n'
-        f'Humedad: {hum}%\n'
-        f'Vento: {viento_text}'
+def crear_aplicacion(token: str = BOT_TOKEN) -> Application:
+    def owm_saturado():
+        owm = app.bot_data.get('owm')
+        return owm is not None and owm.saturado
+
+    cola = ColaConContrapresion(WORKERS + COLA_MAXIMA, WORKERS, saturado=owm_saturado)
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .update_queue(cola)
+        .concurrent_updates(WORKERS)
+        .post_init(_iniciar_cliente)
+        .post_shutdown(_cerrar_cliente)
     )
+    if TELEGRAM_BASE_URL:
+        builder = builder.base_url(TELEGRAM_BASE_URL)
+    app = builder.build()
+    app.bot_data['admision'] = admision = Admision()
+    app.add_handler(CommandHandler('start', start))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
-    await update.message.reply_text(resp)
+    @metricas.registro.colector
+    def _colector():
+        owm = app.bot_data.get('owm')
+        yield ('bot_updates_pendientes', 'gauge', 'Updates aceptados y aún sin terminar', [({}, cola.pendientes)])
+        yield ('bot_contrapresion_esperas_total', 'counter', 'Updates que esperaron hueco en la cola',
+               [({}, cola.esperas)])
+        yield ('bot_contrapresion_segundos_total', 'counter', 'Tiempo total esperando hueco en la cola',
+               [({}, cola.tiempo_espera)])
+        yield ('owm_peticiones_en_espera', 'gauge', 'Peticiones del bot esperando conexión libre',
+               [({}, owm.en_espera if owm else 0)])
+        yield ('bot_consultas_en_curso', 'gauge', 'Ciudades consultándose ahora (una por ciudad)',
+               [({}, admision.en_curso)])
+        yield ('bot_consultas_en_espera', 'gauge', 'Consultas esperando el límite global',
+               [({}, admision.en_espera)])
+        yield ('bot_respuestas_recordadas', 'gauge', 'Ciudades consultadas hace poco que se responden al instante',
+               [({}, len(admision))])
+
+    return app
+
+
+def _ejecutar_webhook(app: Application):
+    # El proxy inverso termina TLS y reenvía la misma ruta al puerto local
+    ruta = os.getenv('WEBHOOK_RUTA', urlparse(WEBHOOK_URL).path.strip('/'))
+    print(f'Bot arrancando (webhook {WEBHOOK_URL} -> {WEBHOOK_ESCUCHA}:{WEBHOOK_PUERTO}/{ruta}, '
+          f'{WORKERS} workers). Ctrl-C para parar.')
+    app.run_webhook(
+        listen=WEBHOOK_ESCUCHA,
+        port=WEBHOOK_PUERTO,
+        url_path=ruta,
+        webhook_url=WEBHOOK_URL,
+        secret_token=WEBHOOK_SECRETO,
+        max_connections=WEBHOOK_MAX_CONEXIONES,
+    )
 
 
 def main():
@@ -119,11 +288,22 @@ def main():
         print('Pone `API_KEY` (OpenWeatherMap) en el archivo .env antes de ejecutar este script.')
         return
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
-    app.add_handler(CommandHandler('start', start))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    app = crear_aplicacion()
+    if metricas.iniciar_servidor(METRICAS_PUERTO):
+        print(f'Métricas en http://127.0.0.1:{METRICAS_PUERTO}/metrics')
+
+    # Al recibir SIGINT/SIGTERM, PTB deja de aceptar updates, espera a que terminen los
+    # que están en curso y luego `post_shutdown` cierra el cliente de OWM.
+    if BOT_MODO == 'webhook':
+        if not WEBHOOK_URL:
+            print('BOT_MODO=webhook necesita `WEBHOOK_URL`; uso polling.')
+        elif importlib.util.find_spec('tornado') is None:
+            print('El webhook necesita `pip install "python-telegram-bot[webhooks]"`; uso polling.')
+        else:
+            _ejecutar_webhook(app)
+            return
 
-    print('Bot arrancando (polling). Ctrl-C para parar.')
+    print(f'Bot arrancando (polling, {WORKERS} workers). Ctrl-C para parar.')
     app.run_polling()
 
 
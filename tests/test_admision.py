@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from admision import Admision
+
+
+def test_la_misma_ciudad_en_vuelo_se_consulta_una_vez():
+    control = Admision(memoria=0)
+    llamadas = []
+
+    async def consultar():
+        llamadas.append(1)
+        await asyncio.sleep(0.05)
+        return 'Madrid'
+
+    async def main():
+        return await asyncio.gather(*(control.resolver('madrid', consultar) for _ in range(10)))
+
+    resultados = asyncio.run(main())
+    assert len(llamadas) == 1
+    assert sorted(origen for _, origen in resultados) == ['compartida'] * 9 + ['consulta']
+    assert {resultado for resultado, _ in resultados} == {'Madrid'}
+    assert control.en_curso == 0
+
+
+def test_ciudades_distintas_no_se_comparten():
+    control = Admision(memoria=0)
+    llamadas = []
+
+    def consulta(ciudad):
+        async def consultar():
+            llamadas.append(ciudad)
+            await asyncio.sleep(0.01)
+            return ciudad
+        return consultar
+
+    async def main():
+        return await asyncio.gather(*(control.resolver(c, consulta(c)) for c in ('madrid', 'lima', 'roma')))
+
+    assert [r for r, _ in asyncio.run(main())] == ['madrid', 'lima', 'roma']
+    assert sorted(llamadas) == ['lima', 'madrid', 'roma']
+
+
+def test_el_error_llega_a_todos_los_que_esperan_y_no_se_recuerda():
+    control = Admision()
+    llamadas = []
+
+    async def falla():
+        llamadas.append(1)
+        await asyncio.sleep(0.01)
+        raise ConnectionError('sin red')
+
+    async def main():
+        return await asyncio.gather(*(control.resolver('madrid', falla) for _ in range(3)),
+                                    return_exceptions=True)
+
+    errores = asyncio.run(main())
+    assert len(llamadas) == 1
+    assert all(isinstance(e, ConnectionError) for e in errores)
+    assert control.recordada('madrid') is None
+
+
+def test_lo_consultado_se_recuerda_si_se_pide():
+    control = Admision(memoria=60)
+
+    async def consultar():
+        return None  # p.ej. ciudad no encontrada
+
+    async def main():
+        await control.resolver('atlantida', consultar, recordar=lambda r: r is not None)
+        await control.resolver('madrid', lambda: asyncio.sleep(0, 'Madrid'))
+        return await control.resolver('madrid', consultar)
+
+    assert asyncio.run(main()) == ('Madrid', 'memoria')
+    assert control.recordada('atlantida') is None
+
+
+@pytest.mark.parametrize('mensajes, limitados', [(4, 0), (6, 2)])
+def test_limite_por_chat(mensajes, limitados):
+    control = Admision(por_minuto=12, rafaga=4)
+    esperas = [control.admitir(chat=1) for _ in range(mensajes)]
+    assert sum(1 for e in esperas if e > 0) == limitados
+    assert control.admitir(chat=2) == 0  # otro chat tiene su propio cubo
@@ -0,0 +1,66 @@
+import copy
+import json
+import os
+
+import pytest
+
+import agregacion
+from modelos import ResumenDia
+
+DATOS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'datos')
+
+
+@pytest.fixture(scope='module')
+def forecast():
+    with open(os.path.join(DATOS, 'forecast.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _variantes(forecast):
+    """La respuesta grabada y versiones con otra zona horaria y con campos que faltan."""
+    otra_zona = copy.deepcopy(forecast)
+    otra_zona['city']['timezone'] = -5 * 3600
+    incompleta = copy.deepcopy(forecast)
+    for i, it in enumerate(incompleta['list']):
+        if i % 3 == 0:
+            it.pop('wind', None)
+        if i % 4 == 0:
+            it.pop('weather', None)
+        if i % 5 == 0:
+            it['rain'] = {'3h': 0.4}
+        if i % 7 == 0:
+            it['wind'] = dict(it.get('wind') or {}, deg=0)
+    recortada = copy.deepcopy(forecast)
+    recortada['list'] = recortada['list'][5:17]
+    return [forecast, otra_zona, incompleta, recortada]
+
+
+def test_lote_igual_que_resumen_diario(forecast):
+    variantes = _variantes(forecast)
+    esperado = [agregacion.resumen_diario(f) for f in variantes]
+    assert agregacion.resumen_diario_lote(variantes) == esperado
+
+
+@pytest.mark.parametrize('max_days', [1, 3, 5])
+def test_lote_respeta_max_days(forecast, max_days):
+    variantes = _variantes(forecast)
+    esperado = [agregacion.resumen_diario(f, max_days) for f in variantes]
+    assert agregacion.resumen_diario_lote(variantes, max_days=max_days) == esperado
+
+
+def test_incremental_igual_que_resumen_diario(forecast):
+    for f in _variantes(forecast):
+        zona = f['city']['timezone']
+        assert agregacion.resumen_diario_incremental(f['list'], zona) == agregacion.resumen_diario(f)
+
+
+def test_incremental_desde_el_cuerpo(forecast):
+    city, slots = agregacion.leer_forecast(json.dumps(forecast).encode())
+    assert agregacion.resumen_diario_incremental(slots, city['timezone']) == agregacion.resumen_diario(forecast)
+
+
+def test_dias_incremental_son_los_del_resumen(forecast):
+    for f in _variantes(forecast):
+        zona = f['city']['timezone']
+        dias = [ResumenDia(*dia) for dia in agregacion.dias_incremental(f['list'], zona)]
+        assert dias == [ResumenDia.desde_owm(dia) for dia in agregacion.resumen_diario(f)]
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from cache_clima import CacheClima
+from cache_compartida import BackendMemoria
+
+
+@pytest.fixture
+def cache():
+    return CacheClima(backend=BackendMemoria())
+
+
+def _caducar(cache, endpoint, lat, lon):
+    """Deja la entrada fuera de su TTL pero dentro del margen de dato viejo."""
+    clave = cache.clave(endpoint, lat, lon)
+    valor, _, servible_hasta = cache._local.leer(clave)
+    cache._local.guardar(clave, valor, time.time() - 1, servible_hasta)
+
+
+def test_misses_simultaneos_hacen_una_llamada_sync(cache):
+    llamadas = []
+    barrera = threading.Barrier(8)
+
+    def cargar():
+        llamadas.append(1)
+        time.sleep(0.1)
+        return {'temp': 20}
+
+    def pedir(resultados):
+        barrera.wait()
+        resultados.append(cache.obtener('weather', 40.4168, -3.7038, cargar))
+
+    resultados = []
+    hilos = [threading.Thread(target=pedir, args=(resultados,)) for _ in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert len(llamadas) == 1
+    assert resultados == [{'temp': 20}] * 8
+    assert cache.estadisticas()['llamadas_api'] == 1
+
+
+def test_misses_simultaneos_hacen_una_llamada_async(cache):
+    llamadas = []
+
+    async def cargar():
+        llamadas.append(1)
+        await asyncio.sleep(0.05)
+        return {'temp': 20}
+
+    async def main():
+        # Coordenadas distintas que caen en la misma clave (2 decimales)
+        return await asyncio.gather(*(cache.obtener_async('weather', 40.4168 + i * 1e-4, -3.7038, cargar)
+                                      for i in range(10)))
+
+    assert asyncio.run(main()) == [{'temp': 20}] * 10
+    assert len(llamadas) == 1
+    assert cache.coalescidas == 9
+
+
+def test_caducada_se_sirve_y_se_refresca_una_vez_sync(cache):
+    cache.obtener('weather', 40.42, -3.70, lambda: {'temp': 20})
+    _caducar(cache, 'weather', 40.42, -3.70)
+    llamadas = []
+    listo = threading.Event()
+
+    def cargar():
+        llamadas.append(1)
+        listo.wait(2)
+        return {'temp': 25}
+
+    servidos = [cache.obtener('weather', 40.42, -3.70, cargar) for _ in range(5)]
+    assert servidos == [{'temp': 20}] * 5  # el viejo, sin esperar al refresco
+    listo.set()
+    cache._refresco.shutdown(wait=True)
+    assert len(llamadas) == 1
+    assert cache.obtener('weather', 40.42, -3.70, cargar) == {'temp': 25}
+    assert cache.refrescos == 1
+
+
+def test_caducada_se_refresca_una_vez_async(cache):
+    llamadas = []
+
+    async def cargar():
+        llamadas.append(1)
+        await asyncio.sleep(0.05)
+        return {'temp': len(llamadas)}
+
+    async def main():
+        await cache.obtener_async('weather', 40.42, -3.70, cargar)
+        _caducar(cache, 'weather', 40.42, -3.70)
+        servidos = await asyncio.gather(*(cache.obtener_async('weather', 40.42, -3.70, cargar)
+                                          for _ in range(5)))
+        await cache.esperar_refrescos()
+        return servidos, await cache.obtener_async('weather', 40.42, -3.70, cargar)
+
+    servidos, despues = asyncio.run(main())
+    assert servidos == [{'temp': 1}] * 5
+    assert despues == {'temp': 2}
+    assert len(llamadas) == 2  # la carga inicial y un solo refresco
+
+
+def test_fallo_no_se_cachea(cache):
+    def falla():
+        raise RuntimeError('sin red')
+
+    with pytest.raises(RuntimeError):
+        cache.obtener('weather', 40.42, -3.70, falla)
+    assert cache.obtener('weather', 40.42, -3.70, lambda: {'temp': 20}) == {'temp': 20}
+    assert cache.estadisticas()['llamadas_api'] == 1
@@ -0,0 +1,45 @@
+import pytest
+
+import nomenclator
+
+
+@pytest.fixture(scope='module')
+def n(tmp_path_factory):
+    directorio = str(tmp_path_factory.mktemp('nomenclator'))
+    nomenclator.construir(nomenclator.FUENTE, directorio)
+    return nomenclator.Nomenclator(directorio)
+
+
+@pytest.mark.parametrize('consulta, esperada', [
+    ('Madrid', ('Madrid', 'ES')),
+    ('  MADRID, es ', ('Madrid', 'ES')),
+    ('cordoba', ('Córdoba', 'ES')),
+    ('Córdoba, AR', ('Córdoba', 'AR')),
+    ('Москва', ('Moscú', 'RU')),
+])
+def test_buscar_resuelve_lo_exacto(n, consulta, esperada):
+    u = n.buscar(consulta)
+    assert (u.nombre_local, u.pais) == esperada
+
+
+@pytest.mark.parametrize('consulta', ['Parma', 'Burgas', 'Palmas', 'Barclona', 'San', 'Madr',
+                                      'Kobe', 'Toul', 'Sevil'])
+def test_buscar_no_adivina_erratas_ni_prefijos(n, consulta):
+    # Pueden ser ciudades que no están en el nomenclátor: las resuelve OpenWeatherMap
+    assert n.buscar(consulta) is None
+
+
+@pytest.mark.parametrize('consulta, primera', [
+    ('Madird', 'Madrid'),
+    ('Barclona', 'Barcelona'),
+    ('Sevila', 'Sevilla'),
+    ('Burgas', 'Burgos'),
+    ('Sevil', 'Sevilla'),  # los prefijos sólo se proponen
+    ('Toul', 'Toulouse'),
+])
+def test_parecidas_la_mas_cercana_primero(n, consulta, primera):
+    assert n.parecidas(consulta)[0].nombre_local == primera
+
+
+def test_parecidas_respeta_el_pais(n):
+    assert all(u.pais == 'AR' for u in n.parecidas('Cordova, AR'))
@@ -0,0 +1,361 @@
+"""Capa de transporte HTTP común a todos los fetchers de OpenWeatherMap.
+
+- Una `requests.Session` con pool keep-alive compartida por el dashboard (y otra
+  `httpx.AsyncClient` por event loop en el bot, ver `owm_async.py`).
+- Timeouts uniformes de conexión y lectura.
+- Reintentos con backoff exponencial con jitter (tenacity) ante errores de red,
+  429 y 5xx, respetando `Retry-After`.
+- Limitador token-bucket del lado cliente, dimensionado al plan de OWM: las ráfagas
+  esperan turno en vez de fallar con 429. Con un backend compartido de
+  `cache_compartida` el presupuesto es uno para todos los procesos.
+- Métricas por endpoint que separan tiempo de conexión, espera y transferencia.
+"""
+import asyncio
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from tenacity import (AsyncRetrying, Retrying, retry_if_exception_type, retry_if_result,
+                      stop_after_attempt, wait_random_exponential)
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import cache_compartida
+from metricas import bytes_owm, latencia_owm, peticiones_owm, registro
+
+OWM_BASE_URL = os.getenv('OWM_BASE_URL', 'https://api.openweathermap.org').rstrip('/')
+
+TIMEOUT_CONEXION = float(os.getenv('OWM_TIMEOUT_CONEXION', 5))
+TIMEOUT_LECTURA = float(os.getenv('OWM_TIMEOUT_LECTURA', 10))
+TIMEOUT = (TIMEOUT_CONEXION, TIMEOUT_LECTURA)
+
+# Plan gratuito: 60 llamadas/minuto. La ráfaga sale de ese mismo presupuesto: el cubo se
+# rellena a (plan - ráfaga) por minuto, así en ningún minuto se pasa del plan
+LLAMADAS_POR_MINUTO = float(os.getenv('OWM_LLAMADAS_MINUTO', 60))
+RAFAGA = float(os.getenv('OWM_RAFAGA', 10))
+# Si para conseguir turno habría que esperar más que esto, se falla en vez de encolar
+ESPERA_MAXIMA = float(os.getenv('OWM_ESPERA_MAXIMA', 30))
+
+INTENTOS = int(os.getenv('OWM_INTENTOS', 3))
+STATUS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+
+def url_owm(ruta: str) -> str:
+    """URL completa de un endpoint de OWM ('/data/2.5/weather' -> 'https://...')."""
+    return f'{OWM_BASE_URL}{ruta}'
+
+
+class LimiteLlamadasExcedido(requests.RequestException):
+    """La cola del limitador supera `ESPERA_MAXIMA`: mejor fallar rápido que colgar la UI."""
+
+
+class LimitadorTokens:
+    """Token bucket compartido por hilos y corrutinas.
+
+    `reservar()` descuenta un token (el saldo puede quedar negativo: eso es la cola)
+    y devuelve cuánto hay que esperar; cada llamador duerme a su manera
+    (`time.sleep` o `asyncio.sleep`), así un mismo limitador sirve para ambos mundos.
+
+    Caben `rafaga` llamadas seguidas y el cubo se rellena a `por_minuto - rafaga` por
+    minuto: en cualquier ventana de 60 s no salen más de `por_minuto`. Sin `backend`
+    el presupuesto es de este proceso; con un backend compartido de `cache_compartida`
+    (ver `BackendSQLite.gastar`) lo reparten todos los procesos que usan `clave`.
+    """
+
+    def __init__(self, por_minuto: float = LLAMADAS_POR_MINUTO, rafaga: float = RAFAGA,
+                 espera_maxima: float = ESPERA_MAXIMA, backend=None, clave: str = 'owm'):
+        # La ráfaga nunca se come todo el plan (p.ej. OWM_RAFAGA=OWM_LLAMADAS_MINUTO)
+        self.capacidad = max(min(rafaga, por_minuto / 2), 1.0)
+        self.tasa = max(por_minuto - self.capacidad, 1.0) / 60.0
+        self.espera_maxima = espera_maxima
+        self.backend = backend
+        self.clave = clave
+        self._tokens = self.capacidad
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+        self.esperas = 0
+        self.tiempo_esperado = 0.0
+        self.rechazadas = 0
+
+    def _gastar_local(self):
+        with self._lock:
+            ahora = time.monotonic()
+            self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+            self._ultimo = ahora
+            espera = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.tasa
+            if espera > self.espera_maxima:
+                return espera, False
+            self._tokens -= 1
+            return espera, True
+
+    def reservar(self) -> float:
+        resultado = None
+        if self.backend is not None:
+            resultado = self.backend.gastar(self.clave, self.tasa, self.capacidad, self.espera_maxima)
+        # Si el backend no responde, cada proceso se limita solo
+        espera, concedida = resultado if resultado is not None else self._gastar_local()
+        with self._lock:
+            if not concedida:
+                self.rechazadas += 1
+                raise LimiteLlamadasExcedido(
+                    f'Demasiadas peticiones a OpenWeatherMap; habría que esperar {espera:.0f}s')
+            if espera:
+                self.esperas += 1
+                self.tiempo_esperado += espera
+        return espera
+
+    def adquirir(self):
+        espera = self.reservar()
+        if espera:
+            time.sleep(espera)
+
+    async def adquirir_async(self):
+        if self.backend is not None:
+            espera = await asyncio.to_thread(self.reservar)  # el backend es SQLite o Redis
+        else:
+            espera = self.reservar()
+        if espera:
+            await asyncio.sleep(espera)
+
+
+class Metricas:
+    """Contadores y tiempos acumulados por endpoint (ruta de la URL)."""
+
+    CAMPOS = ('peticiones', 'reintentos', 'errores', 'status_429', 'conexiones_nuevas',
+              't_limitador', 't_conexion', 't_espera', 't_transferencia')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._datos = {}
+
+    def sumar(self, endpoint: str, **valores):
+        with self._lock:
+            fila = self._datos.setdefault(endpoint, dict.fromkeys(self.CAMPOS, 0))
+            for campo, valor in valores.items():
+                fila[campo] += valor
+
+    def estadisticas(self) -> dict:
+        """Por endpoint: contadores y tiempos medios (ms) de conexión/espera/transferencia."""
+        with self._lock:
+            resultado = {}
+            for endpoint, fila in self._datos.items():
+                n = fila['peticiones'] or 1
+                resultado[endpoint] = dict(
+                    fila,
+                    ms_conexion_media=round(1000 * fila['t_conexion'] / n, 2),
+                    ms_espera_media=round(1000 * fila['t_espera'] / n, 2),
+                    ms_transferencia_media=round(1000 * fila['t_transferencia'] / n, 2),
+                )
+            return resultado
+
+    def reiniciar(self):
+        with self._lock:
+            self._datos.clear()
+
+
+limitador = LimitadorTokens(backend=cache_compartida.backend if cache_compartida.backend.compartido else None)
+metricas = Metricas()
+
+
+# --- Medición del tiempo de conexión (TCP + TLS) en urllib3 ---
+
+_local = threading.local()
+
+
+def _medir_conexion(connect):
+    def medido(self):
+        inicio = time.perf_counter()
+        try:
+            return connect(self)
+        finally:
+            _local.t_conexion = getattr(_local, 't_conexion', 0.0) + time.perf_counter() - inicio
+            _local.conexiones = getattr(_local, 'conexiones', 0) + 1
+    return medido
+
+
+class _ConexionHTTP(HTTPConnection):
+    connect = _medir_conexion(HTTPConnection.connect)
+
+
+class _ConexionHTTPS(HTTPSConnection):
+    connect = _medir_conexion(HTTPSConnection.connect)
+
+
+class _PoolHTTP(HTTPConnectionPool):
+    ConnectionCls = _ConexionHTTP
+
+
+class _PoolHTTPS(HTTPSConnectionPool):
+    ConnectionCls = _ConexionHTTPS
+
+
+class _AdaptadorMedido(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _PoolHTTP, 'https': _PoolHTTPS}
+
+
+def _crear_sesion() -> requests.Session:
+    sesion = requests.Session()
+    adaptador = _AdaptadorMedido(pool_connections=4, pool_maxsize=32)
+    sesion.mount('http://', adaptador)
+    sesion.mount('https://', adaptador)
+    return sesion
+
+
+sesion = _crear_sesion()
+
+
+# --- Reintentos ---
+
+def _reintentable(resp) -> bool:
+    return getattr(resp, 'status_code', None) in STATUS_REINTENTABLES
+
+
+class _EsperaRetryAfter(wait_random_exponential):
+    """Backoff exponencial con jitter, pero nunca menos de lo que pida `Retry-After`."""
+
+    def __call__(self, retry_state):
+        espera = super().__call__(retry_state)
+        resultado = retry_state.outcome
+        if resultado is not None and not resultado.failed:
+            cabecera = resultado.result().headers.get('Retry-After')
+            try:
+                espera = max(espera, min(float(cabecera), self.max))
+            except (TypeError, ValueError):
+                pass
+        return espera
+
+
+def _politica(excepciones, **kwargs):
+    return dict(
+        stop=stop_after_attempt(INTENTOS),
+        wait=_EsperaRetryAfter(multiplier=0.5, max=8),
+        retry=retry_if_exception_type(excepciones) | retry_if_result(_reintentable),
+        retry_error_callback=lambda estado: estado.outcome.result(),  # devolver la última respuesta
+        reraise=True,
+        **kwargs,
+    )
+
+
+def _observar(endpoint, status, segundos, tamano):
+    peticiones_owm.inc(endpoint=endpoint, status=status)
+    latencia_owm.observar(segundos, endpoint=endpoint)
+    bytes_owm.observar(tamano, endpoint=endpoint)
+
+
+@registro.colector
+def _colector():
+    datos = metricas.estadisticas()
+    yield ('owm_reintentos_total', 'counter', 'Reintentos tras error de red, 429 o 5xx',
+           [({'endpoint': e}, f['reintentos']) for e, f in datos.items()])
+    yield ('owm_conexiones_nuevas_total', 'counter', 'Conexiones TCP/TLS abiertas (el resto reutiliza el pool)',
+           [({'endpoint': e}, f['conexiones_nuevas']) for e, f in datos.items()])
+    yield ('owm_tiempo_segundos_total', 'counter', 'Tiempo acumulado por fase de la petición',
+           [({'endpoint': e, 'fase': fase}, f[f't_{fase}'])
+            for e, f in datos.items() for fase in ('limitador', 'conexion', 'espera', 'transferencia')])
+    yield ('owm_limitador_esperas_total', 'counter', 'Peticiones que esperaron turno en el limitador',
+           [({}, limitador.esperas)])
+    yield ('owm_limitador_rechazadas_total', 'counter', 'Peticiones rechazadas por cola demasiado larga',
+           [({}, limitador.rechazadas)])
+
+
+def _endpoint(url: str) -> str:
+    return urlparse(url).path or '/'
+
+
+# --- API síncrona (dashboard, geocodificación) ---
+
+def _get_una_vez(url, params, timeout, endpoint):
+    inicio = time.perf_counter()
+    limitador.adquirir()
+    t_limitador = time.perf_counter() - inicio
+
+    _local.t_conexion = 0.0
+    _local.conexiones = 0
+    inicio = time.perf_counter()
+    try:
+        resp = sesion.get(url, params=params, timeout=timeout)
+    except requests.RequestException:
+        metricas.sumar(endpoint, peticiones=1, errores=1, t_limitador=t_limitador,
+                       t_conexion=_local.t_conexion, conexiones_nuevas=_local.conexiones)
+        peticiones_owm.inc(endpoint=endpoint, status='error')
+        raise
+    total = time.perf_counter() - inicio
+    _observar(endpoint, resp.status_code, total, len(resp.content))
+    # `elapsed` llega hasta las cabeceras (incluye conexión); el resto es el cuerpo
+    hasta_cabeceras = min(resp.elapsed.total_seconds(), total)
+    metricas.sumar(
+        endpoint, peticiones=1, t_limitador=t_limitador,
+        status_429=int(resp.status_code == 429), errores=int(resp.status_code >= 500),
+        conexiones_nuevas=_local.conexiones, t_conexion=_local.t_conexion,
+        t_espera=max(hasta_cabeceras - _local.t_conexion, 0.0),
+        t_transferencia=total - hasta_cabeceras,
+    )
+    return resp
+
+
+def get(url: str, params: dict = None, timeout=TIMEOUT) -> requests.Response:
+    """GET con pool, limitador y reintentos. Devuelve la última respuesta (aunque sea
+    un 429/5xx tras agotar los intentos) o propaga el último error de red."""
+    endpoint = _endpoint(url)
+
+    def antes_de_dormir(estado):
+        metricas.sumar(endpoint, reintentos=1)
+
+    reintentar = Retrying(**_politica((requests.ConnectionError, requests.Timeout),
+                                      before_sleep=antes_de_dormir))
+    return reintentar(_get_una_vez, url, params, timeout, endpoint)
+
+
+# --- API asíncrona (bot) ---
+
+async def _get_una_vez_async(client, url, params, timeout, endpoint):
+    import httpx  # sólo lo usa el camino asíncrono; el dashboard no lo carga al arrancar
+
+    inicio = time.perf_counter()
+    await limitador.adquirir_async()
+    t_limitador = time.perf_counter() - inicio
+
+    marcas = {}
+
+    async def traza(evento, info):
+        marcas[evento] = time.perf_counter()
+
+    inicio = time.perf_counter()
+    try:
+        resp = await client.get(url, params=params, timeout=timeout, extensions={'trace': traza})
+    except httpx.HTTPError:
+        metricas.sumar(endpoint, peticiones=1, errores=1, t_limitador=t_limitador)
+        peticiones_owm.inc(endpoint=endpoint, status='error')
+        raise
+    fin = time.perf_counter()
+    _observar(endpoint, resp.status_code, fin - inicio, len(resp.content))
+    t_conexion = 0.0
+    if 'connection.connect_tcp.started' in marcas:
+        fin_conexion = marcas.get('connection.start_tls.complete') or marcas.get('connection.connect_tcp.complete', inicio)
+        t_conexion = fin_conexion - marcas['connection.connect_tcp.started']
+    cuerpo = marcas.get('http11.receive_response_body.started') or marcas.get('http2.receive_response_body.started') or fin
+    metricas.sumar(
+        endpoint, peticiones=1, t_limitador=t_limitador,
+        status_429=int(resp.status_code == 429), errores=int(resp.status_code >= 500),
+        conexiones_nuevas=int('connection.connect_tcp.started' in marcas), t_conexion=t_conexion,
+        t_espera=max(cuerpo - inicio - t_conexion, 0.0), t_transferencia=fin - cuerpo,
+    )
+    return resp
+
+
+async def get_async(client, url: str, params: dict = None, timeout=TIMEOUT_LECTURA):
+    """Como `get` pero sobre un `httpx.AsyncClient`; comparte limitador y métricas."""
+    import httpx
+
+    endpoint = _endpoint(url)
+
+    def antes_de_dormir(estado):
+        metricas.sumar(endpoint, reintentos=1)
+
+    reintentar = AsyncRetrying(**_politica((httpx.TransportError,), before_sleep=antes_de_dormir))
+    return await reintentar(_get_una_vez_async, client, url, params, timeout, endpoint)